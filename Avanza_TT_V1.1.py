@@ -2,8 +2,8 @@
 Created by Alexey.Klechikov@gmail.com
 
 Install with:
-* Windows - pyinstaller --onefile --noconsole -i"C:\icon.ico" --add-data C:\icon.ico;images C:\Avanza_TT_V1.1.py
-* MacOS - sudo pyinstaller --onefile --windowed Avanza_TT_V1.1.py
+* Windows - pyinstaller --onefile --noconsole -i"C:\icon.ico" --add-data C:\icon.ico;images --hidden-import pandas --hidden-import h5py --hidden-import requests C:\Avanza_TT_V1.1.py
+* MacOS - sudo pyinstaller --onefile --windowed --hidden-import pandas --hidden-import h5py --hidden-import requests Avanza_TT_V1.1.py
 
 Requirements for a nice interface:
 * PyQt<=5.12.2
@@ -11,67 +11,164 @@ Requirements for a nice interface:
 
 # import pkg_resources.py2_warn ## This is somehow required if I am "pyinstalling" in windows 10
 
-from PyQt5 import QtCore, QtGui, QtWidgets, QtTest
-import os, platform, sys, pkgutil, datetime, threading, h5py, requests, json
+from PyQt5 import QtCore, QtGui, QtWidgets
+import os, platform, sys, pkgutil, datetime, functools, time
 import pyqtgraph as pg
 import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
-from win10toast import ToastNotifier
+from Avanza_TT_core import Ticker, Schema, Portfolios, InstrumentSearch, Alerts
 
 QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
 QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True)
 
-pd.set_option("display.max_rows", 2000, "display.max_columns", 2000)
-
-''' Each ticker has some info, here we select only what we will use in this program '''
-class Ticker:
-    def __init__(self, tickerNumber, count, proxies):
-
-        self.ticker = requests.get('https://www.avanza.se/_mobile/market/{0:s}/{1:d}'.format("stock", int(tickerNumber)), proxies=proxies).json()
-
-        self.number = tickerNumber
-        self.name = self.ticker['name']
-        self.changePercent = self.ticker['changePercent']
-        self.price_last = self.ticker['lastPrice']
-        date = datetime.strptime(self.ticker['lastPriceUpdated'][:19], "%Y-%m-%dT%H:%M:%S")
-        self.price_updateTime = date.strftime("%m/%d, %H:%M")
-        self.count = count
-        self.country = self.ticker['flagCode']
-        self.currency = self.ticker['currency']
-
-        # Some info is not presented in every ticker
-        if 'keyRatios' in self.ticker:
-            self.peRatio = np.NaN if 'priceEarningsRatio' not in self.ticker['keyRatios'] else self.ticker['keyRatios']['priceEarningsRatio']
-            self.volatility = np.NaN if 'volatility' not in self.ticker['keyRatios'] else self.ticker['keyRatios']['volatility']
-            self.directYield = np.NaN if 'directYield' not in self.ticker['keyRatios'] else self.ticker['keyRatios']['directYield']
-        else: self.peRatio, self.volatility, self.directYield = np.NaN, np.NaN, np.NaN
-
-        if 'company' in self.ticker: self.sector = np.NaN if 'sector' not in self.ticker['company'] else self.ticker['company']['sector']
-        else: self.sector = np.NaN
-
-        self.dividends = self.ticker["dividends"] if "dividends" in self.ticker else []
-        self.reports = self.ticker["companyReports"] if "companyReports" in self.ticker else []
-        self.price_oneWeek = self.ticker["priceOneWeekAgo"] if "priceOneWeekAgo" in self.ticker else np.NaN
-        self.price_oneMonth = self.ticker["priceOneMonthAgo"] if "priceOneMonthAgo" in self.ticker else np.NaN
-        self.price_sixMonth = self.ticker["priceSixMonthsAgo"] if "priceSixMonthsAgo" in self.ticker else np.NaN
-        self.price_oneYear = self.ticker["priceOneYearAgo"] if "priceOneYearAgo" in self.ticker else np.NaN
-
-        # Chartdata
-        p, h = { "orderbookId": tickerNumber, "chartType": 'AREA', "chartResolution": 'DAY', "timePeriod": 'three_years'},  {"Content-Type": "application/json"}
-        r = requests.post('https://www.avanza.se/ab/component/highstockchart/getchart/orderbook', data=json.dumps(p), headers=h, proxies=proxies).json()
-        if 'dataPoints' in r:
-            dataSeries = r['dataPoints']
-            for x in dataSeries:
-                x[0] = datetime.fromtimestamp(x[0] / 1000).isoformat()
-            self.chartdata = pd.read_json(json.dumps(dataSeries))
-            self.chartdata.columns = ['Date', 'Price']
-            self.chartdata = self.chartdata.loc[pd.notnull(self.chartdata.Price)]
-
-''' __For TimeAxis plotting__ '''
+@functools.lru_cache(maxsize=None)
+def f_iconPath():
+    ''' When we create .exe with pyinstaller, we need to store icon inside it. Then we find it inside unpacked temp directory (once, walking the importers is slow) '''
+    iconpath = ""
+    for i in pkgutil.iter_importers():
+        path = str(i).split("'")[1].replace("\\\\", "\\") if str(i).find('FileFinder') >= 0 else None
+        if path != None: iconpath = path + "\\images\\icon.ico"
+    return iconpath
+
+''' __For TimeAxis plotting__ (x values are seconds since 1970) '''
 class TimeAxisItem(pg.AxisItem):
-    def f_tickStrings(self, values, scale, spacing):
-        return [datetime.fromtimestamp(value).date() for value in values]
+    def tickStrings(self, values, scale, spacing):
+        # Time of the day is shown if the ticks are less than a day apart (intraday data or a zoomed in graph)
+        form = "%Y-%m-%d" if spacing >= 86400 else "%m-%d %H:%M"
+
+        strings = []
+        for value in values:
+            try: strings.append(datetime.fromtimestamp(value * scale).strftime(form))
+            except (ValueError, OverflowError, OSError): strings.append("")
+        return strings
+
+    @staticmethod
+    def f_decimate(plot):
+        ''' Only the visible part of the curves is drawn, with at most a few points per pixel (min and max of every group, so peaks are kept) '''
+        plot.getPlotItem().setClipToView(True)
+        plot.getPlotItem().setDownsampling(auto=True, mode="peak")
+
+''' Main table: one numpy array per column. Refresh repaints only the cells which changed '''
+class PortfolioTableModel(QtCore.QAbstractTableModel):
+    columns = [("ID", 100), ("Name", 200), ("Country", 50), ("Updated", 80), ("P/E", 50), ("Change today", 90), ("Price (SEK)", 70), ("Amount", 60), ("Total value (SEK)", 100)]
+    sortRole = QtCore.Qt.UserRole
+
+    def __init__(self, parent=None):
+        super(PortfolioTableModel, self).__init__(parent)
+        self.store = self.f_store([], [])
+
+    @staticmethod
+    def f_store(tickers, amounts):
+        ''' Empty columns for the tickers ("Currency" - currency of price and total, "SEK" or ticker's currency if its rate is missing) '''
+        store = {"ID": np.array(tickers, dtype=np.int64), "Amount": np.array(amounts, dtype=np.int64)}
+        for name in ["Name", "Country", "Updated", "Currency"]: store[name] = np.full(len(tickers), "", dtype=object)
+        for name in ["P/E", "Change today", "Price (SEK)", "Total value (SEK)"]: store[name] = np.full(len(tickers), np.nan)
+        return store
+
+    @staticmethod
+    def f_changed(old, new):
+        ''' Mask of the rows with a new value (NaN == NaN) '''
+        if old.dtype.kind == "f": return ~((old == new) | (np.isnan(old) & np.isnan(new)))
+        return np.asarray(old != new, dtype=bool)
+
+    def f_setTickers(self, tickers):
+        ''' Rows for holdings {ID: amount} without data (before the refresh) '''
+        self.beginResetModel()
+        self.store = self.f_store(list(tickers), list(tickers.values()))
+        self.endResetModel()
+
+    def f_setRows(self, rows):
+        ''' Data of the refresh: [(ticker, price, total, currency), ...] '''
+
+        new = self.f_store([i[0].number for i in rows], [i[0].count for i in rows])
+        new["Name"][:], new["Country"][:], new["Updated"][:] = [str(i[0].name) for i in rows], [str(i[0].country) for i in rows], [str(i[0].price_updateTime) for i in rows]
+        new["P/E"][:], new["Change today"][:] = [i[0].peRatio for i in rows], [i[0].changePercent for i in rows]
+        new["Price (SEK)"][:], new["Total value (SEK)"][:], new["Currency"][:] = [i[1] for i in rows], [i[2] for i in rows], [i[3] for i in rows]
+
+        # Removed rows go away, added rows come at the end (order of the holdings). Otherwise the whole table is rebuilt
+        keep = np.isin(self.store["ID"], new["ID"])
+        if not np.array_equal(self.store["ID"][keep], new["ID"][:np.count_nonzero(keep)]):
+            self.beginResetModel()
+            self.store = new
+            self.endResetModel()
+            return
+
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], (~keep).astype(np.int8), [0]])))
+        for start, stop in reversed(list(zip(edges[::2], edges[1::2]))):
+            self.beginRemoveRows(QtCore.QModelIndex(), int(start), int(stop) - 1)
+            self.store = {name: np.delete(self.store[name], np.s_[start:stop]) for name in self.store}
+            self.endRemoveRows()
+
+        old, size = self.store, len(self.store["ID"])
+        if len(new["ID"]) > size:
+            self.beginInsertRows(QtCore.QModelIndex(), size, len(new["ID"]) - 1)
+            self.store = new
+            self.endInsertRows()
+
+        new, self.store = {name: new[name][:size] for name in new}, new
+        currencyChanged = self.f_changed(old["Currency"], new["Currency"])
+        for column, (name, _) in enumerate(self.columns):
+            changed = self.f_changed(old[name], new[name]) | (currencyChanged if name in ["Price (SEK)", "Total value (SEK)"] else False)
+
+            # One signal for every block of changed rows
+            edges = np.flatnonzero(np.diff(np.concatenate([[0], changed.astype(np.int8), [0]])))
+            for start, stop in zip(edges[::2], edges[1::2]): self.dataChanged.emit(self.index(int(start), column), self.index(int(stop) - 1, column))
+
+    def f_text(self, name, row):
+        value = self.store[name][row]
+        if name in ["ID", "Amount"]: return str(value)
+        if isinstance(value, str): return value
+        if np.isnan(value): return ""
+
+        currency = self.store["Currency"][row]
+        if name == "Price (SEK)": return str(round(value, 2)) + ("" if currency == "SEK" else " " + currency)
+        if name == "Total value (SEK)": return str(int(value)) if currency == "SEK" else str(round(value, 2)) + " " + currency
+        return str(value)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.store["ID"])
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid(): return None
+        name, row = self.columns[index.column()][0], index.row()
+
+        if role == QtCore.Qt.DisplayRole: return self.f_text(name, row)
+        if role == QtCore.Qt.TextAlignmentRole: return QtCore.Qt.AlignCenter
+        if role == self.sortRole:
+            # Numbers are sorted as numbers, empty cells go first
+            value = self.store[name][row]
+            return value if isinstance(value, str) else -np.inf if np.isnan(value) else value.item()
+        if role == QtCore.Qt.ForegroundRole:
+            # Color of the text ("Change today") is defined by its content. Black for other columns
+            value = self.store["Change today"][row]
+            if name == "Change today" and not np.isnan(value): return QtGui.QBrush(QtGui.QColor(255, 0, 0) if value < 0 else QtGui.QColor(0, 0, 255))
+            return QtGui.QBrush(QtGui.QColor(0, 0, 0))
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal: return self.columns[section][0]
+        return None
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsEnabled
+
+''' "ID" column is drawn as buttons (no widget per row). Click opens the ticker details '''
+class TickerButtonDelegate(QtWidgets.QStyledItemDelegate):
+    clicked = QtCore.pyqtSignal(int)
+
+    def paint(self, painter, option, index):
+        button = QtWidgets.QStyleOptionButton()
+        button.rect, button.text, button.state = option.rect, index.data(), QtWidgets.QStyle.State_Enabled | QtWidgets.QStyle.State_Raised
+        (option.widget.style() if option.widget else QtWidgets.QApplication.style()).drawControl(QtWidgets.QStyle.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QtCore.QEvent.MouseButtonRelease and event.button() == QtCore.Qt.LeftButton and option.rect.contains(event.pos()):
+            self.clicked.emit(int(index.data()))
+            return True
+        return False
 
 ''' Interface / Main Window '''
 class Ui_MainWindow(QtWidgets.QMainWindow):
@@ -130,11 +227,7 @@ class Ui_MainWindow(QtWidgets.QMainWindow):
         MainWindow.setMaximumSize(QtCore.QSize(1092, 1000))
         MainWindow.setWindowTitle("Tickers tracker for Avanza")
 
-        # when we create .exe with pyinstaller, we need to store icon inside it. Then we find it inside unpacked temp directory.
-        for i in pkgutil.iter_importers():
-            path = str(i).split("'")[1].replace("\\\\", "\\") if str(i).find('FileFinder')>=0 else None
-            if path != None: self.iconpath = path + "\\images\\icon.ico"
-
+        self.iconpath = f_iconPath()
         MainWindow.setWindowIcon(QtGui.QIcon(self.iconpath))
         MainWindow.setIconSize(QtCore.QSize(30, 30))
 
@@ -143,12 +236,13 @@ class Ui_MainWindow(QtWidgets.QMainWindow):
         MainWindow.setCentralWidget(self.centralwidget)
 
         # Block: Table
-        self.Interface_TableMain = QtWidgets.QTableWidget(self.centralwidget)
+        self.Interface_TableMain = QtWidgets.QTableView(self.centralwidget)
         self.__create_element(self.Interface_TableMain, [5, 5, 815, 581], "Interface_TableMain", font=font_ee)
         self.Interface_TableMain.setLayoutDirection(QtCore.Qt.LeftToRight)
         self.Interface_TableMain.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOn)
         self.Interface_TableMain.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.Interface_TableMain.verticalHeader().hide()
+        self.Interface_TableMain.verticalHeader().setDefaultSectionSize(20)
 
         # Block: Tickers management
         self.Interface_Label_TickersManagement = QtWidgets.QLabel(self.centralwidget)
@@ -257,9 +351,22 @@ class Ui_MainWindow(QtWidgets.QMainWindow):
         # MenuBar
         self.menubar = QtWidgets.QMenuBar(MainWindow)
         self.__create_element(self.menubar, [0, 0, 699, 21], "menubar")
+        self.menuPortfolio = QtWidgets.QMenu(self.menubar)
+        self.__create_element(self.menuPortfolio, [999, 999, 999, 999], "menuPortfolio", title="Portfolio")
         self.menuHelp = QtWidgets.QMenu(self.menubar)
         self.__create_element(self.menuHelp, [999, 999, 999, 999], "menuHelp", title="Help")
         MainWindow.setMenuBar(self.menubar)
+        self.actionAnalytics = QtWidgets.QAction(MainWindow)
+        self.__create_element(self.actionAnalytics, [999, 999, 999, 999], "actionAnalytics", text="Analytics")
+        self.menuPortfolio.addAction(self.actionAnalytics)
+        self.actionRecordIntraday = QtWidgets.QAction(MainWindow)
+        self.__create_element(self.actionRecordIntraday, [999, 999, 999, 999], "actionRecordIntraday", text="Record intraday quotes")
+        self.actionRecordIntraday.setCheckable(True)
+        self.menuPortfolio.addAction(self.actionRecordIntraday)
+        self.actionNewPortfolio = QtWidgets.QAction(MainWindow)
+        self.__create_element(self.actionNewPortfolio, [999, 999, 999, 999], "actionNewPortfolio", text="New portfolio...")
+        self.menuPortfolio.addAction(self.actionNewPortfolio)
+        self.menubar.addAction(self.menuPortfolio.menuAction())
         self.actionVersion = QtWidgets.QAction(MainWindow)
         self.__create_element(self.actionVersion, [999, 999, 999, 999], "actionVersion", text="Version 1.1")
         self.menuHelp.addAction(self.actionVersion)
@@ -270,23 +377,18 @@ class Ui_MainWindow(QtWidgets.QMainWindow):
         self.statusbar.setObjectName("statusbar")
         MainWindow.setStatusBar(self.statusbar)
 
-''' Interface / Message Box (ticker details) '''
+''' Interface / Message Box (ticker details). Created once, f_setTicker fills it for every ticker (table rows and the data of the only curve) '''
 class Ui_MessageBox_Details(QtWidgets.QMessageBox):
 
-    def __init__(self, ticker):
+    def __init__(self, ticker=None):
 
-        QtGui.QMessageBox.__init__(self)
+        QtWidgets.QMessageBox.__init__(self)
 
-        self.setWindowTitle("Ticker {}".format(ticker.number))
-
-        # when we create .exe with pyinstaller, we need to store icon inside it. Then we find it inside unpacked temp directory.
-        for i in pkgutil.iter_importers():
-            path = str(i).split("'")[1].replace("\\\\", "\\") if str(i).find('FileFinder') >= 0 else None
-            if path != None: self.iconpath = path + "\\images\\icon.ico"
+        self.iconpath = f_iconPath()
         self.setWindowIcon(QtGui.QIcon(self.iconpath))
 
         # Block: Table
-        self.Interface_Table_MessageBox = QtGui.QTableWidget(self)
+        self.Interface_Table_MessageBox = QtWidgets.QTableWidget(self)
         self.Interface_Table_MessageBox.setGeometry(QtCore.QRect(0, 0, 300, 400))
         self.Interface_Table_MessageBox.setObjectName('Interface_Table_MessageBox')
         font_ee = QtGui.QFont()
@@ -297,29 +399,15 @@ class Ui_MessageBox_Details(QtWidgets.QMessageBox):
         self.Interface_Table_MessageBox.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.Interface_Table_MessageBox.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
 
-        ticker_info = [("Name", ticker.name), ("Country", ticker.currency), ("Currency", ticker.country), ("Sector", ticker.sector), ("Key ratios", "Span"), ("P/E ratio", ticker.peRatio), ("Volatility", ticker.volatility), ("Direct yield", ticker.directYield), ("Price", "Span"), ("Last", ticker.price_last), ("One Week Ago", ticker.price_oneWeek), ("One Month Ago", ticker.price_oneMonth), ("Six Months Ago", ticker.price_sixMonth), ("One Year Ago", ticker.price_oneYear), ("Dividends (per share)", "Span")] + [(i['exDate'], i['amountPerShare']) for i in ticker.dividends]
-
-        self.Interface_Table_MessageBox.setColumnCount(2)
-        self.Interface_Table_MessageBox.setRowCount(len(ticker_info))
-
         col_param = [("Parameter", 100), ("Value", 200)]
 
-        for i in range(0, len(ticker_info)):
-            self.Interface_Table_MessageBox.setRowHeight(i, 1 if platform.system == "Windows" else 20)
-
-            for j in [0, 1]:
-                item = QtWidgets.QTableWidgetItem()
-                item.setTextAlignment(QtCore.Qt.AlignCenter)
-                item.setText(col_param[j][0])
-                self.Interface_Table_MessageBox.setColumnWidth(j, col_param[j][1])
-                self.Interface_Table_MessageBox.setHorizontalHeaderItem(j, item)
-
-                item = QtWidgets.QTableWidgetItem()
-                item.setTextAlignment(QtCore.Qt.AlignCenter)
-                item.setData(QtCore.Qt.EditRole, ticker_info[i][0 if j == 0 else 1])
-                self.Interface_Table_MessageBox.setItem(i, j, item)
-
-                if ticker_info[i][1] == "Span": self.Interface_Table_MessageBox.setSpan(i, 0, 1, 2)
+        self.Interface_Table_MessageBox.setColumnCount(2)
+        for j in [0, 1]:
+            item = QtWidgets.QTableWidgetItem()
+            item.setTextAlignment(QtCore.Qt.AlignCenter)
+            item.setText(col_param[j][0])
+            self.Interface_Table_MessageBox.setColumnWidth(j, col_param[j][1])
+            self.Interface_Table_MessageBox.setHorizontalHeaderItem(j, item)
 
         font_graphs = QtGui.QFont()
         font_graphs.setPixelSize(10)
@@ -341,14 +429,43 @@ class Ui_MessageBox_Details(QtWidgets.QMessageBox):
         self.Interface_GraphicsView_Chart.showAxis("right")
         self.Interface_GraphicsView_Chart.getAxis("right").setTicks([])
 
-        self.Interface_GraphicsView_Chart.getPlotItem().clear()
-        points = pg.PlotCurveItem(x=[x.timestamp() for x in [datetime.strptime(i[:10], '%Y-%m-%d') for i in ticker.chartdata["Date"]]], y=list(ticker.chartdata["Price"]), pen=pg.mkPen(color=(0, 0, 255), width=2))
+        # One curve, long series (years of days, intraday quotes) are decimated to the pixels of the view
+        TimeAxisItem.f_decimate(self.Interface_GraphicsView_Chart)
+        self.chartCurve = self.Interface_GraphicsView_Chart.plot(pen=pg.mkPen(color=(0, 0, 255), width=2))
+
+        if ticker is not None: self.f_setTicker(ticker)
+
+    def f_setTicker(self, ticker):
+        ''' Show the info and the price chart of the ticker '''
+
+        self.setWindowTitle("Ticker {}".format(ticker.number))
+
+        ticker_info = [("Name", ticker.name), ("Country", ticker.currency), ("Currency", ticker.country), ("Sector", ticker.sector), ("Key ratios", "Span"), ("P/E ratio", ticker.peRatio), ("Volatility", ticker.volatility), ("Direct yield", ticker.directYield), ("Price", "Span"), ("Last", ticker.price_last), ("One Week Ago", ticker.price_oneWeek), ("One Month Ago", ticker.price_oneMonth), ("Six Months Ago", ticker.price_sixMonth), ("One Year Ago", ticker.price_oneYear), ("Dividends (per share)", "Span")] + [(i['exDate'], i['amountPerShare']) for i in ticker.dividends]
+
+        # Rows of the previous ticker are removed (with their spans)
+        self.Interface_Table_MessageBox.clearSpans()
+        self.Interface_Table_MessageBox.setRowCount(0)
+        self.Interface_Table_MessageBox.setRowCount(len(ticker_info))
+
+        for i in range(0, len(ticker_info)):
+            self.Interface_Table_MessageBox.setRowHeight(i, 1 if platform.system == "Windows" else 20)
+
+            for j in [0, 1]:
+                item = QtWidgets.QTableWidgetItem()
+                item.setTextAlignment(QtCore.Qt.AlignCenter)
+                item.setData(QtCore.Qt.EditRole, ticker_info[i][0 if j == 0 else 1])
+                self.Interface_Table_MessageBox.setItem(i, j, item)
+
+            if ticker_info[i][1] == "Span": self.Interface_Table_MessageBox.setSpan(i, 0, 1, 2)
 
-        self.Interface_GraphicsView_Chart.addItem(points)
+        # Days as seconds since 1970 (float64 arrays go to the curve as they are)
+        chartdata = ticker.chartdata
+        self.chartCurve.setData(chartdata["Date"].values.astype("datetime64[s]").astype(np.float64), chartdata["Price"].values.astype(np.float64))
+        self.Interface_GraphicsView_Chart.enableAutoRange()
 
     # Resize MessageBox window (Ugly solution, but the only I found)
     def event(self, _):
-        result = QtGui.QMessageBox.event(self, _)
+        result = QtWidgets.QMessageBox.event(self, _)
 
         size = [800, 450]
         self.setMinimumWidth(size[0])
@@ -366,18 +483,15 @@ class Ui_MessageBox_Dividents(QtWidgets.QMessageBox):
 
     def __init__(self, tickers):
 
-        QtGui.QMessageBox.__init__(self)
+        QtWidgets.QMessageBox.__init__(self)
 
         self.setWindowTitle("Dividends Calendar")
 
-        # when we create .exe with pyinstaller, we need to store icon inside it. Then we find it inside unpacked temp directory.
-        for i in pkgutil.iter_importers():
-            path = str(i).split("'")[1].replace("\\\\", "\\") if str(i).find('FileFinder') >= 0 else None
-            if path != None: self.iconpath = path + "\\images\\icon.ico"
+        self.iconpath = f_iconPath()
         self.setWindowIcon(QtGui.QIcon(self.iconpath))
 
         # Block: Table
-        self.Interface_Table_MessageBox = QtGui.QTableWidget(self)
+        self.Interface_Table_MessageBox = QtWidgets.QTableWidget(self)
         self.Interface_Table_MessageBox.setGeometry(QtCore.QRect(0, 0, 500, 400))
         self.Interface_Table_MessageBox.setObjectName('Interface_Table_MessageBox')
         font_ee = QtGui.QFont()
@@ -419,7 +533,7 @@ class Ui_MessageBox_Dividents(QtWidgets.QMessageBox):
 
     # Resize MessageBox window (Ugly solution, but the only I found)
     def event(self, _):
-        result = QtGui.QMessageBox.event(self, _)
+        result = QtWidgets.QMessageBox.event(self, _)
 
         size = [500, 450]
         self.setMinimumWidth(size[0])
@@ -438,6 +552,64 @@ class Ui_MessageBox_Dividents(QtWidgets.QMessageBox):
 
         self.Interface_Table_MessageBox.sortItems(self.sortTable[0], self.sortTable[1])
 
+''' Interface / Message Box (returns, volatility, drawdown and beta of the holdings and of the portfolio) '''
+class Ui_MessageBox_Analytics(QtWidgets.QMessageBox):
+
+    def __init__(self, result, names):
+
+        QtWidgets.QMessageBox.__init__(self)
+
+        self.setWindowTitle("Analytics")
+
+        self.iconpath = f_iconPath()
+        self.setWindowIcon(QtGui.QIcon(self.iconpath))
+
+        # Block: Table
+        self.Interface_Table_MessageBox = QtWidgets.QTableWidget(self)
+        self.Interface_Table_MessageBox.setGeometry(QtCore.QRect(0, 0, 620, 400))
+        self.Interface_Table_MessageBox.setObjectName('Interface_Table_MessageBox')
+        font_ee = QtGui.QFont()
+        font_ee.setPointSize(9 if platform.system() == 'Windows' else 11)
+        font_ee.setBold(False)
+        self.Interface_Table_MessageBox.setFont(font_ee)
+        self.Interface_Table_MessageBox.verticalHeader().hide()
+        self.Interface_Table_MessageBox.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+
+        # Percents (the portfolio is the last column of the result, its beta to itself is 1)
+        col_param = [("Company", 160)] + [(name + " %", 65) for name in result["returns"]] + [("Volatility %", 80), ("Max DD %", 75), ("Beta", 60)]
+        rows = [[names.get(column, column)] + [round(float(result["returns"][name][i]) * 100, 2) for name in result["returns"]] + [round(float(result["volatility"][i]) * 100, 2), round(float(result["maxDrawdown"][i]) * 100, 2), round(float(result["beta"][i]), 2) if i < len(result["beta"]) else 1.0] for i, column in enumerate(result["columns"])]
+
+        self.Interface_Table_MessageBox.setColumnCount(len(col_param))
+        self.Interface_Table_MessageBox.setRowCount(len(rows))
+        for j, (name, width) in enumerate(col_param):
+            item = QtWidgets.QTableWidgetItem(name)
+            item.setTextAlignment(QtCore.Qt.AlignCenter)
+            self.Interface_Table_MessageBox.setHorizontalHeaderItem(j, item)
+            self.Interface_Table_MessageBox.setColumnWidth(j, width)
+
+        for i, row in enumerate(rows):
+            self.Interface_Table_MessageBox.setRowHeight(i, 20)
+            for j, value in enumerate(row):
+                # Numbers are stored as numbers, so the columns are sorted by value
+                item = QtWidgets.QTableWidgetItem()
+                item.setTextAlignment(QtCore.Qt.AlignCenter)
+                item.setData(QtCore.Qt.EditRole, value)
+                self.Interface_Table_MessageBox.setItem(i, j, item)
+
+        self.Interface_Table_MessageBox.setSortingEnabled(True)
+
+    # Resize MessageBox window (Ugly solution, but the only I found)
+    def event(self, _):
+        result = QtWidgets.QMessageBox.event(self, _)
+
+        size = [620, 450]
+        self.setMinimumWidth(size[0])
+        self.setMaximumWidth(size[0])
+        self.setMinimumHeight(size[1])
+        self.setMaximumHeight(size[1])
+        self.resize(size[0], size[1])
+        return result
+
 ''' Interface / Message Box (reports calendar details) '''
 class Ui_MessageBox_Reports(QtWidgets.QMessageBox):
 
@@ -446,18 +618,15 @@ class Ui_MessageBox_Reports(QtWidgets.QMessageBox):
 
     def __init__(self, tickers):
 
-        QtGui.QMessageBox.__init__(self)
+        QtWidgets.QMessageBox.__init__(self)
 
         self.setWindowTitle("Dividends Calendar")
 
-        # when we create .exe with pyinstaller, we need to store icon inside it. Then we find it inside unpacked temp directory.
-        for i in pkgutil.iter_importers():
-            path = str(i).split("'")[1].replace("\\\\", "\\") if str(i).find('FileFinder') >= 0 else None
-            if path != None: self.iconpath = path + "\\images\\icon.ico"
+        self.iconpath = f_iconPath()
         self.setWindowIcon(QtGui.QIcon(self.iconpath))
 
         # Block: Table
-        self.Interface_Table_MessageBox = QtGui.QTableWidget(self)
+        self.Interface_Table_MessageBox = QtWidgets.QTableWidget(self)
         self.Interface_Table_MessageBox.setGeometry(QtCore.QRect(0, 0, 500, 400))
         self.Interface_Table_MessageBox.setObjectName('Interface_Table_MessageBox')
         font_ee = QtGui.QFont()
@@ -499,7 +668,7 @@ class Ui_MessageBox_Reports(QtWidgets.QMessageBox):
 
     # Resize MessageBox window (Ugly solution, but the only I found)
     def event(self, _):
-        result = QtGui.QMessageBox.event(self, _)
+        result = QtWidgets.QMessageBox.event(self, _)
 
         size = [360, 450]
         self.setMinimumWidth(size[0])
@@ -521,15 +690,50 @@ class Ui_MessageBox_Reports(QtWidgets.QMessageBox):
 ''' Main '''
 class GUI(Ui_MainWindow):
     # Starting values
-    TICKERS, CURRENCY_RATES_TICKERS, totalBalance, currentDir = {}, {}, "0 SEK", os.getcwd().replace("\\", "/") + "/"
+    currentDir = os.getcwd().replace("\\", "/") + "/"
+
+    # Balance graph (SEK): x - timestamps of the days (noon), y - totals
+    balance_x, balance_y = np.zeros(0), np.zeros(0)
 
     # Table / Sorting
     sorting, sortTable, = {}, [5, QtCore.Qt.AscendingOrder]
 
+    # Refresh results are delivered from the fetch engine to the GUI thread
+    refreshFinished, holdingFinished, searchFinished, analyticsFinished = QtCore.pyqtSignal(object), QtCore.pyqtSignal(object, object, object), QtCore.pyqtSignal(object, int), QtCore.pyqtSignal(object)
+    backfillFinished, detailsFinished, alertsFinished = QtCore.pyqtSignal(object), QtCore.pyqtSignal(object), QtCore.pyqtSignal(object)
+
     def __init__(self):
         super(GUI, self).__init__()
         self.setupUi(self)
 
+        # Holdings, storage and the refresh pipeline are shared with the command line version (Avanza_TT_core.py)
+        # All portfolios (accounts) of the file are refreshed together, the table shows one of them (self.portfolio)
+        self.portfolios, self.portfolio, self.refreshFuture = Portfolios("user_data.hdf5"), None, None
+        self.engine, self.history, self.metrics = self.portfolios.engine, self.portfolios.history, self.portfolios.engine.metrics
+
+        # Search as you type: the request is sent after a pause in typing, results of older requests are dropped (generation)
+        self.search, self.searchFuture, self.searchGeneration = InstrumentSearch(self.engine), None, 0
+        self.searchTimer = QtCore.QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(300)
+        self.searchTimer.timeout.connect(self.f_searchTicker)
+
+        # Main table: model -> sorting proxy -> view
+        self.tableModel, self.tableProxy, self.tableDelegate = PortfolioTableModel(self), QtCore.QSortFilterProxyModel(self), TickerButtonDelegate(self)
+        self.tableProxy.setSourceModel(self.tableModel)
+        self.tableProxy.setSortRole(PortfolioTableModel.sortRole)
+        self.Interface_TableMain.setModel(self.tableProxy)
+        self.Interface_TableMain.setItemDelegateForColumn(0, self.tableDelegate)
+        for column, (_, width) in enumerate(PortfolioTableModel.columns): self.Interface_TableMain.setColumnWidth(column, width)
+        self.tableProxy.sort(self.sortTable[0], self.sortTable[1])
+
+        # Balance graph has one curve, its data is updated with every refresh (decimated, so years of days are drawn as fast as a month)
+        TimeAxisItem.f_decimate(self.Interface_GraphicsView_Balance)
+        self.balanceCurve = self.Interface_GraphicsView_Balance.plot(pen=pg.mkPen(color=(0, 0, 255), width=2))
+
+        # Ticker details: one dialog, it is filled again for every ticker
+        self.detailsBox = None
+
         # Triggers
         self.Interface_Button_Update_Now.clicked.connect(self.f_updateTableContent)
         self.Interface_Button_Update_Interval.clicked.connect(self.f_updateInterval)
@@ -544,29 +748,68 @@ class GUI(Ui_MainWindow):
         self.Interface_Button_UpdateHistory.clicked.connect(self.f_updateBalanceHistory)
 
         self.Interface_TableMain.horizontalHeader().sectionClicked.connect(self.f_tableColumnSort)
+        self.tableDelegate.clicked.connect(self.f_tickerDetailedInfo)
 
-        self.Interface_LineEdit_Ticker_Name.textChanged.connect(self.f_tickersAddRemove)
+        self.Interface_LineEdit_Ticker_Name.textChanged.connect(self.searchTimer.start)
         self.Interface_LineEdit_Proxy.editingFinished.connect(self.f_hdfFileUpdate)
 
         self.actionVersion.triggered.connect(self.f_menuInfo)
-
-        # Initial calls
+        self.actionAnalytics.triggered.connect(self.f_analytics)
+        self.actionRecordIntraday.triggered.connect(self.portfolios.f_setRecording)
+        self.actionNewPortfolio.triggered.connect(self.f_newPortfolio)
+
+        self.refreshFinished.connect(self.f_fillTableContent)
+        self.holdingFinished.connect(self.f_holdingFetched)
+        self.searchFinished.connect(self.f_fillSearchResults)
+        self.analyticsFinished.connect(self.f_showAnalytics)
+        self.backfillFinished.connect(self.f_balanceHistoryUpdated)
+        self.detailsFinished.connect(self.f_showDetails)
+        self.alertsFinished.connect(self.f_showAlerts)
+
+        # Interval updates: every next update is planned by the trading hours of the markets (f_planUpdate)
+        self.updateTimer, self.updateInterval, self.refreshPartial = QtCore.QTimer(self), 3600, False
+        self.updateTimer.setSingleShot(True)
+        self.updateTimer.timeout.connect(self.f_scheduledUpdate)
+
+        # Initial calls. The window is shown with the last stored snapshot, the first refresh starts when the event loop is running
         self.f_hdfFileRead()
         self.f_fillTableTickers()
+        self.f_showSnapshot()
+        QtCore.QTimer.singleShot(0, self.f_updateTableContent)
 
-    def f_tickerDetailedInfo(self):
+    def f_tickerDetailedInfo(self, tickerNumber=None):
+        ''' Quote and price history are loaded in the fetch engine, the popup is shown by f_showDetails '''
 
         if self.sender().objectName() == "Interface_Button_Ticker_Info":
             # If "sender" == Button "?"
-            tickerData = Ticker(int(self.Interface_ComboBox_Ticker_ID.currentText()), 1, proxies=self.proxies)
+            tickerText = self.Interface_ComboBox_Ticker_ID.currentText()
+            f_ticker = lambda: Ticker(int(tickerText), 1, self.engine, self.history)
 
         else:
-            # If "sender" == Table: Find Ticker object by its name and show popup window with some more ticker info
-            for index, i in enumerate(self.all_data):
-                if i.number == int(self.sender().text()): tickerData = self.all_data[index]
+            # If "sender" == Table: Find Ticker object by its number and show popup window with some more ticker info
+            tickerData = next((i for i in self.portfolio.all_data if i.number == tickerNumber), None)
+            if tickerData is None: return
+            f_ticker = lambda: tickerData
 
-        msgBox = Ui_MessageBox_Details(tickerData)
-        msgBox.exec_()
+        def f_load():
+            ticker = f_ticker()
+            ticker.chartdata
+            return ticker
+
+        self.statusbar.showMessage("Loading ticker details...")
+        self.engine.f_request(f_load).add_done_callback(self.detailsFinished.emit)
+
+    def f_showDetails(self, future):
+        try:
+            tickerData = future.result()
+        except Exception as e:
+            self.statusbar.showMessage("Ticker details failed ({})".format(e))
+            return
+
+        self.statusbar.clearMessage()
+        if self.detailsBox is None: self.detailsBox = Ui_MessageBox_Details()
+        self.detailsBox.f_setTicker(tickerData)
+        self.detailsBox.exec_()
 
     def f_tableColumnSort(self, logicalIndex):
         ''' Sort table on column header click '''
@@ -575,275 +818,245 @@ class GUI(Ui_MainWindow):
 
         self.sortTable = [logicalIndex, self.sorting[logicalIndex]]
 
-        self.Interface_TableMain.sortItems(self.sortTable[0], self.sortTable[1])
-
-    def f_checkConnection(self):
-        ''' Check if the internet connection can provide access to avanza.se '''
-
-        # Proxies
-        self.proxies = {"https": self.Interface_LineEdit_Proxy.text()}
-
-        try:
-            if requests.get('https://www.avanza.se/', proxies=self.proxies).status_code == 200: return True
-        except:
-            self.statusbar.showMessage("Check your internet connection or proxy settings")
-
-        return False
+        self.tableProxy.sort(self.sortTable[0], self.sortTable[1])
 
     def f_calendar(self):
-        msgBox = Ui_MessageBox_Dividents(self.all_data) if self.sender().objectName() == "Interface_Button_Dividends" else Ui_MessageBox_Reports(self.all_data)
+        msgBox = Ui_MessageBox_Dividents(self.portfolio.all_data) if self.sender().objectName() == "Interface_Button_Dividends" else Ui_MessageBox_Reports(self.portfolio.all_data)
         msgBox.exec_()
 
     def f_hdfFileRead(self):
+        ''' Holdings, proxy and balance graph from HDF file (created if it doesn't exist) '''
+
+        self.portfolios.f_read()
+        self.portfolio = self.portfolios.items[None]
+        if self.portfolio.migrated: self.statusbar.showMessage("user_data.hdf5 is converted to the new format (old file is kept as backup)")
+
+        self.Interface_LineEdit_Proxy.setText(self.portfolio.proxy)
+        self.f_balanceRead()
+        self.f_fillPortfolioMenu()
+
+    def f_fillPortfolioMenu(self):
+        ''' Menu "Portfolio": analytics, one item per portfolio (checked - shown in the table), new portfolio '''
+        self.menuPortfolio.clear()
+        self.menuPortfolio.addAction(self.actionAnalytics)
+        self.menuPortfolio.addAction(self.actionRecordIntraday)
+        self.actionRecordIntraday.setChecked(self.portfolios.recorder is not None)
+        self.menuPortfolio.addSeparator()
+
+        group = QtWidgets.QActionGroup(self.menuPortfolio)
+        for name, portfolio in self.portfolios.items.items():
+            action = self.menuPortfolio.addAction("Main" if name is None else name)
+            action.setCheckable(True)
+            action.setChecked(portfolio is self.portfolio)
+            action.setActionGroup(group)
+            action.triggered.connect(functools.partial(self.f_switchPortfolio, name))
+
+        self.menuPortfolio.addSeparator()
+        self.menuPortfolio.addAction(self.actionNewPortfolio)
+
+    def f_newPortfolio(self):
+        name, ok = QtWidgets.QInputDialog.getText(self, "New portfolio", "Name of the portfolio (account):")
+        name = name.strip()
+        if not ok or not name: return
+        if name in self.portfolios.items or name == "Main": return self.statusbar.showMessage("Portfolio " + name + " already exists")
+
+        self.portfolios.f_add(name)
+        self.f_switchPortfolio(name)
+
+    def f_switchPortfolio(self, name, checked=True):
+        ''' Show another portfolio (its data is taken from the last refresh of all portfolios, nothing is downloaded) '''
+        self.portfolio = self.portfolios.items[name]
 
-        # Create Index dataset where all column names are stored
-        indexes_arr = [n.encode("ascii", "ignore") for n in
-                       ["ID", "Amount", "Name", "Change percent", "Price last", "Price one week", "Price one month", "Price six month", "Price one year",
-                        "Price update time", "Country", "Currency", "P/E ratio", "Volatility", "Direct Yield", "Sector"]]
-
-        # read HDF file if exists or create empty one
-        if os.path.exists(self.currentDir + "user_data.hdf5"):
-
-            with h5py.File("user_data.hdf5", "r") as file:
-                # Take all info from last day
-                for ticker, amount in file["tickers"][sorted(list(file["tickers"].keys()))[-3]]["Tickers Info"][:, :2]:
-                    self.TICKERS[int(ticker)] = int(amount)
-
-                # Take currencies from last day
-                for ticker, _, name in file["tickers"][sorted(list(file["tickers"].keys()))[-3]]["Currency rates"][:, :]:
-                    self.CURRENCY_RATES_TICKERS[int(ticker)] = str(name)
-
-                # Proxies
-                self.Interface_LineEdit_Proxy.setText("" if not file["proxy"][:, 0] else file["proxy"][:, 0][0])
-
-        else:
-            with h5py.File("user_data.hdf5", "w") as file:
-                groupTickers = file.create_group("tickers")
-                groupTickers.create_dataset("Tickers Indexes", data=indexes_arr)
-
-                balanceArr_start = np.array([str(datetime.now().date()).encode("ascii", "ignore"), self.totalBalance.encode("ascii", "ignore")])
-                groupTickers.create_dataset("Balance", (1, 2), maxshape=(None, 2), chunks=True, data=balanceArr_start)
-
-                # Proxies
-                file.create_dataset("proxy", (1, 1), dtype=h5py.special_dtype(vlen=str))
+        self.f_fillTableTickers()
+        if not self.portfolio.all_data and self.portfolio.snapshot is not None: self.f_showSnapshot()
+        else: self.f_showData()
+        self.f_balanceRead()
+        self.f_fillPortfolioMenu()
 
-                # Fill the table with some default data
-                self.TICKERS = {5361: 10, 293975: 10, 599956: 10, 549768: 10, 233288: 10}
-                self.CURRENCY_RATES_TICKERS = {19000: "USD/SEK", 18998: "EUR/SEK", 53293: "NOK/SEK"}
+        self.setWindowTitle("Tickers tracker for Avanza" + ("" if name is None else " - " + name))
 
     def f_hdfFileUpdate(self):
 
-        # Tickers data
-        dataArr = np.array([[i.number, i.count, i.name.encode("ascii", "ignore"), i.changePercent, i.price_last, i.price_oneWeek, i.price_oneMonth, i.price_sixMonth, i.price_oneYear, i.price_updateTime.encode("ascii", "ignore"), i.country.encode("ascii", "ignore"), i.currency.encode("ascii", "ignore"), i.peRatio, i.volatility, i.directYield, i.sector.encode("ascii", "ignore")] for i in self.all_data])
-
-        # Currency data
-        currencyArr = np.array([[self.currencyRates[i][1], self.currencyRates[i][0], i.encode("ascii", "ignore")] for i in self.currencyRates])
-
-        with h5py.File("user_data.hdf5", "a") as file:
+        saved = self.portfolio.saved.get("balance")
+        self.portfolios.f_write(self.Interface_LineEdit_Proxy.text())
 
-            # Work with datasets
-            groupTickers = file["tickers"]
+        # Today's point on the graph, if a new balance was written
+        date, balance = self.portfolio.saved.get("balance") or (None, {})
+        if self.portfolio.saved.get("balance") != saved and "SEK" in balance: self.f_drawBalance(date, balance["SEK"])
 
-            # Update today's total balance (add new row or rewrite old one for today)
-            if groupTickers["Balance"][groupTickers["Balance"].shape[0]-1, 0] != str(datetime.now().date()).encode("ascii", "ignore"):
-                 groupTickers["Balance"].resize((groupTickers["Balance"].shape[0] + 1), axis = 0)
+    def f_tickersAddRemove(self):
 
-            groupTickers["Balance"][groupTickers["Balance"].shape[0] - 1, :] = [str(datetime.now().date()).encode("ascii", "ignore"), self.totalBalance.encode("ascii", "ignore")]
+        self.statusbar.clearMessage()
 
-            # Send Balance points to print
-            balanceArr_x, balanceArr_y = [], []
-            for i in groupTickers["Balance"]:
-                try:
-                    balanceArr_y.append(int(str(i[1])[2:-5]))
-                except: continue
-                balanceArr_x.append(datetime.strptime(str(i[0])[2:-1] + " 12", '%Y-%m-%d %H'))
+        # Data (only the changed ticker is downloaded)
+        if self.sender().objectName() in ["Interface_Button_Ticker_Update", "Interface_Button_Ticker_Remove"]:
+            try:
+                tickerNumber = int(self.Interface_ComboBox_Ticker_ID.currentText())
+                if self.sender().objectName() == "Interface_Button_Ticker_Update":
+                    if not self.portfolio.f_setAmount(tickerNumber, int(self.Interface_LineEdit_Ticker_Amount.text())): return self.f_fetchHolding(self.portfolio.f_fetchHolding, self.portfolio.f_addHolding, tickerNumber)
+                else: self.portfolio.f_removeHolding(tickerNumber)
+            except:
+                self.statusbar.showMessage("Recheck Ticker format and Amount (both should be numbers)")
+                return
 
-            if len(balanceArr_y) > 0: self.f_drawBalance(balanceArr_x, balanceArr_y)
+        # Currency
+        elif self.sender().objectName() in ["Interface_Button_Ticker_Currency_Add", "Interface_Button_Ticker_Currency_Remove"]:
+            try:
+                tickerNumber = int(self.Interface_LineEdit_Ticker_Currency_ID.text())
+                if self.sender().objectName() == "Interface_Button_Ticker_Currency_Add": return self.f_fetchHolding(self.portfolio.f_fetchCurrency, self.portfolio.f_addCurrency, tickerNumber)
+                else: self.portfolio.f_removeCurrency(tickerNumber)
+            except:
+                self.statusbar.showMessage("Recheck Currency Ticker format (should be a number)")
+                return
 
-            # Check if we already created the group with datasets today
-            if "/tickers/" + str(datetime.now().date()) in file:
-                subgroupLast = groupTickers[str(datetime.now().date())]
+        self.f_holdingsChanged()
 
-                subgroupLast["Tickers Info"].resize((len(dataArr)), axis = 0)
-                subgroupLast["Tickers Info"][:] = dataArr
+    def f_searchTicker(self):
+        ''' Search Ticker by Name, fill combobox (ID is used as it is) '''
 
-                subgroupLast["Currency rates"].resize((len(currencyArr)), axis = 0)
-                subgroupLast["Currency rates"][:] = currencyArr
-            else:
-                subgroupLast = groupTickers.create_group(str(datetime.now().date()))
+        self.statusbar.clearMessage()
+        query, self.searchGeneration = self.Interface_LineEdit_Ticker_Name.text().strip(), self.searchGeneration + 1
 
-                subgroupLast.create_dataset("Tickers Info", data=dataArr, maxshape=(None, 16), chunks=True)
-                subgroupLast.create_dataset("Currency rates", data=currencyArr, maxshape=(None, 3), chunks=True)
+        # Previous request is not needed anymore
+        if self.searchFuture is not None: self.searchFuture.cancel()
 
-            # update Proxy
-            file["proxy"][:, 0] = [self.Interface_LineEdit_Proxy.text().encode("ascii", "ignore")]
+        if query.isdigit(): return self.f_fillSearchResults([(query, "")], self.searchGeneration)
 
-    def f_tickersAddRemove(self):
+        hits = self.search.f_cached(query)
+        if hits is not None: return self.f_fillSearchResults(hits, self.searchGeneration)
 
-        self.statusbar.clearMessage()
+        generation = self.searchGeneration
+        self.searchFuture = self.engine.f_request(self.search.f_search, query)
+        self.searchFuture.add_done_callback(lambda future: None if future.cancelled() or future.exception() else self.searchFinished.emit(future.result(), generation))
 
-        # Fill ticker Name / ID
-        if self.sender().objectName() in ["Interface_LineEdit_Ticker_Name"]:
-            # Search Ticker by Name, fill combobox, set ID
-            if self.sender().objectName() == "Interface_LineEdit_Ticker_Name":
+    def f_fillSearchResults(self, hits, generation):
+        if generation != self.searchGeneration: return
 
-                self.Interface_ComboBox_Ticker_ID.clear()
-                try:
-                    _ = int(self.Interface_LineEdit_Ticker_Name.text())
-                    self.Interface_ComboBox_Ticker_ID.addItem(self.Interface_LineEdit_Ticker_Name.text())
-                except ValueError:
-                    ticker = requests.get('https://www.avanza.se/_cqbe/search/global-search/global-search-template?query={}'.format(self.Interface_LineEdit_Ticker_Name.text()), proxies=self.proxies).json()
+        self.Interface_ComboBox_Ticker_ID.clear()
+        for index, (orderbookId, name) in enumerate(hits):
+            self.Interface_ComboBox_Ticker_ID.addItem(orderbookId)
+            self.Interface_ComboBox_Ticker_ID.setItemData(index, name, QtCore.Qt.ToolTipRole)
 
-                    for SearchResultFilteredArr in [i["hits"] for i in ticker["resultGroups"] if i["instrumentType"] == 'STOCK']:
+    def f_fetchHolding(self, fetch, add, tickerNumber):
+        ''' Download one ticker in the fetch engine (it doesn't wait for a running refresh), add(ticker) is called in GUI thread when it arrives '''
+        self.statusbar.showMessage("Updating {}...".format(tickerNumber))
+        self.engine.f_request(fetch, tickerNumber).add_done_callback(lambda future: self.holdingFinished.emit(future, add, tickerNumber))
 
-                        for SearchResult in SearchResultFilteredArr:
-                            self.Interface_ComboBox_Ticker_ID.addItem(SearchResult['link']['orderbookId'])
+    def f_holdingFetched(self, future, add, tickerNumber):
+        try:
+            add(future.result())
+        except Exception:
+            self.statusbar.showMessage("Ticker {} is not found (check the number and internet connection)".format(tickerNumber))
             return
 
-        # Data
-        if self.sender().objectName() in ["Interface_Button_Ticker_Update", "Interface_Button_Ticker_Remove"]:
-            try:
-                if self.sender().objectName() == "Interface_Button_Ticker_Update": self.TICKERS[int(self.Interface_ComboBox_Ticker_ID.currentText())] = int(self.Interface_LineEdit_Ticker_Amount.text())
-                else: del self.TICKERS[int(self.Interface_ComboBox_Ticker_ID.currentText())]
-            except: self.statusbar.showMessage("Recheck Ticker format and Amount (both should be numbers)")
+        self.f_holdingsChanged()
+        self.statusbar.showMessage("Ticker {} is updated".format(tickerNumber))
 
-        # Currency
-        elif self.sender().objectName() in ["Interface_Button_Ticker_Currency_Add", "Interface_Button_Ticker_Currency_Remove"]:
-            try:
-                if self.sender().objectName() == "Interface_Button_Ticker_Currency_Add":
-                    self.CURRENCY_RATES_TICKERS[int(self.Interface_LineEdit_Ticker_Currency_ID.text())] = Ticker(int(self.Interface_LineEdit_Ticker_Currency_ID.text()), 1, proxies = {"https": self.Interface_LineEdit_Proxy.text()}).name
-                else: del self.CURRENCY_RATES_TICKERS[int(self.Interface_LineEdit_Ticker_Currency_ID.text())]
-            except: self.statusbar.showMessage("Recheck Currency Ticker format (should be a number)")
+    def f_holdingsChanged(self):
+        ''' Show and save the holdings after add / remove / amount change '''
 
-        self.f_fillTableTickers()
+        self.f_showData()
+        self.f_fitWindow()
+
+        # Snapshot of today is rewritten with the new holdings. Data from the old snapshot is not saved - full refresh instead
+        if self.portfolio.stale: self.f_updateTableContent()
+        else: self.f_hdfFileUpdate()
 
     def f_fillTableTickers(self):
-        self.Interface_TableMain.clearContents()
 
-        self.Interface_TableMain.setColumnCount(9)
-        self.Interface_TableMain.setRowCount(len(self.TICKERS))
+        self.tableModel.f_setTickers(self.portfolio.TICKERS)
+        self.f_fitWindow()
 
+    def f_fitWindow(self):
+        ''' Window height follows the number of holdings '''
         offset = 20 if platform.system() == 'Windows' else 0
-        self.MainWindow_size_height = max(421 + offset, 61 + offset + 20*len(self.TICKERS))
+        self.MainWindow_size_height = max(421 + offset, 61 + offset + 20*len(self.portfolio.TICKERS))
         self.resize(1092, 1000 if self.MainWindow_size_height > 1000 else self.MainWindow_size_height)
 
-        column_names = ["ID", "Name", "Country", "Updated", "P/E", "Change today", "Price (SEK)", "Amount", "Total value (SEK)"]
-        column_widths = [100, 200, 50, 80, 50, 90, 70, 60, 100]
+    @QtCore.pyqtSlot()
+    def f_updateTableContent(self, tickers=None):
+        ''' Start the refresh (of all holdings or only of tickers) in the fetch engine. The table is filled by f_fillTableContent when the data arrives '''
 
-        for i, tickerNumber in enumerate(self.TICKERS):
+        # Previous refresh is still running
+        if self.refreshFuture is not None and not self.refreshFuture.done(): return
 
-            self.Interface_TableMain.setRowHeight(i, 1 if platform.system == "Windows" else 20)
+        self.engine.proxies = {"https": self.Interface_LineEdit_Proxy.text()}
+        self.statusbar.showMessage("Updating...")
+        self.refreshStarted = time.perf_counter()
 
-            for j in range(0, self.Interface_TableMain.columnCount()):
-                item = QtWidgets.QTableWidgetItem()
-                item.setTextAlignment(QtCore.Qt.AlignCenter)
-                item.setText(column_names[j])
-                self.Interface_TableMain.setColumnWidth(j, column_widths[j])
-                self.Interface_TableMain.setHorizontalHeaderItem(j, item)
+        # Results from the stored snapshot can't be mixed with the new ones
+        self.refreshPartial = self.portfolios.f_partial(tickers)
 
-                if j == 0:
-                    item = QtWidgets.QPushButton(self.Interface_TableMain)
-                    item.setText(str(tickerNumber))
-                    self.Interface_TableMain.setCellWidget(i, j, item)
-                else:
-                    item = QtWidgets.QTableWidgetItem()
-                    item.setTextAlignment(QtCore.Qt.AlignCenter)
+        # One request per orderbookId and currency pair for all portfolios
+        self.refreshFuture = self.engine.f_submit(self.portfolios.f_fetch, dict(tickers) if self.refreshPartial else None)
+        self.refreshFuture.add_done_callback(self.refreshFinished.emit)
 
-                    if j == 7: content = self.TICKERS[tickerNumber]
-                    else: content = ""
+    def f_fillTableContent(self, future):
 
-                    item.setFlags(QtCore.Qt.ItemIsEditable)
-                    item.setData(QtCore.Qt.EditRole, content)
-                    self.Interface_TableMain.setItem(i, j, item)
-
-        self.f_updateTableContent()
+        try:
+            fetched, currencyRates, failed = future.result()
+        except Exception as e:
+            self.metrics.f_observe("refresh", time.perf_counter() - self.refreshStarted, True)
+            self.statusbar.showMessage(str(e) if isinstance(e, ConnectionError) else "Update failed ({})".format(e))
+            return
 
-    def f_updateTableContent(self):
-
-        if not self.f_checkConnection(): return
-
-        self.message, self.all_data, self.currencyRates, self.cell_buttons_collection, balance, self.totalBalance = "", [], {}, [], {"SEK": 0}, "0 SEK"
-
-        def __update_thread__(ticker, TICKERS, all_data, currencyRates, proxies):
-
-            if not all_data == False: # threads for DATA
-                tickerData = Ticker(int(ticker), int(TICKERS[ticker]), proxies = proxies)
-                all_data.append(tickerData)
-
-            else: # threads for CURRENCY
-                tickerData = Ticker(int(ticker), 1, proxies = proxies)
-                currencyRates[tickerData.name] = [tickerData.price_last, tickerData.number]
-
-        # Start data update CURRENCY in threads and Wait for all threads to quit
-        for ticker in self.CURRENCY_RATES_TICKERS:
-            x = threading.Thread(target=__update_thread__, args=(ticker, False, False, self.currencyRates, self.proxies))
-            x.start()
-        while threading.active_count() > 1: True
-
-        # Start data update DATA in threads and Wait for all threads to quit
-        for ticker in self.TICKERS.keys():
-            x = threading.Thread(target=__update_thread__, args=(ticker, self.TICKERS, self.all_data, False, self.proxies))
-            x.start()
-        while threading.active_count() > 1: True
-
-        # Fill the table
-        for index, ticker in enumerate(self.all_data):
-            item = QtWidgets.QPushButton(self.Interface_TableMain)
-            item.setText(str(ticker.number))
-            item.clicked.connect(self.f_tickerDetailedInfo)
-            self.Interface_TableMain.setCellWidget(index, 0, item)
-            self.Interface_TableMain.item(index, 1).setText(str(ticker.name))
-            self.Interface_TableMain.item(index, 2).setText(str(ticker.country))
-            self.Interface_TableMain.item(index, 3).setData(QtCore.Qt.EditRole, ticker.price_updateTime)
-            self.Interface_TableMain.item(index, 4).setData(QtCore.Qt.EditRole, ticker.peRatio)
-            self.Interface_TableMain.item(index, 5).setData(QtCore.Qt.EditRole, ticker.changePercent)
-
-            if ticker.currency not in balance: balance[ticker.currency] = 0
-            if ticker.currency + "/SEK" not in self.currencyRates and ticker.currency != "SEK":
-                self.statusbar.showMessage("Missing Currency Ticker (" + ticker.currency + "/SEK)")
-                price_last = str(ticker.price_last) + " " + str(ticker.currency)
-                total = str(round(ticker.price_last * ticker.count, 2)) + " " + str(ticker.currency)
-                balance[ticker.currency] += int(round(ticker.price_last * ticker.count))
-            else:
-                price_last = round(ticker.price_last * (1 if ticker.currency == "SEK" else self.currencyRates[ticker.currency + "/SEK"][0]), 2)
-                total = round(ticker.price_last * ticker.count * (1 if ticker.currency == "SEK" else self.currencyRates[ticker.currency + "/SEK"][0]))
-                balance["SEK"] += int(total)
-
-            self.Interface_TableMain.item(index, 6).setData(QtCore.Qt.EditRole, price_last)
-            self.Interface_TableMain.item(index, 7).setData(QtCore.Qt.EditRole, ticker.count)
-            self.Interface_TableMain.item(index, 8).setData(QtCore.Qt.EditRole, total)
+        # Prices and totals in SEK (tickers of the closed markets keep the last prices)
+        self.portfolios.f_distribute(fetched, currencyRates, self.refreshPartial)
 
-            # Color of the text ("Change today") is defined by its content. Black for other columns
-            [self.Interface_TableMain.item(index, i).setForeground(QtGui.QColor(0, 0, 0)) for i in range(1, 9)]
-            self.Interface_TableMain.item(index, 5).setForeground(
-                QtGui.QBrush(QtGui.QColor(255, 0, 0) if ticker.changePercent < 0 else QtGui.QColor(0, 0, 255)))
+        # Quiet market: table, graph and HDF file are not touched
+        if self.portfolio.modified:
+            with self.metrics.f_span("refresh.table"): self.f_showData()
 
-            # Prepare message for toast notification
+        # Alerts (rules of alerts.json and the drop threshold) are checked only if warnings are on. Each one fires once in its cooldown
+        notice = ""
+        if self.Interface_CheckBox_ShowWarnings.isChecked():
             try:
-                _ = float(self.Interface_LineEdit_ShowWarnings.text())
-            except:
-                self.statusbar.showMessage("Warnings threshold should be a number")
-                return
+                rules = [{"id": "threshold", "field": "changePercent", "op": "<", "level": float(self.Interface_LineEdit_ShowWarnings.text())}]
+            except ValueError:
+                notice, rules = " | Warnings threshold should be a number", []
+
+            # Values are taken here, the rules are checked (and their state is written) in the fetch engine. Instruments of all portfolios are checked once, even if they are in several
+            self.engine.f_submit(self.portfolios.f_alerts, rules, self.portfolios.f_alertValues()).add_done_callback(self.alertsFinished.emit)
+
+        # HDF write
+        self.f_hdfFileUpdate()
 
-            if ticker.changePercent < float(self.Interface_LineEdit_ShowWarnings.text()):
-                self.message += ticker.name + " " + str(ticker.changePercent) + "\n"
+        # Timing of the whole refresh (from the button to the written file) goes to the metrics file
+        self.metrics.f_observe("refresh", time.perf_counter() - self.refreshStarted)
+        self.metrics.f_export(self.portfolio.metricsPath)
 
-        # calculate "Balance"
-        self.totalBalance = " + ".join([str(str(balance[i]) + " " + i) for i in balance if balance[i] != 0])
+        # Show "Update time" and timing summary in status bar
+        self.statusbar.showMessage(f"Last update at {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}" + ("" if not failed else " (failed: {})".format(", ".join([str(i) for i in failed]))) + " | " + self.metrics.f_summary() + notice)
 
-        self.Interface_Label_Balance.setText("Balance: " + str(self.totalBalance))
+    def f_showAlerts(self, future):
+        try:
+            alerts = future.result()
+        except Exception as e:
+            self.statusbar.showMessage(self.statusbar.currentMessage() + " | Alerts failed ({})".format(e))
+            return
 
-        # Sort the table for consistent view
-        self.Interface_TableMain.sortItems(self.sortTable[0], self.sortTable[1])
+        self.message = "".join([Alerts.f_text(alert, alert["name"]) + "\n" for alert in alerts])
 
         # Warning
-        self.f_showWarnings("Significant drop today (by more than " + self.Interface_LineEdit_ShowWarnings.text() + "%)", self.message)
+        with self.metrics.f_span("refresh.toast"): self.f_showWarnings("Alerts (drop by more than " + self.Interface_LineEdit_ShowWarnings.text() + "% and the rules of alerts.json)", self.message)
 
-        # HDF write
-        self.f_hdfFileUpdate()
+    def f_showSnapshot(self):
+        ''' Last stored data (shown until the first refresh is done, nothing is written back) '''
+        if self.portfolio.snapshot is None: return
+
+        self.portfolio.f_convert(*self.portfolio.f_lastSnapshot(), stale=True)
+        self.f_showData()
+        self.statusbar.showMessage("Data from " + str(self.portfolio.snapshot[2]))
+
+    def f_showData(self):
+        ''' Fill the table and the balance label from the portfolio '''
 
-        # Show "Update time" in status bar
-        self.statusbar.showMessage(f"Last update at {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+        # Only changed cells are repainted (sorting proxy keeps the order)
+        self.tableModel.f_setRows(self.portfolio.rows)
+
+        if self.portfolio.missingCurrencies: self.statusbar.showMessage("Missing Currency Ticker (" + self.portfolio.missingCurrencies[-1] + "/SEK)")
+
+        self.Interface_Label_Balance.setText("Balance: " + str(self.portfolio.totalBalance))
 
     def f_updateInterval(self):
 
@@ -858,124 +1071,85 @@ class GUI(Ui_MainWindow):
         if self.Interface_Button_Update_Interval.text() == "Interval":
             self.Interface_Button_Update_Interval.setText("Stop")
             self.Interface_Button_Update_Now.setDisabled(True)
+            self.updateInterval = int(self.Interface_LineEdit_Update_Interval.text()) * 60
+            self.f_updateTableContent()
+            self.f_planUpdate()
         else:
             self.Interface_Button_Update_Interval.setText("Interval")
             self.Interface_Button_Update_Now.setDisabled(False)
+            self.updateTimer.stop()
 
-        while self.Interface_Button_Update_Interval.text() == "Stop":
-            self.f_updateTableContent()
-            QtTest.QTest.qWait(int(self.Interface_LineEdit_Update_Interval.text()) * 1000 * 60)
+    def f_scheduledUpdate(self):
+        ''' Refresh only the holdings whose market is open. Nothing is requested while all markets are closed '''
+
+        openTickers = self.portfolios.f_openTickers()
+        if openTickers: self.f_updateTableContent(openTickers)
+        self.f_planUpdate()
+
+        if not openTickers: self.statusbar.showMessage("Markets are closed, next update at " + self.nextUpdate.strftime('%d/%m/%Y %H:%M'))
+
+    def f_planUpdate(self):
+        seconds = self.portfolios.f_nextRefresh(self.updateInterval)
+        self.nextUpdate = datetime.now() + timedelta(seconds=seconds)
+        self.updateTimer.start(int(seconds * 1000))
 
     def f_updateBalanceHistory(self):
         '''
         Used to fill balances for missing dates
         '''
 
-        ### 1 - create full dates list
-
-        USER_BALANCE = []
-        with h5py.File("user_data.hdf5", "r") as file:
-            # Take all info from last day
-            for folder_date in [i for i in file["tickers"].keys() if not i in ["Balance", "Tickers Indexes"]]:
-                for ticker, amount, currency in file["tickers"][folder_date]["Tickers Info"][:, [0, 1, 11]]:
-                    USER_BALANCE.append([datetime.strptime(folder_date, '%Y-%m-%d'), int(ticker), int(amount), str(currency)[2:-1]])
-
-        df_datesWithData = pd.DataFrame(USER_BALANCE, columns=("Date", "Ticker", "Amount", "Currency"))
-
-        # Generate dataframe with only dusiness days starting from first run of the program
-        df_datesEmpty = pd.bdate_range(start=df_datesWithData['Date'][0], end=datetime.now(), freq="B").to_frame(index=False, name="Date")
-        # Merge dataframes to see when program wasnt working -> convert to dict
-        df_datesFull = df_datesWithData.merge(df_datesEmpty, how="outer").sort_values("Date")
-
-        # iterate by dates to fill missing dateInfo
-        datesUnique, df_memo = list(df_datesFull["Date"].drop_duplicates()), ''
-        if len(datesUnique) < 2: return
-        for date in reversed(datesUnique):
-            df_dateInfo = df_datesFull[df_datesFull["Date"] == date]
-            if pd.isna(df_dateInfo.iloc[0].Ticker):
-                df_memo["Date"].replace(df_memo.iloc[0].Date, date, inplace=True)
-                df_datesFull = df_datesFull.merge(df_memo, how="outer")
-            else:
-                df_memo = df_dateInfo
-
-        # Columns: "Date", "Ticker", "Amount", "Currency"
-        df_datesFull = df_datesFull.sort_values("Date").dropna().reset_index(drop=True)
-
-        ### 2 - find tickers price for the date
-
-        # create DataFrame with trimmed chartdata (this data is already downloaded)
-        df_pricesHistory, df_temp = pd.DataFrame(columns=["Date", "Ticker", "Price"]), ""
-        for i in self.all_data:
-            i.chartdata["Date"] = pd.to_datetime(i.chartdata["Date"])
-            df_temp = i.chartdata[i.chartdata["Date"] >= df_datesWithData['Date'][0]]
-            df_temp["Ticker"] = i.number
-            # Columns: "Date", "Ticker", "Price"
-            df_pricesHistory = pd.concat([df_pricesHistory, df_temp])
-
-        # check fo missing chartdata (not in portfolio by today, so I keep only chartData)
-        missingTickers = list(pd.concat([df_datesFull["Ticker"].drop_duplicates(), df_pricesHistory["Ticker"].drop_duplicates()]).drop_duplicates(keep=False))
-        for ticker in missingTickers:
-            tickerData = Ticker(int(ticker), 1, proxies=self.proxies)
-            tickerData.chartdata["Date"] = pd.to_datetime(tickerData.chartdata["Date"])
-            df_temp = tickerData.chartdata[tickerData.chartdata["Date"] >= df_datesWithData['Date'][0]]
-            df_temp["Ticker"] = tickerData.number
-            df_pricesHistory = pd.concat([df_pricesHistory, df_temp])
-
-        ### 3 - merge 1 and 2, check for holidays (NaN for Price)
-
-        # Columns: "Date", "Ticker", "Amount", "Price", "Currency"
-        df_datesFullwPrices = pd.merge(df_datesFull, df_pricesHistory, how="left")
-        df_datesFullwPrices = df_datesFullwPrices[df_datesFullwPrices["Date"] < datetime.today() - timedelta(days=1)]
-
-        # Filter out only rows with NaN Prices. They are likely belongs to National Holidays in the Ticker'c country
-        df_missingPrices = df_datesFullwPrices[pd.isnull(df_datesFullwPrices["Price"])]
-        for date in list(df_missingPrices["Date"].drop_duplicates()):
-            df_datesFullwPrices = df_datesFullwPrices[df_datesFullwPrices["Date"] != date]
-
-        ### 4 - download currency rates for each date
-
-        df_currencyRatesHistory, df_temp = pd.DataFrame(columns=["Date", "Currency", "Rate"]), ""
-        for ticker in self.CURRENCY_RATES_TICKERS:
-            tickerData = Ticker(int(ticker), 1, proxies=self.proxies)
-            tickerData.chartdata["Date"] = pd.to_datetime(tickerData.chartdata["Date"])
-            df_temp = tickerData.chartdata[tickerData.chartdata["Date"] >= df_datesWithData['Date'][0]].rename(columns={"Price": "Rate"})
-            df_temp["Currency"] = tickerData.name.replace("/SEK", "")
-            # Columns: "Date", "Currency", "Rate"
-            df_currencyRatesHistory = pd.concat([df_currencyRatesHistory, df_temp])
-
-        ### 5 - merge 3 and 4
-
-        # Columns: "Date", "Ticker", "Amount", "Price", "Currency", "Rate"
-        df_datesFullwPrices = pd.merge(df_datesFullwPrices, df_currencyRatesHistory, how="left")
-        df_datesFullwPrices.loc[df_datesFullwPrices["Currency"] == "SEK", "Rate"] = 1
-
-        ### 6 - sum by dates
-
-        df_datesFullwPrices["Total"] = df_datesFullwPrices["Rate"] * df_datesFullwPrices["Price"] * df_datesFullwPrices["Amount"]
-        # Columns: "Date", "Total"
-        df_datesFullwPrices = df_datesFullwPrices.groupby(["Date"])["Total"].sum()
-
-        ### 7 - write updated balances in hdf
-
-        with h5py.File("user_data.hdf5", "a") as file:
-
-            # Work with datasets
-            groupTickersBalance = file["tickers"]["Balance"]
-            groupTickersBalance.resize((0, 2))
-
-            # Update today's total balance (add new row or rewrite old one for today)
-            for row in df_datesFullwPrices.iteritems():
-                groupTickersBalance.resize((groupTickersBalance.shape[0] + 1), axis=0)
-                groupTickersBalance[groupTickersBalance.shape[0] - 1, :] = [str(row[0]).encode("ascii", "ignore"), str(str(round(row[1])) + " SEK").encode("ascii", "ignore")]
-
-        ### 8 - call "Update Table" to get todays data
+        # Balances are recomputed from the snapshots and the local price history in the fetch engine (price history may have to be downloaded)
+        self.statusbar.showMessage("Updating balance history...")
+        self.Interface_Button_UpdateHistory.setEnabled(False)
+        self.engine.f_submit(self.portfolio.f_backfill).add_done_callback(self.backfillFinished.emit)
+
+    def f_balanceHistoryUpdated(self, future):
+        self.Interface_Button_UpdateHistory.setEnabled(True)
+        try:
+            days = future.result()
+        except Exception as e:
+            self.statusbar.showMessage("Balance history update failed ({})".format(e))
+            return
+
+        self.statusbar.clearMessage()
+        if not days: return
+        with self.metrics.f_span("balance.read"): self.f_balanceRead()
+
+        # Call "Update Table" to get todays data
         self.f_updateTableContent()
 
-    def f_drawBalance(self, balanceArr_x, balanceArr_y):
+    def f_balanceRead(self):
+        ''' Load the balance graph (SEK) from HDF file '''
+
+        dates, totals = self.portfolio.f_balance("SEK")
+
+        self.balance_x, self.balance_y = dates.astype(np.int64) * 86400.0 + 43200, totals
+        self.balanceCurve.setData(self.balance_x, self.balance_y)
+
+    def f_drawBalance(self, date, total):
+        ''' Add (or replace if it is the last day on the graph) one point of the balance graph '''
 
-        self.Interface_GraphicsView_Balance.getPlotItem().clear()
-        points = pg.PlotCurveItem(x=[x.timestamp() for x in balanceArr_x], y=balanceArr_y, pen=pg.mkPen(color=(0, 0, 255), width=2))
-        self.Interface_GraphicsView_Balance.addItem(points)
+        x = np.datetime64(date, "D").astype(np.int64) * 86400.0 + 43200
+        if len(self.balance_x) > 0 and self.balance_x[-1] == x: self.balance_y[-1] = total
+        else: self.balance_x, self.balance_y = np.append(self.balance_x, x), np.append(self.balance_y, total)
+
+        self.balanceCurve.setData(self.balance_x, self.balance_y)
+
+    def f_analytics(self):
+        ''' Analytics are computed in the fetch engine (price history of the holdings may have to be downloaded) '''
+        self.statusbar.showMessage("Computing analytics...")
+        self.engine.f_submit(self.portfolio.f_analytics).add_done_callback(self.analyticsFinished.emit)
+
+    def f_showAnalytics(self, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.statusbar.showMessage("Analytics failed ({})".format(e))
+            return
+
+        self.statusbar.clearMessage()
+        msgBox = Ui_MessageBox_Analytics(result, {ticker.number: ticker.name for ticker in self.portfolio.all_data})
+        msgBox.exec_()
 
     def f_menuInfo(self):
 
@@ -988,14 +1162,27 @@ class GUI(Ui_MainWindow):
                        "Check new version at https://github.com/Alexey-Klechikov/Avanza_TT/releases")
         msgBox.exec_()
 
+    def closeEvent(self, event):
+        # Intraday quotes which are still in memory are written
+        self.portfolios.f_close()
+        super(GUI, self).closeEvent(event)
+
     def f_showWarnings(self, category, message):
 
-        if not self.Interface_CheckBox_ShowWarnings.isChecked(): return
+        if not self.Interface_CheckBox_ShowWarnings.isChecked() or not message: return
 
+        # Imported on first notification (it is slow to import and not needed at startup)
+        from win10toast import ToastNotifier
         toaster = ToastNotifier()
         toaster.show_toast(category, message, duration=10, icon_path=self.iconpath, threaded=True)
 
 if __name__ == "__main__":
+    # One-shot conversion of user_data.hdf5 written by an older version: Avanza_TT_V1.1.py --migrate [path]
+    if "--migrate" in sys.argv:
+        path = (sys.argv[sys.argv.index("--migrate") + 1:] or ["user_data.hdf5"])[0]
+        print("{} is converted to schema v{}".format(path, Schema.version) if Schema.f_migrate(path) else "{} is up to date".format(path))
+        sys.exit()
+
     QtWidgets.QApplication.setStyle("Fusion")
     app = QtWidgets.QApplication(sys.argv)
     prog = GUI()
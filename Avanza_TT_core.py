@@ -0,0 +1,1867 @@
+'''
+Created by Alexey.Klechikov@gmail.com
+
+Core of Avanza_TT: data from avanza.se, HDF5 storage and the refresh pipeline (fetch -> convert -> persist -> alert).
+Has no GUI dependencies, so it can run on a headless box:
+* Avanza_TT_core.py refresh - update prices, today's balance and snapshot
+* Avanza_TT_core.py backfill [--since 2026-01-01] - fill balances for the days when the program wasn't working
+* Avanza_TT_core.py watch --interval 60 - refresh every 60 minutes while the markets of the holdings are open
+* Avanza_TT_core.py analytics - returns, volatility, max drawdown and beta of the holdings
+* Avanza_TT_core.py --record on watch - also keep every intraday quote (intraday.hdf5)
+* Avanza_TT_core.py alerts --add yearChange "<" -20 --target 5361 - alert rules (checked with every refresh)
+'''
+
+import os, re, sys, copy, time, threading, shutil, argparse, importlib, json, functools, contextlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+import numpy as np
+from datetime import datetime, timedelta
+
+''' Module which is imported on first attribute access. Most of the startup time is spent importing pandas, h5py and requests '''
+class LazyModule:
+    def __init__(self, name):
+        self.__name, self.__module = name, None
+
+    def __getattr__(self, attribute):
+        # import_module holds the import lock, so the first access from several workers imports the module once
+        if self.__module is None: self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+pd, h5py, requests = LazyModule("pandas"), LazyModule("h5py"), LazyModule("requests")
+
+''' Timing of the refresh phases and of the requests per endpoint: histograms and the last samples (for p50 / p95), exported as JSON lines '''
+class Metrics:
+    # Upper bounds of the histogram buckets (seconds), samples kept per span, size of the metrics file before it is rotated and number of old files
+    buckets, window, maxBytes, backups = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60], 1024, 1024 * 1024, 3
+
+    def __init__(self):
+        # name -> counts per bucket (the last one is above all buckets), sum, errors, last samples
+        self.lock, self.histograms = threading.Lock(), {}
+
+        # Totals of the requests at the last summary (it reports the requests since then)
+        self.reported = 0, 0
+
+    def f_observe(self, name, seconds, error=False):
+        with self.lock:
+            if name not in self.histograms: self.histograms[name] = {"counts": np.zeros(len(self.buckets) + 1, dtype=np.int64), "sum": 0.0, "errors": 0, "samples": deque(maxlen=self.window)}
+            histogram = self.histograms[name]
+            histogram["counts"][np.searchsorted(self.buckets, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["errors"] += int(error)
+            histogram["samples"].append(seconds)
+
+    @contextlib.contextmanager
+    def f_span(self, name):
+        ''' with metrics.f_span("name"): ... - duration of the block (it is counted as an error if it raises) '''
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.f_observe(name, time.perf_counter() - started, True)
+            raise
+        self.f_observe(name, time.perf_counter() - started)
+
+    @staticmethod
+    def f_timed(name):
+        ''' Method decorator: span of every call in self.engine.metrics '''
+        def decorator(method):
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.engine.metrics.f_span(name): return method(self, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def f_stats(self):
+        ''' {name: count, errors, sum, last, p50, p95 (seconds, of the last samples), buckets (cumulative counts, Prometheus "le")} '''
+        with self.lock:
+            stats = {}
+            for name, histogram in self.histograms.items():
+                samples, counts = np.array(histogram["samples"]), np.cumsum(histogram["counts"])
+                p50, p95 = np.percentile(samples, [50, 95])
+                stats[name] = {"count": int(counts[-1]), "errors": histogram["errors"], "sum": round(histogram["sum"], 6), "last": round(samples[-1], 6), "p50": round(p50, 6), "p95": round(p95, 6),
+                               "buckets": dict(zip([str(i) for i in self.buckets] + ["+Inf"], counts.tolist()))}
+            return stats
+
+    def f_export(self, path):
+        ''' Append the current stats as one line to the metrics file. The file is rotated (path.1 ... path.{backups}) when it is bigger than maxBytes '''
+        if os.path.exists(path) and os.path.getsize(path) > self.maxBytes:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists("{}.{}".format(path, i)): os.replace("{}.{}".format(path, i), "{}.{}".format(path, i + 1))
+            os.replace(path, path + ".1")
+
+        with open(path, "a") as file: file.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "metrics": self.f_stats()}) + "\n")
+
+    def f_summary(self, name="refresh"):
+        ''' Short text for the status bar: last duration of the span with p50 / p95, requests and errors since the previous summary '''
+        stats = self.f_stats()
+        requests = sum(stats[i]["count"] for i in stats if i.startswith("http ")), sum(stats[i]["errors"] for i in stats if i.startswith("http "))
+        (count, errors), self.reported = [i - j for i, j in zip(requests, self.reported)], requests
+
+        text = "" if name not in stats else "{} {:.2f} s (p50 {:.2f}, p95 {:.2f}), ".format(name, stats[name]["last"], stats[name]["p50"], stats[name]["p95"])
+        return text + "{} requests".format(count) + ("" if not errors else ", {} errors".format(errors))
+
+''' One keep-alive session and a bounded worker pool shared by all requests to avanza.se '''
+class FetchEngine:
+    baseUrl, timeout, maxWorkers, interactiveWorkers = "https://www.avanza.se", (5, 20), 16, 4
+
+    def __init__(self, proxies=None):
+        self.proxies, self.__session, self.__lock = proxies or {}, None, threading.Lock()
+
+        # Timing of the requests (spans "http GET /path", numbers in the path are replaced by {id}) and of the refresh phases
+        self.metrics = Metrics()
+
+        # Validators of the endpoints which send ETag / Last-Modified: path -> (ETag, Last-Modified, data)
+        self.validators = {}
+
+        # False if the last request got no response (no connection, proxy or timeout). A refresh checks it instead of a request of its own
+        self.connected = True
+
+        # Workers do the requests, the dispatcher runs whole jobs (refresh) so the caller (GUI thread) is never blocked.
+        # Interactive requests (search, details, one holding) have their own workers, so they don't queue behind the requests of a refresh
+        self.pool = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix="fetch")
+        self.dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispatch")
+        self.interactive = ThreadPoolExecutor(max_workers=self.interactiveWorkers, thread_name_prefix="interactive")
+
+    @property
+    def session(self):
+        ''' Created on first request (in a worker), so requests is not imported before the window is shown '''
+        with self.__lock:
+            if self.__session is None:
+                # Connections are kept alive in the pool and reused by all workers, so a refresh costs one TLS handshake per connection
+                self.__session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.maxWorkers + self.interactiveWorkers)
+                self.__session.mount("https://", adapter)
+                self.__session.mount("http://", adapter)
+            return self.__session
+
+    def f_get(self, path, **kwargs):
+        return self.f_send("GET", path, **kwargs)
+
+    def f_post(self, path, **kwargs):
+        return self.f_send("POST", path, **kwargs)
+
+    def f_send(self, method, path, **kwargs):
+        ''' Request with its latency and errors (exception or status >= 400) counted per endpoint '''
+        name, started = "http {} {}".format(method, re.sub(r"\d+", "{id}", path)), time.perf_counter()
+        try:
+            response = self.session.request(method, self.baseUrl + path, proxies=self.proxies, timeout=self.timeout, **kwargs)
+        except Exception as error:
+            self.metrics.f_observe(name, time.perf_counter() - started, True)
+            if isinstance(error, (requests.ConnectionError, requests.Timeout)): self.connected = False
+            raise
+
+        self.metrics.f_observe(name, time.perf_counter() - started, response.status_code >= 400)
+        self.connected = True
+        return response
+
+    def f_getJson(self, path):
+        ''' JSON of the GET request (conditional if the endpoint sent ETag / Last-Modified before). Returns data and False if it is not modified '''
+        cached = self.validators.get(path)
+        headers = {} if cached is None else {name: value for name, value in [("If-None-Match", cached[0]), ("If-Modified-Since", cached[1])] if value}
+
+        response = self.f_get(path, headers=headers)
+        if response.status_code == 304 and cached is not None: return cached[2], False
+
+        data = response.json()
+        if response.headers.get("ETag") or response.headers.get("Last-Modified"): self.validators[path] = response.headers.get("ETag"), response.headers.get("Last-Modified"), data
+        return data, True
+
+    def f_map(self, function, items):
+        ''' Run function for every item in the worker pool. Returns results (in items order) and items that failed '''
+        items = list(items)
+        futures = [self.pool.submit(function, i) for i in items]
+
+        results, failed = [], []
+        for item, future in zip(items, futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                failed.append(item)
+
+        return results, failed
+
+    def f_submit(self, function, *args):
+        ''' Run a job in the background. Returns concurrent.futures.Future '''
+        return self.dispatcher.submit(function, *args)
+
+    def f_request(self, function, *args):
+        ''' Run a short job (a few requests) in the interactive workers, so it doesn't wait for the running refresh. Returns concurrent.futures.Future '''
+        return self.interactive.submit(function, *args)
+
+    def f_close(self):
+        self.dispatcher.shutdown(wait=False, cancel_futures=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.interactive.shutdown(wait=False, cancel_futures=True)
+        if self.__session is not None: self.__session.close()
+
+''' Each ticker has some info, here we select only what we will use in this program '''
+class Ticker:
+    chartDtype = np.dtype([("Date", "<i8"), ("Price", "<f8")])
+
+    # Quote is the same if these fields are the same
+    quoteKeys = ["lastPrice", "lastPriceUpdated", "changePercent"]
+
+    def __init__(self, tickerNumber, count, engine, history=None, data=None):
+
+        self.ticker = data if data is not None else engine.f_get('/_mobile/market/{0:s}/{1:d}'.format("stock", int(tickerNumber))).json()
+
+        self.number = tickerNumber
+        self.name = self.ticker['name']
+        self.changePercent = self.ticker['changePercent']
+        self.price_last = self.ticker['lastPrice']
+        date = datetime.strptime(self.ticker['lastPriceUpdated'][:19], "%Y-%m-%dT%H:%M:%S")
+        self.price_updateTime = date.strftime("%m/%d, %H:%M")
+        self.count = count
+        self.country = self.ticker['flagCode']
+        self.currency = self.ticker['currency']
+
+        # Some info is not presented in every ticker
+        if 'keyRatios' in self.ticker:
+            self.peRatio = np.NaN if 'priceEarningsRatio' not in self.ticker['keyRatios'] else self.ticker['keyRatios']['priceEarningsRatio']
+            self.volatility = np.NaN if 'volatility' not in self.ticker['keyRatios'] else self.ticker['keyRatios']['volatility']
+            self.directYield = np.NaN if 'directYield' not in self.ticker['keyRatios'] else self.ticker['keyRatios']['directYield']
+        else: self.peRatio, self.volatility, self.directYield = np.NaN, np.NaN, np.NaN
+
+        if 'company' in self.ticker: self.sector = np.NaN if 'sector' not in self.ticker['company'] else self.ticker['company']['sector']
+        else: self.sector = np.NaN
+
+        self.dividends = self.ticker["dividends"] if "dividends" in self.ticker else []
+        self.reports = self.ticker["companyReports"] if "companyReports" in self.ticker else []
+        self.price_oneWeek = self.ticker["priceOneWeekAgo"] if "priceOneWeekAgo" in self.ticker else np.NaN
+        self.price_oneMonth = self.ticker["priceOneMonthAgo"] if "priceOneMonthAgo" in self.ticker else np.NaN
+        self.price_sixMonth = self.ticker["priceSixMonthsAgo"] if "priceSixMonthsAgo" in self.ticker else np.NaN
+        self.price_oneYear = self.ticker["priceOneYearAgo"] if "priceOneYearAgo" in self.ticker else np.NaN
+
+        # Chartdata is taken on first use only (table refresh doesn't need it)
+        self.engine, self.history, self.__chartdata = engine, history, None
+
+    @classmethod
+    def f_fetch(cls, tickerNumber, count, engine, history=None, previous=None):
+        ''' Ticker with the last quote. previous (Ticker of the last refresh) is returned as it is if its quote didn't change '''
+        data, modified = engine.f_getJson('/_mobile/market/{0:s}/{1:d}'.format("stock", int(tickerNumber)))
+
+        # Tickers from the stored snapshot don't have all info, they are always replaced
+        if previous is not None and previous.ticker is not None and (not modified or all(data.get(key) == previous.ticker.get(key) for key in cls.quoteKeys)): return previous
+        with engine.metrics.f_span("ticker.init"): return cls(tickerNumber, count, engine, history, data)
+
+    @classmethod
+    def f_fromSnapshot(cls, row, engine, history=None):
+        ''' Ticker from a stored snapshot row (no requests). Used to show the last known data before the first refresh '''
+
+        self = cls.__new__(cls)
+        self.ticker, self.number, self.count, self.name = None, int(row["ID"]), int(row["Amount"]), Schema.f_text(row["Name"])
+        self.changePercent, self.price_last, self.price_updateTime = float(row["Change percent"]), float(row["Price last"]), Schema.f_text(row["Price update time"])
+        self.country, self.currency, self.sector = Schema.f_text(row["Country"]), Schema.f_text(row["Currency"]), Schema.f_text(row["Sector"]) or np.NaN
+        self.peRatio, self.volatility, self.directYield = float(row["P/E ratio"]), float(row["Volatility"]), float(row["Direct Yield"])
+        self.price_oneWeek, self.price_oneMonth, self.price_sixMonth, self.price_oneYear = float(row["Price one week"]), float(row["Price one month"]), float(row["Price six month"]), float(row["Price one year"])
+        self.dividends, self.reports = [], []
+
+        self.engine, self.history, self.__chartdata = engine, history, None
+        return self
+
+    @property
+    def chartdata(self):
+        if self.__chartdata is None:
+            if self.history is not None: self.__chartdata = self.history.f_read(self.number)
+            else: self.__chartdata = self.f_parseChart(self.f_chartArray(self.f_getChartPoints(self.engine, self.number)))
+        return self.__chartdata
+
+    @staticmethod
+    def f_getChartPoints(engine, tickerNumber, timePeriod='three_years'):
+        ''' Daily prices as they come from avanza.se: [[timestamp (ms), price or None], ...] '''
+
+        p, h = { "orderbookId": tickerNumber, "chartType": 'AREA', "chartResolution": 'DAY', "timePeriod": timePeriod},  {"Content-Type": "application/json"}
+        return engine.f_post('/ab/component/highstockchart/getchart/orderbook', data=json.dumps(p), headers=h).json().get('dataPoints', [])
+
+    @staticmethod
+    def f_chartArray(dataSeries):
+        ''' Typed array of chart points (Date - int64 ms, Price - float64) without missing prices '''
+
+        raw = np.array(dataSeries, dtype=np.float64).reshape(-1, 2)  # None -> NaN
+        raw = raw[~np.isnan(raw[:, 1])]
+
+        points = np.empty(len(raw), dtype=Ticker.chartDtype)
+        points["Date"], points["Price"] = raw[:, 0], raw[:, 1]
+        return points
+
+    @staticmethod
+    def f_parseChart(points):
+        ''' Chartdata DataFrame (columns: "Date" - datetime64, "Price" - float64) '''
+
+        # Daily points are stamped at midnight Stockholm time (22:00 / 23:00 UTC the day before), half a day shift gives the calendar day
+        dates = ((points["Date"] + 43200000) // 86400000).astype("datetime64[D]")
+        return pd.DataFrame({"Date": dates.astype("datetime64[ns]"), "Price": points["Price"]})
+
+''' Stocks search (global-search) with LRU cache. A longer query is answered from the cached result of its prefix if that result has all hits '''
+class InstrumentSearch:
+    maxSize, ttl = 256, 10 * 60
+
+    def __init__(self, engine):
+        self.engine, self.cache, self.lock = engine, OrderedDict(), threading.Lock()
+
+    def f_cached(self, query):
+        ''' Hits of the query from the cache (None if it has to be requested) '''
+        with self.lock:
+            for prefix in [query[:i] for i in range(len(query), 0, -1)]:
+                if prefix not in self.cache: continue
+
+                created, hits, complete = self.cache[prefix]
+                if time.time() - created > self.ttl:
+                    del self.cache[prefix]
+                    continue
+
+                if prefix == query or complete:
+                    self.cache.move_to_end(prefix)
+                    return hits if prefix == query else [i for i in hits if query.lower() in i[1].lower()]
+            return None
+
+    def f_search(self, query):
+        ''' Stocks [(orderbookId, name), ...] found by the query (may run in a background thread) '''
+        query = query.strip()
+        if not query: return []
+
+        hits = self.f_cached(query)
+        if hits is not None: return hits
+
+        groups = [i for i in self.engine.f_get('/_cqbe/search/global-search/global-search-template', params={"query": query}).json()["resultGroups"] if i["instrumentType"] == 'STOCK']
+        hits = [(str(hit['link']['orderbookId']), hit.get("name") or hit['link'].get("linkDisplay", "")) for group in groups for hit in group["hits"]]
+
+        # Result can be filtered for longer queries only if it is not cut
+        complete = all(group.get("numberOfHits", -1) == len(group["hits"]) for group in groups)
+
+        with self.lock:
+            self.cache[query] = time.time(), hits, complete
+            self.cache.move_to_end(query)
+            while len(self.cache) > self.maxSize: self.cache.popitem(last=False)
+        return hits
+
+''' Currency rates to SEK. Only the last price of a pair is requested and kept for ttl seconds, pairs which are not tracked are derived through the tracked ones '''
+class FxEngine:
+    base, ttl = "SEK", 300
+
+    def __init__(self, engine, ttl=None):
+        self.engine, self.lock = engine, threading.Lock()
+        if ttl is not None: self.ttl = ttl
+
+        # orderbookId -> (time of the request, rate, name of the pair)
+        self.cache = {}
+
+    def f_rate(self, tickerNumber):
+        ''' Last price and name of the pair (may run in a worker) '''
+        with self.lock: cached = self.cache.get(tickerNumber)
+        if cached is not None and time.time() - cached[0] < self.ttl: return cached[1], cached[2]
+
+        data, _ = self.engine.f_getJson('/_mobile/market/{0:s}/{1:d}'.format("stock", int(tickerNumber)))
+        with self.lock: self.cache[tickerNumber] = time.time(), float(data['lastPrice']), data['name']
+        return float(data['lastPrice']), data['name']
+
+    def f_fetch(self, currencyTickers):
+        ''' Rates of the pairs ({name: [rate, orderbookId]}) and orderbookIds which failed '''
+        results, failed = self.engine.f_map(lambda ticker: (int(ticker),) + self.f_rate(int(ticker)), currencyTickers)
+        return {name: [rate, ticker] for ticker, rate, name in results}, failed
+
+    @classmethod
+    def f_paths(cls, pairs, currencies):
+        ''' Chain of pairs from every currency to SEK: [(name of the pair, 1 or -1 for the inverse), ...], [] for SEK and None if there is no way to SEK '''
+
+        # Graph of the pairs, in both directions
+        edges = {}
+        for name in pairs:
+            pair = [i.strip().upper() for i in name.split("/")]
+            if len(pair) != 2: continue
+            edges.setdefault(pair[0], {})[pair[1]] = (name, 1)
+            edges.setdefault(pair[1], {})[pair[0]] = (name, -1)
+
+        # Breadth-first from SEK, so the shortest chain is used (direct pair if it is there)
+        paths, queue = {cls.base: []}, deque([cls.base])
+        while queue:
+            currency = queue.popleft()
+            for other in edges.get(currency, {}):
+                if other not in paths:
+                    paths[other] = [edges[other][currency]] + paths[currency]
+                    queue.append(other)
+
+        return [paths.get(i) for i in currencies]
+
+    @classmethod
+    def f_toBase(cls, currencyRates, currencies):
+        ''' Rate of every currency to SEK (NaN if there is no way to SEK): X/SEK, inverse of SEK/X or a chain of pairs (USD/EUR * EUR/SEK) '''
+        rates = {name: rate for name, (rate, _) in currencyRates.items() if rate and not np.isnan(rate)}
+        return np.array([np.nan if path is None else np.prod([rates[name] ** sign for name, sign in path]) for path in cls.f_paths(rates, currencies)], dtype=np.float64)
+
+''' Trading hours and holidays of the exchanges (by flagCode of the ticker). Markets which are not listed are open on weekdays '''
+class MarketCalendar:
+    # flagCode: UTC offset in winter (hours), daylight saving rule, opening and closing (local time)
+    exchanges = {"SE": (1, "EU", "09:00", "17:30"), "DK": (1, "EU", "09:00", "17:00"), "NO": (1, "EU", "09:00", "16:20"), "FI": (2, "EU", "10:00", "18:30"),
+                 "DE": (1, "EU", "09:00", "17:30"), "FR": (1, "EU", "09:00", "17:30"), "NL": (1, "EU", "09:00", "17:30"), "GB": (0, "EU", "08:00", "16:30"),
+                 "US": (-5, "US", "09:30", "16:00"), "CA": (-5, "US", "09:30", "16:00")}
+
+    # Holidays: ("date", month, day), ("observed", month, day) - moved to Friday / Monday from weekend, ("substitute", month, day) - moved from weekend to the next free weekday, ("easter", days from Easter Sunday),
+    # ("nth", month, weekday, n) - n-th weekday of the month (-1 - last), ("after", month, day, weekday) - first weekday on or after the date
+    holidays = {"SE": [("date", 1, 1), ("date", 1, 6), ("date", 5, 1), ("date", 6, 6), ("date", 12, 24), ("date", 12, 25), ("date", 12, 26), ("date", 12, 31), ("easter", -2), ("easter", 1), ("easter", 39), ("after", 6, 19, 4)],
+                "DK": [("date", 1, 1), ("date", 6, 5), ("date", 12, 24), ("date", 12, 25), ("date", 12, 26), ("date", 12, 31), ("easter", -3), ("easter", -2), ("easter", 1), ("easter", 39), ("easter", 40), ("easter", 50)],
+                "NO": [("date", 1, 1), ("date", 5, 1), ("date", 5, 17), ("date", 12, 24), ("date", 12, 25), ("date", 12, 26), ("date", 12, 31), ("easter", -3), ("easter", -2), ("easter", 1), ("easter", 39), ("easter", 50)],
+                "FI": [("date", 1, 1), ("date", 1, 6), ("date", 5, 1), ("date", 12, 6), ("date", 12, 24), ("date", 12, 25), ("date", 12, 26), ("date", 12, 31), ("easter", -2), ("easter", 1), ("after", 6, 19, 4)],
+                "DE": [("date", 1, 1), ("date", 5, 1), ("date", 12, 24), ("date", 12, 25), ("date", 12, 26), ("date", 12, 31), ("easter", -2), ("easter", 1)],
+                "FR": [("date", 1, 1), ("date", 5, 1), ("date", 12, 25), ("date", 12, 26), ("easter", -2), ("easter", 1)],
+                "NL": [("date", 1, 1), ("date", 5, 1), ("date", 12, 25), ("date", 12, 26), ("easter", -2), ("easter", 1)],
+                "GB": [("substitute", 1, 1), ("substitute", 12, 25), ("substitute", 12, 26), ("easter", -2), ("easter", 1), ("nth", 5, 0, 1), ("nth", 5, 0, -1), ("nth", 8, 0, -1)],
+                "US": [("observed", 1, 1), ("observed", 6, 19), ("observed", 7, 4), ("observed", 12, 25), ("easter", -2), ("nth", 1, 0, 3), ("nth", 2, 0, 3), ("nth", 5, 0, -1), ("nth", 9, 0, 1), ("nth", 11, 3, 4)],
+                "CA": [("substitute", 1, 1), ("substitute", 7, 1), ("substitute", 12, 25), ("substitute", 12, 26), ("easter", -2), ("nth", 2, 0, 3), ("after", 5, 18, 0), ("nth", 8, 0, 1), ("nth", 9, 0, 1), ("nth", 10, 0, 2)]}
+
+    # Refreshes are more often (nearEdgeStep) during the first and the last nearEdge seconds of the trading day. Closing prices are taken closeGrace seconds after closing
+    nearEdge, nearEdgeStep, closeGrace = 30 * 60, 5 * 60, 5 * 60
+
+    @staticmethod
+    def f_easter(year):
+        ''' Easter Sunday (Gregorian calendar, anonymous algorithm) '''
+        a, b, c = year % 19, year // 100, year % 100
+        d, e, f = b // 4, b % 4, (b + 8) // 25
+        h = (19 * a + b - d - (b - f + 1) // 3 + 15) % 30
+        l = (32 + 2 * e + 2 * (c // 4) - h - c % 4) % 7
+        m = (a + 11 * h + 22 * l) // 451
+        return datetime(year, (h + l - 7 * m + 114) // 31, (h + l - 7 * m + 114) % 31 + 1).date()
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def f_holidays(cls, flagCode, year):
+        days = set()
+        for rule in cls.holidays.get(flagCode, []):
+            if rule[0] == "date": days.add(datetime(year, rule[1], rule[2]).date())
+            elif rule[0] == "easter": days.add(cls.f_easter(year) + timedelta(days=rule[1]))
+            elif rule[0] == "observed":
+                day = datetime(year, rule[1], rule[2]).date()
+                days.add(day - timedelta(days=1) if day.weekday() == 5 else day + timedelta(days=1) if day.weekday() == 6 else day)
+            elif rule[0] == "substitute":
+                day = datetime(year, rule[1], rule[2]).date()
+                while day.weekday() > 4 or day in days: day += timedelta(days=1)
+                days.add(day)
+            elif rule[0] == "after":
+                day = datetime(year, rule[1], rule[2]).date()
+                days.add(day + timedelta(days=(rule[3] - day.weekday()) % 7))
+            elif rule[0] == "nth":
+                first = datetime(year, rule[1], 1).date()
+                if rule[3] > 0: days.add(first + timedelta(days=(rule[2] - first.weekday()) % 7 + 7 * (rule[3] - 1)))
+                else:
+                    last = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+                    days.add(last - timedelta(days=(last.weekday() - rule[2]) % 7))
+        return days
+
+    @classmethod
+    def f_utcOffset(cls, flagCode, utc):
+        ''' Hours between local time of the exchange and UTC (naive datetime) '''
+        offset, rule = cls.exchanges[flagCode][:2]
+        lastSunday = lambda month: max(day for day in [datetime(utc.year, month, 31 - i) for i in range(7)] if day.weekday() == 6)
+        if rule == "EU":
+            # From the last Sunday of March to the last Sunday of October, 01:00 UTC
+            summer = lastSunday(3) + timedelta(hours=1) <= utc < lastSunday(10) + timedelta(hours=1)
+        else:
+            # From the second Sunday of March to the first Sunday of November, 02:00 local time
+            march, november = datetime(utc.year, 3, 1), datetime(utc.year, 11, 1)
+            start = march + timedelta(days=(6 - march.weekday()) % 7 + 7, hours=2 - offset)
+            end = november + timedelta(days=(6 - november.weekday()) % 7, hours=2 - offset - 1)
+            summer = start <= utc < end
+        return offset + (1 if summer else 0)
+
+    @classmethod
+    def f_session(cls, flagCode, utc):
+        ''' Opening and closing (UTC) of the trading day which is going on or is next '''
+        for days in range(15):
+            if flagCode not in cls.exchanges:
+                day = (utc + timedelta(days=days)).date()
+                if day.weekday() > 4: continue
+                opening, closing = datetime.combine(day, datetime.min.time()), datetime.combine(day, datetime.min.time()) + timedelta(days=1)
+            else:
+                offset = cls.f_utcOffset(flagCode, utc + timedelta(days=days))
+                day = (utc + timedelta(days=days, hours=offset)).date()
+                if day.weekday() > 4 or day in cls.f_holidays(flagCode, day.year): continue
+                opening, closing = [datetime.combine(day, datetime.strptime(i, "%H:%M").time()) - timedelta(hours=offset) for i in cls.exchanges[flagCode][2:]]
+            if closing > utc: return opening, closing
+        return None
+
+    @classmethod
+    def f_isOpen(cls, flagCode, utc, grace=0):
+        ''' Market is trading at utc (or closed less than grace seconds ago) '''
+        session = cls.f_session(flagCode, utc - timedelta(seconds=grace))
+        return session is not None and session[0] <= utc
+
+    @classmethod
+    def f_nextRefresh(cls, flagCodes, utc, interval):
+        ''' Seconds to the next refresh: interval while any market is open (shorter near opening and closing), otherwise until the next opening '''
+
+        sessions = [i for i in [cls.f_session(flagCode, utc) for flagCode in set(flagCodes) or {""}] if i is not None]
+        if not sessions: return interval
+
+        opened = [i for i in sessions if i[0] <= utc]
+        step = interval if not opened else min(interval, cls.nearEdgeStep) if any((utc - i[0]).total_seconds() < cls.nearEdge or (i[1] - utc).total_seconds() < cls.nearEdge for i in opened) else interval
+
+        # Don't miss the opening of the other markets and the closing prices
+        edges = [i[0] + timedelta(seconds=60) for i in sessions if i[0] > utc] + [i[1] + timedelta(seconds=60) for i in opened]
+        wait = min([(i - utc).total_seconds() for i in edges] + ([step] if opened else []))
+        return max(wait, 30)
+
+''' Local daily prices for every orderbookId (history.hdf5). When the cache is warm only the last days are downloaded and appended '''
+class HistoryCache:
+    # Shortest chart period which covers the missing days. Cache is not rechecked more often than maxAge (seconds)
+    periods, maxAge = [(7, "one_week"), (31, "one_month"), (92, "three_months"), (366, "one_year"), (1096, "three_years")], 15 * 60
+
+    # Free rows after the stored points of every ticker (about two years of days, the dataset is moved when they are used up)
+    spare = 512
+
+    def __init__(self, engine, path="history.hdf5"):
+        self.engine, self.path, self.lock, self.data = engine, path, threading.Lock(), {}
+
+        # Goes up with every download, so results computed from the history know when they are outdated
+        self.generation = 0
+
+        # key -> (contiguous, size, capacity, checked, date of the last point) of the stored points
+        self.layout = None
+
+    def f_read(self, tickerNumber, start=None, stop=None):
+        ''' Chartdata (columns: "Date", "Price") from the local store, topped up from avanza.se if it is outdated '''
+        return Ticker.f_parseChart(self.f_points(tickerNumber, start, stop))
+
+    def f_points(self, tickerNumber, start=None, stop=None):
+        ''' Same as f_read, typed array of chart points (Ticker.chartDtype) of the days in [start, stop].
+        Whole series are kept in memory (and topped up there). Days of a ticker which is not in memory are read from the file, if it is fresh '''
+        key = str(int(tickerNumber))
+
+        # Points are stamped at midnight Stockholm time, so the calendar day starts half a day before
+        first = None if start is None else np.datetime64(start, "D").astype(np.int64) * 86400000 - 43200000
+        last = None if stop is None else (np.datetime64(stop, "D").astype(np.int64) + 1) * 86400000 - 43200000
+
+        if key not in self.data:
+            with self.lock: layout = self.f_layout().get(key)
+            if layout is not None and (first is not None or last is not None) and self.f_isFresh(layout[4], layout[3]): return self.f_load(key, first, last)
+            self.data[key] = self.f_load(key), 0 if layout is None else layout[3]
+        points, checked = self.data[key]
+
+        if not self.f_isFresh(points["Date"][-1] if len(points) else None, checked):
+            # Days since the last stored one (it is downloaded again, it could be stored before the market closed)
+            days = self.periods[-1][0] if not len(points) else (datetime.now() - datetime.fromtimestamp(points["Date"][-1] / 1000)).days + 1
+            period = [p for d, p in self.periods if d >= days or p == self.periods[-1][1]][0]
+
+            new = Ticker.f_chartArray(Ticker.f_getChartPoints(self.engine, int(tickerNumber), period))
+
+            keep = len(points) if not len(new) else Schema.f_bisect(points["Date"], new["Date"][0])
+            points, checked = np.concatenate([points[:keep], new]), time.time()
+            self.data[key] = self.f_store(key, points, keep, checked)
+            with self.lock: self.generation += 1
+
+        first = 0 if first is None else Schema.f_bisect(points["Date"], first)
+        last = len(points) if last is None else Schema.f_bisect(points["Date"], last)
+        return points[first:max(first, last)]
+
+    def f_isFresh(self, latest, checked):
+        ''' latest - date of the last stored point (ms, None if nothing is stored) '''
+        if latest is None: return False
+        if time.time() - checked < self.maxAge: return True
+
+        # Weekend after the last business day is stored - nothing new to download
+        today = np.datetime64(datetime.now().date())
+        lastStored = np.datetime64(datetime.fromtimestamp(latest / 1000).date())
+        return not np.is_busday(today) and lastStored >= np.busday_offset(today, 0, roll="backward")
+
+    def f_layout(self, file=None):
+        ''' Where the points of every ticker are stored (read once, then kept up to date by f_store). Called with the lock held '''
+        if self.layout is None:
+            self.layout = {}
+            if file is None and not os.path.exists(self.path): return self.layout
+
+            with (contextlib.nullcontext(file) if file is not None else h5py.File(self.path, "r")) as file:
+                for key, dataset in file.items():
+                    # Chunked (compressed) datasets of older versions are moved to the contiguous layout with the next download
+                    size = int(dataset.attrs.get("Size", dataset.shape[0]))
+                    self.layout[key] = dataset.chunks is None, size, dataset.shape[0], float(dataset.attrs["Checked"]), int(dataset[size - 1]["Date"]) if size else None
+        return self.layout
+
+    def f_load(self, key, first=None, last=None):
+        ''' Stored points with first <= Date < last (ms, None - from the first / to the last stored point). Only these rows are read '''
+        with self.lock:
+            layout = self.f_layout().get(key)
+            if layout is None or not layout[1]: return np.zeros(0, dtype=Ticker.chartDtype)
+
+            # Rows are read straight into the array. The file is not memory mapped: a mapped file can't be resized on Windows
+            with h5py.File(self.path, "r") as file:
+                dataset, size = file[key], layout[1]
+                first = 0 if first is None else Schema.f_bisect(dataset.fields("Date"), first, size)
+                last = size if last is None else Schema.f_bisect(dataset.fields("Date"), last, size)
+                points = np.zeros(max(0, last - first), dtype=Ticker.chartDtype)
+                if len(points): dataset.read_direct(points, np.s_[first:last])
+            return points
+
+    def f_store(self, key, points, keep, checked):
+        ''' Write points[keep:] (rows from "keep" are rewritten). Returns the stored points and checked '''
+        with self.lock:
+            with h5py.File(self.path, "a") as file:
+                layout = self.f_layout(file).get(key)
+
+                # Contiguous, uncompressed dataset with free rows for the next days, so it is appended in place
+                if layout is None or not layout[0] or layout[2] < len(points):
+                    # Written before the old one is deleted, so the points are not lost if the write fails
+                    if key + ".new" in file: del file[key + ".new"]
+                    dataset = file.create_dataset(key + ".new", shape=(len(points) + self.spare,), dtype=Ticker.chartDtype)
+                    dataset[:len(points)] = points
+                    if key in file: del file[key]
+                    file.move(key + ".new", key)
+                    dataset = file[key]
+                else:
+                    dataset = file[key]
+                    if len(points) > keep: dataset[keep:len(points)] = points[keep:]
+
+                dataset.attrs["Size"], dataset.attrs["Checked"] = len(points), checked
+                self.layout[key] = True, len(points), dataset.shape[0], checked, int(points["Date"][-1]) if len(points) else None
+
+            return points, checked
+
+''' Fixed-size buffer of typed rows. When it is full, the oldest rows are overwritten '''
+class RingBuffer:
+
+    def __init__(self, size, dtype):
+        # Rows ever added and rows read (positions in the buffer are modulo its size)
+        self.data, self.written, self.read = np.zeros(size, dtype=dtype), 0, 0
+
+    def f_push(self, row):
+        ''' Add a row. Returns number of rows dropped (overwritten before they were read) '''
+        self.data[self.written % len(self.data)] = row
+        self.written += 1
+
+        dropped = max(0, self.written - self.read - len(self.data))
+        self.read += dropped
+        return dropped
+
+    def f_drain(self):
+        ''' Rows which were not read yet, oldest first '''
+        rows = self.data[np.arange(self.read, self.written) % len(self.data)]
+        self.read = self.written
+        return rows
+
+''' Alert rules over the quotes of all holdings and the drawdown of every portfolio, evaluated with one numpy comparison (Rules x Columns).
+A rule fires again for the same column only after its cooldown. Rules, times of the alerts and the last values are kept in alerts.json '''
+class Alerts:
+    # Values the rules test. Instruments: price, change today and since the reference prices (%), P/E, yield. Portfolios: drawdown from the highest balance (%)
+    fields = ["price", "changePercent", "weekChange", "monthChange", "sixMonthChange", "yearChange", "peRatio", "directYield", "drawdown"]
+    operators = ["<", ">", "crosses below", "crosses above"]
+
+    # Seconds before a rule fires again for the same column while its condition holds
+    cooldown = 6 * 3600
+
+    # Nothing has fired yet (see fired)
+    noAlerts = [], [], np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+
+    def __init__(self, path="alerts.json"):
+        # Rules are kept in alerts.json (edited by hand or with the command line), the state in numpy arrays next to it (alerts.npz)
+        self.path, self.statePath, self.lock = path, os.path.splitext(path)[0] + ".npz", threading.Lock()
+
+        # Rules: {"id", "field", "op", "level", "target" (orderbookId or portfolio name, every column if not set), "cooldown"}
+        # fired: rule ids, columns, and rule, column and time of every alert (arrays, the ones of the checked pairs after every evaluation)
+        # last: columns and values (Fields x Columns) of the last evaluation (for "crosses" rules)
+        self.rules, self.fired, self.last = [], self.noAlerts, ([], np.zeros((len(self.fields), 0)))
+
+        # Rules as arrays (see f_compile) and the pairs to check (see f_pairs), rebuilt when the rules change; longest cooldown
+        self.compiled, self.pairs, self.longest = None, None, self.cooldown
+
+        # Rules / state changed since the files were read or written (the state only if an alert fired or the values moved)
+        self.unsaved, self.unsavedState = False, False
+
+    def f_read(self):
+        with self.lock:
+            self.rules, self.fired, self.last, legacy = [], self.noAlerts, ([], np.zeros((len(self.fields), 0))), False
+            if os.path.exists(self.path):
+                with open(self.path) as file: data = json.load(file)
+                self.rules, legacy = data.get("rules", []), "fired" in data or "last" in data
+
+                # Older versions kept the state in alerts.json: fired - {"rule id|column": time}, last - {column: values} (values of another list of fields are dropped)
+                keys, last = [key.partition("|") for key in data.get("fired", {})], {column: values for column, values in data.get("last", {}).items() if len(values) == len(self.fields)}
+                ids, columns = {i[0]: None for i in keys}, {i[2]: None for i in keys}
+                ids, columns = {rule: n for n, rule in enumerate(ids)}, {column: n for n, column in enumerate(columns)}
+                rows, cols = np.array([ids[i[0]] for i in keys], dtype=np.intp), np.array([columns[i[2]] for i in keys], dtype=np.intp)
+                self.fired = list(ids), list(columns), rows, cols, np.array(list(data.get("fired", {}).values()), dtype=np.float64)
+                self.last = list(last), np.array(list(last.values()), dtype=np.float64).reshape(len(last), len(self.fields)).T
+
+            if os.path.exists(self.statePath):
+                with np.load(self.statePath) as state:
+                    self.fired = state["ids"].tolist(), state["columns"].tolist(), state["rows"].astype(np.intp), state["cols"].astype(np.intp), state["fired"]
+                    self.last = (state["lastColumns"].tolist(), state["last"]) if state["fields"].tolist() == self.fields else ([], np.zeros((len(self.fields), 0)))
+
+            # Files of older versions are written in the new format with the next f_write
+            self.compiled, self.pairs, self.unsaved, self.unsavedState = None, None, legacy, legacy
+
+    def f_write(self):
+        ''' Rules and state, the ones which changed. Written aside and swapped in, so a crash never leaves a half-written file '''
+        with self.lock:
+            if self.unsaved:
+                with open(self.path + ".new", "w") as file: json.dump({"rules": self.rules}, file)
+                os.replace(self.path + ".new", self.path)
+                self.unsaved = False
+
+            if self.unsavedState:
+                # Alerts whose cooldown is over are not needed any more
+                ids, columns, rows, cols, fired = self.fired
+                keep = fired > time.time() - self.longest
+                with open(self.statePath + ".new", "wb") as file:
+                    np.savez(file, ids=np.array(ids, dtype=str), columns=np.array(columns, dtype=str), rows=rows[keep].astype(np.int32), cols=cols[keep].astype(np.int32), fired=fired[keep],
+                             fields=np.array(self.fields), lastColumns=np.array(self.last[0], dtype=str), last=self.last[1])
+                os.replace(self.statePath + ".new", self.statePath)
+                self.unsavedState = False
+
+    def f_add(self, field, op, level, target=None, cooldown=None, id=None):
+        ''' Add a rule (or replace the one with the same id). Returns the rule '''
+        if field not in self.fields: raise ValueError("Field should be one of: " + ", ".join(self.fields))
+        if op not in self.operators: raise ValueError("Operator should be one of: " + ", ".join(self.operators))
+
+        rule = {"id": str(id or "{}{}{}{}".format(field, op.replace(" ", "-"), level, "" if target is None else "@" + str(target))), "field": field, "op": op, "level": float(level)}
+        if target is not None: rule["target"] = target
+        if cooldown is not None: rule["cooldown"] = float(cooldown)
+
+        with self.lock:
+            self.rules, self.compiled, self.pairs, self.unsaved = [i for i in self.rules if i["id"] != rule["id"]] + [rule], None, None, True
+        return rule
+
+    def f_remove(self, id):
+        with self.lock:
+            count = len(self.rules)
+            self.rules, self.compiled, self.pairs = [i for i in self.rules if i["id"] != id], None, None
+            if len(self.rules) < count: self.unsaved = True
+        return len(self.rules) < count
+
+    @staticmethod
+    def f_column(target):
+        ''' Column of the rule's target: "orderbookId", "portfolio:name" or "" (every column) '''
+        if target is None: return ""
+        return str(target) if isinstance(target, int) else "portfolio:" + target
+
+    @classmethod
+    def f_compile(cls, rules):
+        ''' Rules as arrays: ids, field rows, sides (1 - above, -1 - below), levels, crossing, target columns, cooldowns '''
+        return (np.array([str(i["id"]) for i in rules], dtype=object),
+                np.array([cls.fields.index(i["field"]) for i in rules], dtype=np.intp),
+                np.array([1.0 if i["op"] in (">", "crosses above") else -1.0 for i in rules], dtype=np.float64),
+                np.array([i["level"] for i in rules], dtype=np.float64),
+                np.array([i["op"].startswith("crosses") for i in rules], dtype=bool),
+                np.array([cls.f_column(i.get("target")) for i in rules], dtype=str),
+                np.array([i.get("cooldown", cls.cooldown) for i in rules], dtype=np.float64))
+
+    @classmethod
+    def f_values(cls, tickers):
+        ''' Fields x Tickers matrix (drawdown is NaN, it is a value of a portfolio) '''
+        column = lambda attribute: np.array([getattr(ticker, attribute) for ticker in tickers], dtype=np.float64)
+
+        price = column("price_last")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            references = [(price / column(i) - 1) * 100 for i in ["price_oneWeek", "price_oneMonth", "price_sixMonth", "price_oneYear"]]
+        return np.vstack([price, column("changePercent")] + references + [column("peRatio"), column("directYield"), np.full(len(tickers), np.nan)]).reshape(len(cls.fields), len(tickers))
+
+    def f_pairs(self, ids, targets, columns):
+        ''' Rule and column of every pair to check (a rule with a target - one pair, without - one per column) and the time of its last alert.
+        Rebuilt only when the rules or the columns change. Called with the lock held '''
+        key = tuple(ids), tuple(targets), tuple(columns)
+        if self.pairs is not None and self.pairs[0] == key: return self.pairs[1:]
+
+        index = {column: i for i, column in enumerate(columns)}
+        targeted, everywhere = [i for i, target in enumerate(targets.tolist()) if target in index], np.flatnonzero(targets == "")
+
+        rows = np.concatenate([np.array(targeted, dtype=np.intp), np.repeat(everywhere, len(columns))])
+        cols = np.concatenate([np.array([index[targets[i]] for i in targeted], dtype=np.intp), np.tile(np.arange(len(columns)), len(everywhere))])
+        fired = self.f_place(self.fired, ids.tolist(), columns, rows, cols)
+
+        # The new pairs hold the alerts from now on (their times are updated by f_evaluate)
+        self.pairs, self.fired = (key, rows, cols, fired), (ids.tolist(), columns, rows, cols, fired)
+        return rows, cols, fired
+
+    @staticmethod
+    def f_place(fired, ids, columns, rows, cols):
+        ''' Times of the alerts (see fired) on the pairs of these rules and columns (-inf - never fired) '''
+        oldIds, oldColumns, oldRows, oldCols, times = fired
+        result = np.full(len(rows), -np.inf)
+        if not len(rows) or not len(times): return result
+
+        # Rule and column of every alert in the new lists (-1 - not there any more)
+        rules, index = {rule: i for i, rule in enumerate(ids)}, {column: i for i, column in enumerate(columns)}
+        rule = np.array([rules.get(i, -1) for i in oldIds] + [-1], dtype=np.intp)[oldRows]
+        column = np.array([index.get(i, -1) for i in oldColumns] + [-1], dtype=np.intp)[oldCols]
+        valid = (rule >= 0) & (column >= 0)
+
+        # Pairs are found by rule * columns + column (sorted once, then one binary search for all alerts)
+        keys, wanted = rows * len(columns) + cols, rule[valid] * len(columns) + column[valid]
+        order = np.argsort(keys)
+        at = np.minimum(np.searchsorted(keys[order], wanted), len(keys) - 1)
+        found = keys[order][at] == wanted
+        result[order[at[found]]] = times[valid][found]
+        return result
+
+    def f_evaluate(self, columns, values, extra=(), now=None):
+        '''
+        Rules of the file and extra rules (not saved) over the values (Fields x Columns, columns - their names).
+        Returns alerts: [{"rule": rule, "column": column, "value": value}], only the ones which are not in cooldown
+        '''
+        now, extra, columns = time.time() if now is None else now, list(extra), list(columns)
+
+        with self.lock:
+            if self.compiled is None: self.compiled = self.f_compile(self.rules)
+            rules = self.rules + extra
+            ids, fields, sides, levels, crossing, targets, cooldowns = [np.concatenate([a, b]) for a, b in zip(self.compiled, self.f_compile(extra))] if extra else self.compiled
+            rows, cols, fired = self.f_pairs(ids, targets, columns)
+
+            # Values of the last evaluation (NaN for new columns, nothing crosses from an unknown value)
+            lastColumns, lastValues = self.last
+            if lastColumns == columns: previous = lastValues
+            else:
+                stored = {column: i for i, column in enumerate(lastColumns)}
+                previous = np.hstack([lastValues, np.full((len(self.fields), 1), np.nan)])[:, [stored.get(column, -1) for column in columns]]
+
+            # Every pair is one element: the value of the rule's field in the column against the rule's level
+            side, level = sides[rows], levels[rows]
+            with np.errstate(invalid="ignore"):
+                beyond = side * (values[fields[rows], cols] - level) > 0
+                crossed = beyond & (side * (previous[fields[rows], cols] - level) <= 0)
+            ready = np.where(crossing[rows], crossed, beyond) & (now - fired >= cooldowns[rows])
+            fired[ready] = now
+
+            alerts = []
+            for pair in np.flatnonzero(ready).tolist():
+                rule, column = rows[pair], cols[pair]
+                alerts.append({"rule": rules[rule], "column": columns[column], "value": float(values[fields[rule], column])})
+
+            self.longest = max(cooldowns.max(initial=0), self.cooldown)
+            if alerts: self.unsavedState = True
+            if lastColumns != columns or not np.array_equal(lastValues, values, equal_nan=True): self.last, self.unsavedState = (columns, np.array(values, dtype=np.float64)), True
+
+        return alerts
+
+    @staticmethod
+    def f_text(alert, name=None):
+        ''' "Name: changePercent -3.1 (< -2)" '''
+        rule = alert["rule"]
+        return "{}: {} {:.2f} ({} {:g})".format(name or alert["column"], rule["field"], alert["value"], rule["op"], rule["level"])
+
+''' Intraday quotes (optional recording). Every refresh adds the updated quotes to a ring buffer per instrument (memory only, so a refresh never waits for the disk),
+a background thread appends them to intraday.hdf5: one append-only, compressed table per orderbookId (Schema.intraday rows) '''
+class IntradayRecorder:
+    # Quotes kept in memory per instrument, seconds between writes, rows per chunk (times go up by minutes and prices change little, so chunks are compressed well)
+    size, interval, chunks = 4096, 60, 4096
+
+    # Shared by all recorders: a recorder which is switched off writes its last quotes in the background, maybe while the next one already writes
+    fileLock = threading.Lock()
+
+    def __init__(self, path="intraday.hdf5", metrics=None, interval=None):
+        self.path, self.metrics, self.interval = path, metrics or Metrics(), interval or self.interval
+        self.lock = threading.Lock()
+
+        # orderbookId -> RingBuffer and time of its last quote; quotes dropped because the writer was behind or failed; instruments whose quote time couldn't be read
+        self.buffers, self.last, self.dropped, self.invalid = {}, {}, 0, set()
+
+        self.wakeup, self.closed = threading.Event(), False
+        self.thread = threading.Thread(target=self.f_run, name="IntradayRecorder", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def f_time(text):
+        ''' lastPriceUpdated ("2026-01-01T09:00:00.000+0100", milliseconds may be missing) as ms since 1970 '''
+        try: stamp = datetime.fromisoformat(text)
+        # Python before 3.11 reads only "+01:00" offsets
+        except ValueError: stamp = datetime.fromisoformat(re.sub(r"([+-]\d\d)(\d\d)$", r"\1:\2", text.replace("Z", "+00:00")))
+        return int(stamp.timestamp() * 1000)
+
+    def f_record(self, tickers):
+        ''' Add the quotes of the tickers which were updated since the last call (tickers from the stored snapshot have no quote) '''
+        rows = []
+        for ticker in tickers:
+            if ticker.ticker is None: continue
+            try: rows.append((ticker.number, self.f_time(ticker.ticker["lastPriceUpdated"]), float(ticker.price_last), float(ticker.changePercent)))
+            except (KeyError, ValueError, TypeError) as error:
+                # Reported once per instrument, its quotes are not recorded
+                if ticker.number not in self.invalid: print("Intraday quotes of {} are not recorded: {!r}".format(ticker.number, error), file=sys.stderr)
+                self.invalid.add(ticker.number)
+
+        with self.lock:
+            for number, stamp, price, changePercent in rows:
+                if stamp <= self.last.get(number, -1): continue
+                if number not in self.buffers: self.buffers[number] = RingBuffer(self.size, Schema.intraday)
+                self.dropped += self.buffers[number].f_push((stamp, price, changePercent))
+                self.last[number] = stamp
+
+    def f_run(self):
+        while not self.closed:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.f_flush()
+
+    def f_flush(self):
+        ''' Append the buffered quotes to the file (in the writer thread). Returns number of written rows '''
+        with self.lock: pending = {number: rows for number, rows in [(number, buffer.f_drain()) for number, buffer in self.buffers.items()] if len(rows)}
+        if not pending: return 0
+
+        # A failed write is counted as an error of the "intraday.write" span
+        written = 0
+        try:
+            with self.fileLock, self.metrics.f_span("intraday.write"), h5py.File(self.path, "a") as file:
+                for number, rows in pending.items():
+                    key = str(number)
+                    if key not in file: dataset = file.create_dataset(key, shape=(0,), dtype=Schema.intraday, maxshape=(None,), chunks=(self.chunks,), compression="gzip", shuffle=True)
+                    else: dataset = file[key]
+
+                    # Quotes which are already in the file (recorded before a restart) are not added again
+                    size = dataset.shape[0]
+                    if size > 0: rows = rows[rows["Time"] > dataset[size - 1]["Time"]]
+
+                    dataset.resize((size + len(rows),))
+                    if len(rows) > 0: dataset[size:] = rows
+                    written += len(rows)
+        except Exception as error:
+            with self.lock: self.dropped += sum(len(rows) for rows in pending.values()) - written
+            print("Intraday quotes are not written to {}: {!r}".format(self.path, error), file=sys.stderr)
+
+        return written
+
+    @classmethod
+    def f_read(cls, path, tickerNumber, start=None, stop=None):
+        ''' Written quotes of the instrument with times in [start, stop) (ms since 1970), only the chunks of these rows are read '''
+        key = str(int(tickerNumber))
+        with cls.fileLock:
+            if not os.path.exists(path): return np.zeros(0, dtype=Schema.intraday)
+
+            with h5py.File(path, "r") as file:
+                if key not in file: return np.zeros(0, dtype=Schema.intraday)
+
+                dataset = file[key]
+                first = 0 if start is None else Schema.f_bisect(dataset.fields("Time"), start)
+                last = dataset.shape[0] if stop is None else Schema.f_bisect(dataset.fields("Time"), stop)
+                return dataset[first:max(first, last)]
+
+    def f_close(self):
+        ''' Stop the writer, quotes which are still in memory are written '''
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.f_flush()
+
+''' Returns, volatility, drawdown, beta and correlations of the holdings and of the whole portfolio from the local history.
+All holdings are aligned on one date index (Days x Tickers matrix), so every measure is computed for all of them with one numpy operation '''
+class Analytics:
+    # Trading days in a year, windows of the returns (trading days), window of the rolling volatility
+    yearDays, windows, volatilityWindow = 252, {"1M": 21, "3M": 63, "1Y": 252}, 63
+
+    def __init__(self, history):
+        self.history, self.lock = history, threading.Lock()
+
+        # Key of the last result (holdings, rates, history generation) and the result
+        self.cache = None, None
+
+    def f_points(self, tickers):
+        ''' Chart points of every ticker from the local history (topped up from avanza.se in the worker pool), empty if it failed '''
+        points = dict(self.history.engine.f_map(lambda ticker: (ticker, self.history.f_points(ticker)), tickers)[0])
+        return [points.get(ticker, np.zeros(0, dtype=Ticker.chartDtype)) for ticker in tickers]
+
+    @staticmethod
+    def f_matrix(points):
+        ''' Days (datetime64[D]) and prices (Days x Tickers). Gaps (holidays of one market) take the last price, days before the first price are NaN '''
+        count = len(points)
+
+        # Calendar day of every point (stamped at midnight Stockholm time) and its column
+        days = [(i["Date"] + 43200000) // 86400000 for i in points]
+        allDays, columns = np.concatenate(days + [np.zeros(0, dtype=np.int64)]), np.repeat(np.arange(count), [len(i) for i in days])
+        index = np.unique(allDays)
+
+        prices = np.full((len(index), count), np.nan)
+        prices[np.searchsorted(index, allDays), columns] = np.concatenate([i["Price"] for i in points] + [np.zeros(0)])
+
+        # Forward fill: row of the last price for every cell
+        rows = np.where(np.isnan(prices), 0, np.arange(len(index))[:, None])
+        prices = prices[np.maximum.accumulate(rows, axis=0), np.arange(count)]
+
+        return index.astype("datetime64[D]"), prices
+
+    def f_compute(self, amounts, rates):
+        '''
+        Measures of the holdings (amounts - {orderbookId: amount}, rates - {orderbookId: rate to SEK}, NaN if unknown) and of the portfolio.
+        The portfolio holds today's amounts for the whole period (values in SEK at today's rates). The result is reused until the history is updated.
+        Returns dict: "columns" - orderbookIds and "Portfolio" (the last column of every array), "days",
+        "returns" ({"1M": ..., "3M": ..., "1Y": ...}), "volatility" (annualized, last year), "maxDrawdown", "beta" (to the portfolio, last year),
+        "correlation" (holdings x holdings, daily returns of the last year), "rollingReturns" ({window: Days x Columns}), "rollingVolatility" (Days x Columns)
+        '''
+        tickers = list(amounts)
+        points = self.f_points(tickers)
+
+        key = tuple(amounts.items()), tuple((ticker, rates.get(ticker)) for ticker in tickers), self.history.generation
+        with self.lock:
+            if self.cache[0] == key: return self.cache[1]
+
+        days, prices = self.f_matrix(points)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Daily returns (NaN before the first price); portfolio return - returns weighted by the values of the day before
+            returns = prices[1:] / prices[:-1] - 1
+            values = prices * np.array([amounts[i] for i in tickers], dtype=np.float64) * np.array([rates.get(i, np.nan) for i in tickers], dtype=np.float64)
+            weights = np.where(np.isnan(returns) | np.isnan(values[:-1]), 0, values[:-1])
+            portfolioReturns = (weights * np.nan_to_num(returns)).sum(axis=1) / weights.sum(axis=1)
+            portfolioReturns[weights.sum(axis=1) == 0] = np.nan
+
+            # Holdings and the portfolio (index from 1) as columns of one matrix
+            series = np.column_stack([prices, np.concatenate([[1.0], np.cumprod(1 + np.nan_to_num(portfolioReturns))])]) if len(days) else np.zeros((0, len(tickers) + 1))
+            returns = np.column_stack([returns, portfolioReturns]) if len(days) else np.zeros((0, len(tickers) + 1))
+            lastYear = returns[-self.yearDays:]
+
+            result = {"columns": tickers + ["Portfolio"], "days": days}
+            result["rollingReturns"] = {name: np.vstack([np.full((min(window, len(days)), series.shape[1]), np.nan), series[window:] / series[:-window] - 1]) for name, window in self.windows.items()}
+            result["returns"] = {name: rolling[-1] if len(rolling) else np.full(series.shape[1], np.nan) for name, rolling in result["rollingReturns"].items()}
+            result["rollingVolatility"] = np.vstack([np.full((min(1, len(days)), series.shape[1]), np.nan), self.f_rollingStd(returns, self.volatilityWindow) * np.sqrt(self.yearDays)])
+            result["volatility"] = np.nanstd(lastYear, axis=0, ddof=1) * np.sqrt(self.yearDays)
+            result["maxDrawdown"] = np.nanmin(series / np.fmax.accumulate(series, axis=0) - 1, axis=0, initial=0)
+            result["beta"] = self.f_beta(lastYear[:, :-1], lastYear[:, -1])
+            result["correlation"] = self.f_correlation(lastYear[:, :-1])
+
+        with self.lock: self.cache = key, result
+        return result
+
+    @staticmethod
+    def f_rollingStd(returns, window):
+        ''' Standard deviation of the last "window" returns for every day (NaN returns are skipped, NaN if there are less than 2 of them) '''
+        if len(returns) < window: return np.full(returns.shape, np.nan)
+
+        # Sums of the window from the cumulative sums: count, x, x^2
+        valid = ~np.isnan(returns)
+        counts, sums, squares = [np.vstack([np.zeros((1, returns.shape[1])), np.cumsum(i, axis=0)]) for i in [valid.astype(np.float64), np.where(valid, returns, 0), np.where(valid, returns, 0) ** 2]]
+        n, s, q = [i[window:] - i[:-window] for i in [counts, sums, squares]]
+
+        std = np.sqrt(np.maximum(q - s * s / n, 0) / (n - 1))
+        std[n < 2] = np.nan
+        return np.vstack([np.full((window - 1, returns.shape[1]), np.nan), std])
+
+    @staticmethod
+    def f_beta(returns, market):
+        ''' Beta of every column to the market returns (days where both are known) '''
+        valid = ~np.isnan(returns) & ~np.isnan(market)[:, None]
+        n = valid.sum(axis=0)
+        x, y = np.where(valid, returns, 0), np.where(valid, market[:, None], 0)
+        covariance = (x * y).sum(axis=0) - x.sum(axis=0) * y.sum(axis=0) / n
+        variance = (y * y).sum(axis=0) - y.sum(axis=0) ** 2 / n
+        beta = covariance / variance
+        beta[n < 2] = np.nan
+        return beta
+
+    @staticmethod
+    def f_correlation(returns):
+        ''' Correlation matrix of the columns, every pair over the days where both are known (pairwise complete, as pandas DataFrame.corr) '''
+        valid = (~np.isnan(returns)).astype(np.float64)
+        x = np.where(valid > 0, returns, 0)
+
+        # Sums over the common days of every pair: count, x, y, x*y, x^2, y^2
+        n, sx, sxy, sxx = valid.T @ valid, x.T @ valid, x.T @ x, (x * x).T @ valid
+        covariance = sxy - sx * sx.T / n
+        correlation = covariance / np.sqrt((sxx - sx * sx / n) * (sxx.T - sx.T * sx.T / n))
+        correlation[n < 2] = np.nan
+        return np.clip(correlation, -1, 1)
+
+''' Typed layout of user_data.hdf5 and migration of files written by older versions '''
+class Schema:
+    version = 4
+
+    # Rows of the daily snapshot
+    tickersInfo = np.dtype([("ID", "<i8"), ("Amount", "<i8"), ("Name", "S64"), ("Change percent", "<f8"), ("Price last", "<f8"), ("Price one week", "<f8"), ("Price one month", "<f8"), ("Price six month", "<f8"), ("Price one year", "<f8"),
+                            ("Price update time", "S16"), ("Country", "S4"), ("Currency", "S4"), ("P/E ratio", "<f8"), ("Volatility", "<f8"), ("Direct Yield", "<f8"), ("Sector", "S64")])
+    currencyRates = np.dtype([("ID", "<i8"), ("Rate", "<f8"), ("Name", "S16")])
+
+    # Snapshot tables (rows of all days, "Date" - days since 1970-01-01) and their date -> rows index
+    tickersTable = np.dtype([("Date", "<i8")] + tickersInfo.descr)
+    ratesTable = np.dtype([("Date", "<i8")] + currencyRates.descr)
+    snapshotsIndex = np.dtype([("Date", "<i8"), ("Tickers start", "<i8"), ("Tickers stop", "<i8"), ("Rates start", "<i8"), ("Rates stop", "<i8")])
+
+    # Daily balance, one row per currency
+    balance = np.dtype([("Date", "<i8"), ("Currency", "S4"), ("Total", "<f8")])
+
+    # Intraday quotes (intraday.hdf5, one table per orderbookId): Time - lastPriceUpdated (ms since 1970). float32 keeps 7 digits of a price with half of the space
+    intraday = np.dtype([("Time", "<i8"), ("Price", "<f4"), ("Change percent", "<f4")])
+
+    @staticmethod
+    def f_bytes(value):
+        ''' Text for fixed width string columns (NaN for missing values) '''
+        return b"" if value is None or (isinstance(value, float) and np.isnan(value)) else str(value).encode("utf-8", "ignore")
+
+    @staticmethod
+    def f_text(value):
+        return value.decode("utf-8", "ignore")
+
+    @staticmethod
+    def f_bisect(column, value, rows=None):
+        ''' First row of a sorted column (its first rows) with column[row] >= value. Reads log2(rows) single values, so a dataset is not read as a whole '''
+        low, high = 0, len(column) if rows is None else rows
+        while low < high:
+            middle = (low + high) // 2
+            if column[middle] < value: low = middle + 1
+            else: high = middle
+        return low
+
+    @staticmethod
+    def f_createTable(group, name, data):
+        ''' Chunked, compressed and resizable table of typed rows '''
+        return group.create_dataset(name, data=data, maxshape=(None,), chunks=(256,), compression="gzip", shuffle=True)
+
+    @staticmethod
+    def f_migrate(path):
+        ''' Bring user_data.hdf5 to the current schema. The old file is kept as <path>.v<version>.bak '''
+
+        with h5py.File(path, "r") as file: version = int(file.attrs.get("Schema", 1))
+        if version >= Schema.version: return False
+
+        temp, packed = path + ".migrate", path + ".pack"
+        shutil.copyfile(path, temp)
+
+        with h5py.File(temp, "a") as file:
+            for step in range(version, Schema.version):
+                getattr(Schema, "f_migrate_v{}".format(step))(file)
+                file.attrs["Schema"] = step + 1
+
+            # Repack into a new file (space of deleted datasets is not reused by HDF5)
+            with h5py.File(packed, "w") as target:
+                for key in file: file.copy(file[key], target, name=key)
+                for key, value in file.attrs.items(): target.attrs[key] = value
+
+        shutil.copyfile(path, "{}.v{}.bak".format(path, version))
+        os.replace(packed, path)
+        os.remove(temp)
+        return True
+
+    @staticmethod
+    def f_migrate_v1(file):
+        ''' v1 -> v2: every value in "Tickers Info" and "Currency rates" was stored as a byte string '''
+
+        if "Tickers Indexes" in file["tickers"]: del file["tickers"]["Tickers Indexes"]
+
+        for date in [i for i in file["tickers"] if isinstance(file["tickers"][i], h5py.Group)]:
+            group = file["tickers"][date]
+
+            number = lambda column: pd.to_numeric(pd.Series(column).str.decode("utf-8"), errors="coerce").to_numpy(np.float64)
+
+            old = group["Tickers Info"][:].reshape(-1, 16)
+            data = np.zeros(len(old), dtype=Schema.tickersInfo)
+            for column, name in enumerate(Schema.tickersInfo.names):
+                data[name] = old[:, column] if Schema.tickersInfo[name].kind == "S" else number(old[:, column])
+
+            old = group["Currency rates"][:].reshape(-1, 3)
+            rates = np.zeros(len(old), dtype=Schema.currencyRates)
+            rates["ID"], rates["Rate"], rates["Name"] = number(old[:, 0]), number(old[:, 1]), old[:, 2]
+
+            del group["Tickers Info"], group["Currency rates"]
+            Schema.f_createTable(group, "Tickers Info", data)
+            Schema.f_createTable(group, "Currency rates", rates)
+
+    @staticmethod
+    def f_migrate_v2(file):
+        ''' v2 -> v3: one group per day is replaced by the snapshot tables '''
+
+        snapshots = Snapshots.f_create(file)
+        for date in sorted([i for i in file["tickers"] if i != "Balance"]):
+            group = file["tickers"][date]
+            snapshots.f_write(np.datetime64(date, "D"), group["Tickers Info"][:], group["Currency rates"][:])
+            del file["tickers"][date]
+
+    @staticmethod
+    def f_migrate_v3(file):
+        ''' v3 -> v4: "/tickers/Balance" rows ("2020-01-31", "123456 SEK + 100 USD") are replaced by the typed "/balance" table '''
+
+        totals = {}
+        for date, text in file["tickers"]["Balance"][:].reshape(-1, 2).tolist():
+            for part in text.decode().split(" + "):
+                try:
+                    total, currency = part.split(" ")
+                    if float(total) != 0: totals[(np.datetime64(date.decode()[:10], "D").astype(np.int64), currency.encode())] = float(total)
+                except ValueError: continue
+
+        Balance.f_create(file, np.array(sorted([key + (value,) for key, value in totals.items()]), dtype=Schema.balance))
+        del file["tickers"]
+
+''' Daily balance per currency (Date - days since 1970-01-01, Currency, Total). Only the rows of the last day are ever rewritten '''
+class Balance:
+
+    def __init__(self, file):
+        self.dataset = file["balance"]
+
+    @staticmethod
+    def f_create(file, data=None):
+        Schema.f_createTable(file, "balance", np.zeros(0, dtype=Schema.balance) if data is None else data)
+        return Balance(file)
+
+    @staticmethod
+    def f_replace(file, data):
+        ''' Replace all rows at once. New rows are written aside and swapped in, so a crash never leaves the balance empty (see f_recover) '''
+
+        if "balance.new" in file: del file["balance.new"]
+        Schema.f_createTable(file, "balance.new", data)
+        Balance.f_swap(file)
+        return Balance(file)
+
+    @staticmethod
+    def f_swap(file):
+        ''' Complete "balance.new" takes the place of "balance" (file - the file or the group of a named portfolio) '''
+        file.file.flush()
+
+        if "balance" in file: file.move("balance", "balance.old")
+        file.move("balance.new", "balance")
+        if "balance.old" in file: del file["balance.old"]
+
+    @staticmethod
+    def f_recover(file):
+        ''' Finish or roll back f_replace interrupted by a crash '''
+
+        # Crash after "balance" is moved aside: "balance.new" is complete by then
+        if "balance" not in file:
+            if "balance.new" in file: file.move("balance.new", "balance")
+            elif "balance.old" in file: file.move("balance.old", "balance")
+
+        # Crash before the swap ("balance.new" is not complete) or after it ("balance.old" is already replaced)
+        for name in ["balance.new", "balance.old"]:
+            if name in file: del file[name]
+
+    def f_read(self):
+        return self.dataset[:]
+
+    def f_range(self, start=None, stop=None):
+        ''' Rows of the dates in [start, stop]: the bounds are found by bisection, so only the chunks of these rows are read '''
+        dates = self.dataset.fields("Date")
+        first = 0 if start is None else Schema.f_bisect(dates, np.datetime64(start, "D").astype(np.int64))
+        last = self.dataset.shape[0] if stop is None else Schema.f_bisect(dates, np.datetime64(stop, "D").astype(np.int64) + 1)
+        return self.dataset[first:max(first, last)]
+
+    def f_replaceFrom(self, start, data, step=65536):
+        ''' Replace the rows from the date on. Rows before it are copied (step rows at a time) to a new table with the data, which is swapped in as in f_replace '''
+        file, first = self.dataset.parent, Schema.f_bisect(self.dataset.fields("Date"), np.datetime64(start, "D").astype(np.int64))
+
+        if "balance.new" in file: del file["balance.new"]
+        new = Schema.f_createTable(file, "balance.new", np.zeros(0, dtype=Schema.balance))
+        new.resize((first + len(data),))
+        for i in range(0, first, step): new[i:min(i + step, first)] = self.dataset[i:min(i + step, first)]
+        if len(data) > 0: new[first:] = data
+
+        Balance.f_swap(file)
+        self.dataset = file["balance"]
+
+    def f_write(self, date, totals):
+        ''' Totals ({currency: total}) of the date. If it is the last stored date, its rows are replaced '''
+        date = np.datetime64(date, "D").astype(np.int64)
+        rows = np.array([(date, currency.encode(), total) for currency, total in totals.items()], dtype=Schema.balance)
+
+        # Rows of the last date are at the end (at most one row per currency)
+        size = self.dataset.shape[0]
+        tail = self.dataset.fields("Date")[max(0, size - 64):size]
+        start = size - int(np.count_nonzero(tail == date))
+
+        self.dataset.resize((start + len(rows),))
+        if len(rows) > 0: self.dataset[start:] = rows
+
+''' Append-only snapshot tables ("Tickers Info", "Currency rates") of all days with a small date -> rows index '''
+class Snapshots:
+
+    def __init__(self, file):
+        self.group = file["snapshots"]
+        self.index = self.group["Index"][:]
+
+    @staticmethod
+    def f_create(file):
+        group = file.create_group("snapshots")
+        Schema.f_createTable(group, "Tickers Info", np.zeros(0, dtype=Schema.tickersTable))
+        Schema.f_createTable(group, "Currency rates", np.zeros(0, dtype=Schema.ratesTable))
+        Schema.f_createTable(group, "Index", np.zeros(0, dtype=Schema.snapshotsIndex))
+        return Snapshots(file)
+
+    def f_write(self, date, tickersInfo, currencyRates):
+        ''' Append the snapshot of the date. If it is the last stored date (update during the day), its rows are replaced.
+        Returns False if the date is earlier than the last stored one (e.g. the clock was turned back): nothing is written then '''
+        date = np.datetime64(date, "D").astype(np.int64)
+
+        replace = len(self.index) > 0 and self.index["Date"][-1] == date
+        if len(self.index) > 0 and self.index["Date"][-1] > date:
+            print("Snapshot of {} is skipped: {} is already stored".format(*np.array([date, self.index["Date"][-1]]).astype("datetime64[D]")), file=sys.stderr)
+            return False
+
+        tickersStart = self.index["Tickers start"][-1] if replace else self.group["Tickers Info"].shape[0]
+        ratesStart = self.index["Rates start"][-1] if replace else self.group["Currency rates"].shape[0]
+        row = np.array([(date, tickersStart, tickersStart + len(tickersInfo), ratesStart, ratesStart + len(currencyRates))], dtype=Schema.snapshotsIndex)
+        self.index = np.concatenate([self.index[:-1] if replace else self.index, row])
+
+        for name, start, rows, dtype in [("Tickers Info", tickersStart, tickersInfo, Schema.tickersTable), ("Currency rates", ratesStart, currencyRates, Schema.ratesTable)]:
+            data = np.zeros(len(rows), dtype=dtype)
+            for field in rows.dtype.names: data[field] = rows[field]
+            data["Date"] = date
+
+            # Same rows of the day are rewritten from the first to the last changed one (compared byte by byte, so NaN == NaN)
+            if replace and self.group[name].shape[0] == start + len(data) and len(data) > 0:
+                stored = self.group[name][start:]
+                if stored.dtype == data.dtype:
+                    changed = np.flatnonzero(stored.view((np.void, dtype.itemsize)) != data.view((np.void, dtype.itemsize)))
+                    if len(changed) > 0: self.group[name][start + changed[0]:start + changed[-1] + 1] = data[changed[0]:changed[-1] + 1]
+                    continue
+
+            self.group[name].resize((start + len(data),))
+            if len(data) > 0: self.group[name][start:] = data
+
+        self.group["Index"].resize((len(self.index),))
+        self.group["Index"][len(self.index) - 1:] = self.index[-1:]
+        return True
+
+    def f_latest(self):
+        ''' Tickers Info and Currency rates of the last stored date (None if nothing is stored yet) '''
+        if not len(self.index): return None
+
+        last = self.index[-1]
+        return self.group["Tickers Info"][last["Tickers start"]:last["Tickers stop"]], self.group["Currency rates"][last["Rates start"]:last["Rates stop"]]
+
+    def f_range(self, start=None, stop=None, fields=None, table="Tickers Info"):
+        ''' Rows of all dates in [start, stop] with one slice read '''
+        dates = self.index["Date"]
+        first = 0 if start is None else np.searchsorted(dates, np.datetime64(start, "D").astype(np.int64), side="left")
+        last = len(dates) if stop is None else np.searchsorted(dates, np.datetime64(stop, "D").astype(np.int64), side="right")
+        if first >= last:
+            empty = np.zeros(0, dtype=Schema.tickersTable if table == "Tickers Info" else Schema.ratesTable)
+            return empty if fields is None else empty[fields]
+
+        column = "Tickers" if table == "Tickers Info" else "Rates"
+        dataset = self.group[table] if fields is None else self.group[table].fields(fields)
+        return dataset[self.index[column + " start"][first]:self.index[column + " stop"][last - 1]]
+
+
+''' Holdings of one portfolio: conversion to SEK, persistence and analytics (Portfolios runs the shared refresh pipeline) '''
+class Portfolio:
+    # Used when user_data.hdf5 is created
+    defaultTickers = {5361: 10, 293975: 10, 599956: 10, 549768: 10, 233288: 10}
+    defaultCurrencyTickers = {19000: "USD/SEK", 18998: "EUR/SEK", 53293: "NOK/SEK"}
+
+    def __init__(self, path="user_data.hdf5", engine=None, name=None, history=None, fx=None):
+        # name - one of the named portfolios in the file (group "portfolios/name"), None - the main one (root of the file)
+        self.path, self.engine, self.name = path, engine or FetchEngine(), name
+        self.history = history or HistoryCache(self.engine, os.path.join(os.path.dirname(path), "history.hdf5"))
+
+        # Timing of the refreshes is appended to this file (see Metrics)
+        self.metricsPath = os.path.join(os.path.dirname(path), "metrics.jsonl")
+
+        self.TICKERS, self.CURRENCY_RATES_TICKERS, self.proxy, self.migrated, self.snapshot = {}, {}, "", False, None
+        self.calendar, self.fx, self.analytics = MarketCalendar(), fx or FxEngine(self.engine), Analytics(self.history)
+
+        # Results of the last refresh (stale - converted from the stored snapshot, not written back), baseRates - rates of the holdings' currencies to SEK
+        self.all_data, self.currencyRates, self.baseRates, self.rows, self.missingCurrencies, self.stale = [], {}, {}, [], [], False
+
+        # Change detection: tickers whose row changed with the last conversion, anything changed with it, what is not yet / already in the file
+        self.changed, self.modified, self.unsaved, self.saved = set(), False, False, {}
+        self.balanceToday, self.totalBalance = {}, "0 SEK"
+
+        # Highest stored balance (SEK) for the drawdown alerts, read on first use
+        self.peak = None
+
+    def f_read(self):
+        ''' Holdings and settings from HDF file (created with default holdings if it doesn't exist) '''
+
+        if os.path.exists(self.path):
+
+            # Files written by older versions are converted to the typed schema once
+            self.migrated = Schema.f_migrate(self.path)
+
+            with h5py.File(self.path, "a") as file:
+                # New named portfolio starts without holdings
+                if self.name is not None and self.name not in file.require_group("portfolios"): self.f_create(file.require_group("portfolios").create_group(self.name))
+                Balance.f_recover(self.f_group(file))
+
+                # Take all info from last day
+                snapshots = Snapshots(self.f_group(file))
+                latest = snapshots.f_latest()
+                if latest is not None:
+                    tickersInfo, currencyRates = latest
+                    self.snapshot = tickersInfo, currencyRates, np.datetime64(int(snapshots.index[-1]["Date"]), "D")
+                    self.TICKERS = dict(zip(tickersInfo["ID"].tolist(), tickersInfo["Amount"].tolist()))
+                    self.CURRENCY_RATES_TICKERS = dict(zip(currencyRates["ID"].tolist(), [Schema.f_text(i) for i in currencyRates["Name"]]))
+                else: self.TICKERS, self.CURRENCY_RATES_TICKERS = dict(self.defaultTickers if self.name is None else {}), dict(self.defaultCurrencyTickers)
+
+                # Proxies
+                proxy = file["proxy"][0, 0] or ""
+                self.proxy = proxy.decode() if isinstance(proxy, bytes) else proxy
+
+        else:
+            with h5py.File(self.path, "w") as file:
+                file.attrs["Schema"] = Schema.version
+                self.f_create(file)
+                if self.name is not None: self.f_create(file.create_group("portfolios").create_group(self.name))
+
+                # Proxies
+                file.create_dataset("proxy", (1, 1), dtype=h5py.special_dtype(vlen=str))
+
+            # Fill the table with some default data
+            self.TICKERS, self.CURRENCY_RATES_TICKERS = dict(self.defaultTickers if self.name is None else {}), dict(self.defaultCurrencyTickers)
+
+        self.engine.proxies, self.saved["proxy"] = {"https": self.proxy}, self.proxy
+
+    @staticmethod
+    def f_create(group):
+        Snapshots.f_create(group)
+        Balance.f_create(group)
+
+    @staticmethod
+    def f_names(path):
+        ''' Portfolios in the file: None (the main one) and the names of the others '''
+        if not os.path.exists(path): return [None]
+        with h5py.File(path, "r") as file: return [None] + (sorted(file["portfolios"]) if "portfolios" in file else [])
+
+    def f_group(self, file):
+        ''' Group of the portfolio in the open file (snapshots and balance) '''
+        return file if self.name is None else file["portfolios"][self.name]
+
+    def f_lastSnapshot(self):
+        ''' Tickers and currency rates of the last stored day (same format as Portfolios.f_fetch returns) '''
+        if self.snapshot is None: return [], {}
+
+        tickersInfo, currencyRates, _ = self.snapshot
+        all_data = [Ticker.f_fromSnapshot(row, self.engine, self.history) for row in tickersInfo]
+        return all_data, {Schema.f_text(i["Name"]): [float(i["Rate"]), int(i["ID"])] for i in currencyRates}
+
+    def f_balance(self, currency="SEK", start=None, stop=None):
+        ''' Stored balance in the currency: dates (datetime64[D]) and totals (of the days in [start, stop] if they are set) '''
+        with h5py.File(self.path, "r") as file:
+            balance = Balance(self.f_group(file)).f_range(start, stop)
+
+        balance = balance[balance["Currency"] == currency.encode()]
+        return balance["Date"].astype("datetime64[D]"), balance["Total"].astype(np.float64)
+
+    @Metrics.f_timed("refresh.convert")
+    def f_convert(self, all_data, currencyRates, stale=False):
+        ''' Prices and totals in SEK for every ticker (self.rows: ticker, price, total, currency - "SEK" or the ticker's currency if it can't be converted) and today's balance '''
+
+        # Holdings could change while the data was downloaded: removed tickers are dropped, amounts are taken from TICKERS
+        all_data = [ticker for ticker in all_data if ticker.number in self.TICKERS]
+
+        # Rates to SEK of the holdings' currencies (direct, inverse or cross rates)
+        currencies = [ticker.currency for ticker in all_data]
+        currenciesUsed = list(dict.fromkeys(currencies))
+        baseRates = {currency: rate for currency, rate in zip(currenciesUsed, FxEngine.f_toBase(currencyRates, currenciesUsed).tolist()) if not np.isnan(rate)}
+
+        # Rows which have to be updated: other quote (other object), other amount or other rate to SEK
+        previous, changedRates = {ticker.number: ticker for ticker in self.all_data}, {i for i in set(baseRates) | set(self.baseRates) if baseRates.get(i) != self.baseRates.get(i)}
+        self.changed = {ticker.number for ticker in all_data if previous.get(ticker.number) is not ticker or ticker.count != self.TICKERS.get(ticker.number) or ticker.currency in changedRates}
+
+        for ticker in all_data: ticker.count = int(self.TICKERS[ticker.number])
+        self.modified = len(self.changed) > 0 or currencyRates != self.currencyRates or [i.number for i in all_data] != [i.number for i in self.all_data] or stale != self.stale
+        self.unsaved = self.unsaved or self.modified
+
+        # All holdings at once (NaN rate - currency without a way to SEK, price and total stay in that currency)
+        prices, counts = np.array([ticker.price_last for ticker in all_data], dtype=np.float64), np.array([ticker.count for ticker in all_data], dtype=np.float64)
+        rates = np.array([baseRates.get(currency, np.nan) for currency in currencies], dtype=np.float64)
+        converted = ~np.isnan(rates)
+        pricesSek, totalsSek, totalsOwn = np.round(prices * rates, 2), np.rint(prices * counts * rates), np.round(prices * counts, 2)
+
+        rowPrices, rowTotals = np.where(converted, pricesSek, prices).tolist(), np.where(converted, totalsSek, totalsOwn).tolist()
+        self.rows = [(ticker, price, int(total) if ok else total, "SEK" if ok else ticker.currency) for ticker, price, total, ok in zip(all_data, rowPrices, rowTotals, converted.tolist())]
+        self.missingCurrencies = [currency for currency in currenciesUsed if currency not in baseRates]
+        self.all_data, self.currencyRates, self.baseRates, self.stale = all_data, currencyRates, baseRates, stale
+
+        # calculate "Balance" (SEK first, then the currencies which can't be converted)
+        balance = {"SEK": int(totalsSek[converted].sum())}
+        for currency in self.missingCurrencies: balance[currency] = int(np.rint(prices * counts)[np.array(currencies, dtype=object) == currency].sum())
+        self.balanceToday = {i: float(balance[i]) for i in balance if balance[i] != 0}
+        self.totalBalance = " + ".join([str(str(balance[i]) + " " + i) for i in balance if balance[i] != 0])
+
+    def f_setAmount(self, tickerNumber, amount):
+        ''' Add a holding or change its amount. Returns False if the ticker has to be downloaded (f_fetchHolding) '''
+        self.TICKERS[tickerNumber] = amount
+        if not any(ticker.number == tickerNumber for ticker in self.all_data): return False
+
+        self.f_convert(self.all_data, self.currencyRates, self.stale)
+        return True
+
+    def f_fetchHolding(self, tickerNumber):
+        ''' Quote of one holding (may run in a background thread) '''
+        return Ticker(int(tickerNumber), int(self.TICKERS.get(tickerNumber, 0)), self.engine, self.history)
+
+    def f_addHolding(self, ticker):
+        ''' Put one downloaded holding into the refresh results (the other tickers are not downloaded again) '''
+        if ticker.number not in self.TICKERS: return
+
+        all_data = [ticker if i.number == ticker.number else i for i in self.all_data]
+        if ticker not in all_data: all_data.append(ticker)
+        self.f_convert(all_data, self.currencyRates, self.stale)
+
+    def f_removeHolding(self, tickerNumber):
+        del self.TICKERS[tickerNumber]
+        self.f_convert(self.all_data, self.currencyRates, self.stale)
+
+    def f_fetchCurrency(self, tickerNumber):
+        ''' Rate of one currency pair: orderbookId, rate, name (may run in a background thread) '''
+        return (int(tickerNumber),) + self.fx.f_rate(int(tickerNumber))
+
+    def f_addCurrency(self, pair):
+        tickerNumber, rate, name = pair
+        self.CURRENCY_RATES_TICKERS[tickerNumber] = name
+        self.f_convert(self.all_data, dict(self.currencyRates, **{name: [rate, tickerNumber]}), self.stale)
+
+    def f_removeCurrency(self, tickerNumber):
+        name = self.CURRENCY_RATES_TICKERS.pop(tickerNumber)
+        self.f_convert(self.all_data, {i: self.currencyRates[i] for i in self.currencyRates if i != name}, self.stale)
+
+    def f_drawdown(self):
+        ''' Today's balance (SEK) below the highest one (%, NaN if it is not known) '''
+        if self.peak is None:
+            _, totals = self.f_balance("SEK")
+            self.peak = float(totals.max()) if len(totals) else np.nan
+
+        total = self.balanceToday.get("SEK", np.nan)
+        self.peak = float(np.fmax(self.peak, total))
+        return (total / self.peak - 1) * 100 if self.peak > 0 else np.nan
+
+    def f_write(self):
+        ''' Today's balance, today's snapshot and settings to HDF file (the file is not touched if they are already there) '''
+
+        today = datetime.now().date()
+        writeData = len(self.all_data) > 0 and not self.stale and (self.unsaved or self.saved.get("date") != today)
+        if not writeData and self.saved.get("proxy") == self.proxy: return
+
+        # Tickers data
+        dataArr = np.array([(i.number, i.count, Schema.f_bytes(i.name), i.changePercent, i.price_last, i.price_oneWeek, i.price_oneMonth, i.price_sixMonth, i.price_oneYear, Schema.f_bytes(i.price_updateTime), Schema.f_bytes(i.country), Schema.f_bytes(i.currency), i.peRatio, i.volatility, i.directYield, Schema.f_bytes(i.sector)) for i in self.all_data], dtype=Schema.tickersInfo)
+
+        # Currency data
+        currencyArr = np.array([(self.currencyRates[i][1], self.currencyRates[i][0], Schema.f_bytes(i)) for i in self.currencyRates], dtype=Schema.currencyRates)
+
+        with self.engine.metrics.f_span("hdf.write"), h5py.File(self.path, "a") as file:
+
+            if writeData:
+                # Update today's total balance (add new rows or rewrite old ones for today)
+                if self.saved.get("balance") != (today, self.balanceToday): Balance(self.f_group(file)).f_write(today, self.balanceToday)
+
+                # Append today's snapshot (replaces the changed rows of the previous update today)
+                Snapshots(self.f_group(file)).f_write(today, dataArr, currencyArr)
+                self.saved.update(date=today, balance=(today, dict(self.balanceToday)))
+                self.unsaved = False
+
+            # update Proxy
+            if self.saved.get("proxy") != self.proxy: file["proxy"][:, 0] = [self.proxy.encode("ascii", "ignore")]
+            self.saved["proxy"] = self.proxy
+
+    def f_openTickers(self, utc=None):
+        ''' Holdings whose market is open now (or closed a moment ago, for the closing price). Tickers without data are included '''
+        utc, countries = utc or datetime.utcnow(), {ticker.number: ticker.country for ticker in self.all_data}
+        return {ticker: amount for ticker, amount in self.TICKERS.items() if self.calendar.f_isOpen(countries.get(ticker, ""), utc, self.calendar.closeGrace)}
+
+    def f_nextRefresh(self, interval, utc=None):
+        ''' Seconds to the next scheduled refresh (interval - seconds between refreshes while markets are open) '''
+        return self.calendar.f_nextRefresh([ticker.country for ticker in self.all_data], utc or datetime.utcnow(), interval)
+
+    def f_analytics(self):
+        ''' Returns, volatility, drawdown, beta and correlations of the holdings (see Analytics.f_compute). May run in a background thread '''
+        currencies = {ticker.number: ticker.currency for ticker in self.all_data}
+        return self.analytics.f_compute(dict(self.TICKERS), {ticker: self.baseRates.get(currencies.get(ticker), np.nan) for ticker in self.TICKERS})
+
+    def f_merge(self, all_data):
+        ''' Results of a refresh of some tickers with the last results of the other ones '''
+        fresh = {ticker.number: ticker for ticker in all_data}
+        return [fresh.pop(ticker.number, ticker) for ticker in self.all_data] + list(fresh.values())
+
+    @Metrics.f_timed("backfill")
+    def f_backfill(self, start=None):
+        '''
+        Used to fill balances for missing dates (start - only from this date on, older balances, snapshots and prices are not read). Returns number of days written
+        '''
+
+        ### 1 - holdings for every business day (Date x Ticker matrix of amounts)
+
+        with self.engine.metrics.f_span("backfill.holdings"), h5py.File(self.path, "r") as file:
+            # Holdings of all days (since start)
+            snapshots = Snapshots(self.f_group(file))
+            USER_BALANCE = snapshots.f_range(start=start, fields=["Date", "ID", "Amount", "Currency"])
+        if not len(USER_BALANCE): return 0
+
+        # Days before the first snapshot are not filled
+        if start is not None: start = max(np.datetime64(start, "D"), np.datetime64(int(snapshots.index["Date"][0]), "D"))
+
+        df_holdings = pd.DataFrame({"Date": USER_BALANCE["Date"].astype("datetime64[D]").astype("datetime64[ns]"), "Ticker": USER_BALANCE["ID"], "Amount": USER_BALANCE["Amount"]})
+        currencies = pd.Series(np.char.decode(USER_BALANCE["Currency"], "utf-8"), index=USER_BALANCE["ID"]).groupby(level=0).last()
+
+        # 0 - ticker is not in the portfolio that day
+        df_amounts = df_holdings.pivot_table(index="Date", columns="Ticker", values="Amount", aggfunc="last", fill_value=0)
+
+        # Add business days since the first run of the program. Days when the program wasn't working take holdings of the next day with data
+        dates = df_amounts.index.union(pd.bdate_range(start=df_amounts.index[0] if start is None else pd.Timestamp(start), end=datetime.now(), freq="B"))
+        if len(dates) < 2: return 0
+        df_amounts = df_amounts.reindex(dates).bfill().dropna(how="all")
+        df_amounts = df_amounts[df_amounts.index < datetime.today() - timedelta(days=1)]
+
+        ### 2 - prices and currency rates for every date (Date x Ticker and Date x Currency matrices, from the local history)
+
+        tickers = list(df_amounts.columns)
+        with self.engine.metrics.f_span("backfill.history"): charts = dict(self.engine.f_map(lambda ticker: (ticker, self.history.f_read(ticker, start)), tickers + list(self.CURRENCY_RATES_TICKERS))[0])
+        series = lambda chartdata: chartdata.drop_duplicates("Date", keep="last").set_index("Date")["Price"]
+
+        df_prices = pd.concat({ticker: series(charts[ticker]) for ticker in tickers if ticker in charts}, axis=1).reindex(index=df_amounts.index, columns=tickers)
+        df_pairs = pd.DataFrame({self.CURRENCY_RATES_TICKERS[ticker]: series(charts[ticker]) for ticker in self.CURRENCY_RATES_TICKERS if ticker in charts}, index=df_amounts.index, dtype=np.float64)
+        df_pairs = df_pairs.where(df_pairs > 0)
+
+        # Rate of every day to SEK: X/SEK, inverse of SEK/X or a chain of pairs, the same chains as FxEngine.f_toBase uses for today's rates
+        used, baseRates = list(dict.fromkeys(currencies[tickers].values)), {}
+        for currency, path in zip(used, FxEngine.f_paths(df_pairs.columns, used)):
+            baseRates[currency] = np.full(len(df_pairs), 1.0 if path is not None else np.nan)
+            for name, sign in path or []: baseRates[currency] = baseRates[currency] * df_pairs[name].to_numpy(np.float64) ** sign
+        df_rates = pd.DataFrame(baseRates, index=df_amounts.index).reindex(columns=currencies[tickers].values)
+
+        ### 3 - check for holidays: days with missing price for any ticker in the portfolio are skipped
+
+        amounts, prices, rates = df_amounts.to_numpy(np.float64), df_prices.to_numpy(np.float64), df_rates.to_numpy(np.float64)
+        held = amounts > 0
+        valid = held.any(axis=1) & ~(held & np.isnan(prices)).any(axis=1)
+
+        ### 4 - sum by dates (holdings without currency rate are not counted)
+
+        totals = np.nansum(np.where(held, amounts * prices * rates, np.nan), axis=1)
+        df_datesFullwPrices = pd.Series(totals[valid], index=df_amounts.index[valid])
+
+        ### 5 - write updated balances in hdf
+
+        balanceArr = np.zeros(len(df_datesFullwPrices), dtype=Schema.balance)
+        balanceArr["Date"] = df_datesFullwPrices.index.values.astype("datetime64[D]").astype(np.int64)
+        balanceArr["Currency"], balanceArr["Total"] = b"SEK", np.round(df_datesFullwPrices.to_numpy(np.float64))
+
+        with self.engine.metrics.f_span("backfill.write"), h5py.File(self.path, "a") as file:
+            # All rows are written with one operation (today's rows are added by "Update Table" below)
+            if start is None: Balance.f_replace(self.f_group(file), balanceArr)
+            else: Balance(self.f_group(file)).f_replaceFrom(start, balanceArr)
+
+        # Today's balance has to be written again, the highest balance is read again
+        self.saved.pop("balance", None)
+        self.unsaved, self.peak = True, None
+
+        return len(balanceArr)
+
+
+''' All portfolios (accounts) of the file with one refresh: every orderbookId and currency pair is requested once and the results are shared '''
+class Portfolios:
+
+    def __init__(self, path="user_data.hdf5", engine=None):
+        self.path, self.engine = path, engine or FetchEngine()
+
+        # Portfolios share the engine, the price history and the currency rates. name -> Portfolio (None - the main one)
+        self.history, self.fx, self.items = HistoryCache(self.engine, os.path.join(os.path.dirname(path), "history.hdf5")), FxEngine(self.engine), {}
+
+        # Tickers of the last refresh (one object per orderbookId, each portfolio has own copies of them)
+        self.shared = {}
+
+        # Intraday quotes are recorded if it is switched on in the file (see f_setRecording). Recorders which were switched off are closed in the background
+        self.recorder, self.closing = None, []
+
+        # Alert rules and their state (next to the file)
+        self.alerts = Alerts(os.path.join(os.path.dirname(path), "alerts.json"))
+
+    def f_read(self):
+        ''' All portfolios of the file (the file is created with the main one if it doesn't exist) '''
+        self.items = {}
+        for name in Portfolio.f_names(self.path): self.f_add(name)
+        self.alerts.f_read()
+
+        with h5py.File(self.path, "r") as file: recording = bool(file.attrs.get("Record intraday", False))
+        if recording and self.recorder is None: self.recorder = IntradayRecorder(os.path.join(os.path.dirname(self.path), "intraday.hdf5"), self.engine.metrics)
+
+    def f_setRecording(self, enabled):
+        ''' Switch recording of the intraday quotes on or off (saved to the file) '''
+        with h5py.File(self.path, "a") as file: file.attrs["Record intraday"] = bool(enabled)
+
+        if enabled and self.recorder is None: self.recorder = IntradayRecorder(os.path.join(os.path.dirname(self.path), "intraday.hdf5"), self.engine.metrics)
+        elif not enabled and self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            self.closing.append(recorder)
+            self.engine.f_submit(recorder.f_close)
+
+    def f_add(self, name):
+        ''' Portfolio of the file (created without holdings if it is not there) '''
+        if name not in self.items:
+            self.items[name] = Portfolio(self.path, self.engine, name, self.history, self.fx)
+            self.items[name].f_read()
+        return self.items[name]
+
+    def f_partial(self, tickers):
+        ''' True if the refresh of these tickers only can be merged into the results of every portfolio '''
+        return tickers is not None and not any(i.stale or (i.TICKERS and not i.all_data) for i in self.items.values())
+
+    @Metrics.f_timed("refresh.fetch")
+    def f_fetch(self, tickers=None):
+        ''' Quotes of the holdings of all portfolios (or only of tickers) and of all currency pairs, each requested once. May run in a background thread.
+        Returns {orderbookId: Ticker}, currencyRates and failed tickers '''
+
+        tickers = list(dict.fromkeys(ticker for i in self.items.values() for ticker in i.TICKERS) if tickers is None else tickers)
+        currencyTickers = list(dict.fromkeys(ticker for i in self.items.values() for ticker in i.CURRENCY_RATES_TICKERS))
+
+        currencyRates, failedCurrencies = self.fx.f_fetch(currencyTickers)
+        # Amount is set by every portfolio on its copy
+        all_data, failed = self.engine.f_map(lambda ticker: Ticker.f_fetch(int(ticker), 0, self.engine, self.history, self.shared.get(ticker)), tickers)
+
+        # Not a single quote arrived and the requests got no response - the connection is down (it is not checked with a request of its own)
+        if tickers and len(failed) == len(tickers) and not self.engine.connected: raise ConnectionError("Check your internet connection or proxy settings")
+
+        # Only buffered in memory, the file is written by the recorder's own thread
+        recorder = self.recorder
+        if recorder is not None: recorder.f_record(all_data)
+
+        return {ticker.number: ticker for ticker in all_data}, currencyRates, failed + failedCurrencies
+
+    def f_share(self, portfolio, fetched):
+        ''' Tickers of the portfolio from the shared results. The portfolio keeps its object if the quote didn't change (no row update) '''
+        previous = {ticker.number: ticker for ticker in portfolio.all_data}
+        return [previous[number] if number in previous and previous[number].ticker is not None and previous[number].ticker is fetched[number].ticker else copy.copy(fetched[number]) for number in portfolio.TICKERS if number in fetched]
+
+    def f_distribute(self, fetched, currencyRates, partial=False):
+        ''' Results of f_fetch to every portfolio (partial - only some tickers were refreshed, the other ones keep the last results) '''
+        for portfolio in self.items.values():
+            all_data, pairs = self.f_share(portfolio, fetched), set(portfolio.CURRENCY_RATES_TICKERS)
+            rates = {name: rate for name, rate in currencyRates.items() if rate[1] in pairs}
+            portfolio.f_convert(portfolio.f_merge(all_data) if partial else all_data, rates)
+        self.shared.update(fetched)
+
+    def f_write(self, proxy=None):
+        for portfolio in self.items.values():
+            if proxy is not None: portfolio.proxy = proxy
+            portfolio.f_write()
+
+    @Metrics.f_timed("refresh")
+    def f_refresh(self, tickers=None):
+        ''' Whole pipeline for all portfolios in the calling thread (tickers - refresh only these holdings). Returns failed tickers '''
+        partial = self.f_partial(tickers)
+
+        fetched, currencyRates, failed = self.f_fetch(tickers if partial else None)
+        self.f_distribute(fetched, currencyRates, partial)
+        self.f_write()
+        return failed
+
+    def f_alertValues(self):
+        ''' Columns, their values (Fields x Columns) and names for the alerts of the last refresh. Portfolios shown from the stored snapshot are not checked '''
+        portfolios = {name: i for name, i in self.items.items() if not i.stale}
+        tickers = list({ticker.number: ticker for i in portfolios.values() for ticker in i.all_data}.values())
+
+        # Instruments and portfolios are columns of one matrix (a portfolio has only the drawdown)
+        drawdowns = np.full((len(Alerts.fields), len(portfolios)), np.nan)
+        drawdowns[Alerts.fields.index("drawdown")] = [i.f_drawdown() for i in portfolios.values()]
+        columns = [str(ticker.number) for ticker in tickers] + [Alerts.f_column("Main" if name is None else name) for name in portfolios]
+        names = dict(zip(columns, [ticker.name for ticker in tickers] + ["Portfolio " + ("Main" if name is None else name) for name in portfolios]))
+        return columns, np.hstack([Alerts.f_values(tickers), drawdowns]), names
+
+    def f_alerts(self, extra=(), values=None):
+        '''
+        Alerts of the last refresh (rules of alerts.json and extra rules): every instrument is checked once, even if it is in several portfolios,
+        and every portfolio for its drawdown. values - result of f_alertValues taken before (then it may run in a worker). Returns alerts with "name" (see Alerts.f_evaluate)
+        '''
+        columns, values, names = self.f_alertValues() if values is None else values
+        with self.engine.metrics.f_span("alerts"): alerts = self.alerts.f_evaluate(columns, values, extra)
+
+        # The state is written only if an alert fired or the values moved, the rules only if they changed
+        self.alerts.f_write()
+        return [dict(alert, name=names[alert["column"]]) for alert in alerts]
+
+    def f_openTickers(self, utc=None):
+        ''' Holdings of all portfolios whose market is open now '''
+        return {ticker: amount for i in self.items.values() for ticker, amount in i.f_openTickers(utc).items()}
+
+    def f_nextRefresh(self, interval, utc=None):
+        return min(i.f_nextRefresh(interval, utc) for i in self.items.values())
+
+    def f_close(self):
+        # Closing again is quick, and the background close may not have run yet (it is cancelled with the engine)
+        for recorder in self.closing + ([self.recorder] if self.recorder is not None else []): recorder.f_close()
+        self.engine.f_close()
+
+
+def main(argv=None):
+    ''' Command line interface (no GUI) '''
+
+    parser = argparse.ArgumentParser(description="Avanza Ticker Tracker without GUI")
+    parser.add_argument("--file", default="user_data.hdf5", help="HDF file with holdings and balance")
+    parser.add_argument("--proxy", help="https proxy (saved to the file)")
+    parser.add_argument("--threshold", type=float, default=-3, help="report tickers which dropped by more than this (%%), once in the cooldown of the alerts")
+    parser.add_argument("--portfolio", help="named portfolio for backfill and analytics (created if it is not in the file), the main one if not set")
+    parser.add_argument("--record", choices=["on", "off"], help="record quotes of every refresh to intraday.hdf5 (saved to the file)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("refresh", help="update prices, today's balance and snapshot")
+    backfill = commands.add_parser("backfill", help="fill balances for the days when the program wasn't working")
+    backfill.add_argument("--since", help="only from this date (YYYY-MM-DD), older balances are kept")
+    watch = commands.add_parser("watch", help="refresh periodically")
+    watch.add_argument("--interval", type=int, default=60, help="minutes between refreshes")
+    commands.add_parser("analytics", help="returns, volatility, max drawdown and beta of the holdings (from the local price history)")
+    migrate = commands.add_parser("migrate", help="convert the file to the current schema")
+    alerts = commands.add_parser("alerts", help="list, add or remove alert rules (alerts.json next to the file)")
+    alerts.add_argument("--add", nargs=3, metavar=("FIELD", "OP", "LEVEL"), help="fields: " + ", ".join(Alerts.fields) + "; operators: " + ", ".join(['"' + i + '"' for i in Alerts.operators]))
+    alerts.add_argument("--target", help="orderbookId or portfolio name (\"Main\" - the main one), every instrument / portfolio if not set")
+    alerts.add_argument("--cooldown", type=float, help="hours before the rule fires again for the same instrument (default %g)" % (Alerts.cooldown / 3600))
+    alerts.add_argument("--remove", metavar="ID")
+    intraday = commands.add_parser("intraday", help="recorded quotes of an instrument (intraday.hdf5 next to the file, see --record)")
+    intraday.add_argument("ticker", type=int, help="orderbookId")
+    intraday.add_argument("--since", help="only from this date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        print("Migrated " + args.file if Schema.f_migrate(args.file) else args.file + " is up to date")
+        return 0
+
+    if args.command == "alerts":
+        rules = Alerts(os.path.join(os.path.dirname(args.file), "alerts.json"))
+        rules.f_read()
+        try:
+            if args.add: rules.f_add(args.add[0], args.add[1], float(args.add[2]), None if args.target is None else int(args.target) if args.target.isdigit() else args.target, None if args.cooldown is None else args.cooldown * 3600)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        if args.remove and not rules.f_remove(args.remove): print("No rule " + args.remove, file=sys.stderr)
+        if args.add or args.remove: rules.f_write()
+
+        for rule in rules.rules: print("{:<40}{} {} {:g}".format(rule["id"], rule["field"], rule["op"], rule["level"]) + ("" if "target" not in rule else " (" + str(rule["target"]) + ")"))
+        return 0
+
+    if args.command == "intraday":
+        start = None if args.since is None else int(datetime.strptime(args.since, "%Y-%m-%d").timestamp() * 1000)
+        for stamp, price, changePercent in IntradayRecorder.f_read(os.path.join(os.path.dirname(args.file), "intraday.hdf5"), args.ticker, start):
+            print("{}{:>12.2f}{:>8.2f} %".format(datetime.fromtimestamp(stamp / 1000).strftime("%Y-%m-%d %H:%M:%S"), price, changePercent))
+        return 0
+
+    # All portfolios of the file are refreshed together, backfill and analytics are done for one of them
+    portfolios = Portfolios(args.file)
+    portfolios.f_read()
+    portfolio = portfolios.f_add(args.portfolio)
+    if args.record is not None: portfolios.f_setRecording(args.record == "on")
+    if args.proxy is not None:
+        for i in portfolios.items.values(): i.proxy = args.proxy
+        portfolios.engine.proxies = {"https": args.proxy}
+
+    try:
+        if args.command == "analytics":
+            # Currencies of the holdings from the last snapshot (no quotes are requested if it is there)
+            if portfolio.snapshot is not None: portfolio.f_convert(*portfolio.f_lastSnapshot(), stale=True)
+            else: portfolios.f_refresh()
+
+            result, names = portfolio.f_analytics(), {ticker.number: ticker.name for ticker in portfolio.all_data}
+            print("{:<30}".format("") + "".join(["{:>10}".format(i) for i in [name + " %" for name in Analytics.windows] + ["Vol %", "Max DD %", "Beta"]]))
+            for i, column in enumerate(result["columns"]):
+                values = [result["returns"][name][i] * 100 for name in Analytics.windows] + [result["volatility"][i] * 100, result["maxDrawdown"][i] * 100, result["beta"][i] if i < len(result["beta"]) else 1.0]
+                print("{:<30}".format(str(names.get(column, column))[:29]) + "".join(["{:>10.2f}".format(value) for value in values]))
+            return 0
+
+        if args.command == "backfill":
+            print("Balance written for " + str(portfolio.f_backfill(args.since)) + " days")
+
+        failed = portfolios.f_refresh()
+        while True:
+            # Timing of the refresh goes to the metrics file
+            portfolio.engine.metrics.f_export(portfolio.metricsPath)
+            print(datetime.now().strftime("%Y-%m-%d %H:%M") + " (" + portfolio.engine.metrics.f_summary() + ")")
+            for name, i in portfolios.items.items():
+                print("  Balance" + ("" if name is None else " " + name) + ": " + i.totalBalance)
+                if i.missingCurrencies: print("    Missing currency rates: " + ", ".join([currency + "/SEK" for currency in i.missingCurrencies]))
+            for alert in portfolios.f_alerts([{"id": "threshold", "field": "changePercent", "op": "<", "level": args.threshold}]): print("  " + Alerts.f_text(alert, alert["name"]))
+            if failed: print("  Failed to update: " + ", ".join([str(i) for i in failed]))
+            if args.command != "watch": break
+
+            # Nothing is requested while the markets are closed
+            while True:
+                time.sleep(portfolios.f_nextRefresh(args.interval * 60))
+                openTickers = portfolios.f_openTickers()
+                if openTickers: break
+            failed = portfolios.f_refresh(openTickers)
+
+    except ConnectionError as error:
+        print(error, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt: pass
+    finally: portfolios.f_close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
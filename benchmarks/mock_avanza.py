@@ -0,0 +1,188 @@
+'''
+Local stand-in for avanza.se, used by the benchmarks (no requests go to the real site).
+Serves the endpoints the program uses:
+* GET  /_mobile/market/stock/{id} - quote
+* POST /ab/component/highstockchart/getchart/orderbook - daily prices
+* GET  /_cqbe/search/global-search/global-search-template?query= - search
+* GET  /_stats - number of served requests (for the benchmarks)
+Data comes from recorded fixtures (a directory written by "record") or is synthetic.
+
+python benchmarks/mock_avanza.py serve [--port 8080] [--latency 50] [--jitter 10] [--error-rate 0.01] [--payload 4096] [--change-rate 1] [--etag] [--fixtures dir]
+python benchmarks/mock_avanza.py record --fixtures dir 5361 293975 19000
+'''
+
+import os, sys, json, time, random, argparse, threading, hashlib, urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+''' Quotes, charts and search results: from fixtures if there is a file for the request, otherwise synthetic '''
+class Fixtures:
+    currencies = {19000: ("USD/SEK", 10.5), 18998: ("EUR/SEK", 11.4), 53293: ("NOK/SEK", 1.0)}
+    periods = {"one_week": 7, "one_month": 31, "three_months": 92, "one_year": 366, "three_years": 1096, "five_years": 1827}
+
+    def __init__(self, directory=None, payload=0, changeRate=1.0):
+        self.directory, self.payload, self.changeRate = directory, payload, changeRate
+
+        # Version of every quote, it goes up with probability changeRate on every request
+        self.versions, self.lock = {}, threading.Lock()
+
+    def f_file(self, *path):
+        if self.directory is None: return None
+        path = os.path.join(self.directory, *path)
+        if not os.path.exists(path): return None
+        with open(path) as file: return json.load(file)
+
+    def f_quote(self, orderbookId):
+        with self.lock:
+            if orderbookId not in self.versions or random.random() < self.changeRate: self.versions[orderbookId] = self.versions.get(orderbookId, -1) + 1
+            version = self.versions[orderbookId]
+
+        quote = self.f_file("stock", "{}.json".format(orderbookId))
+        if quote is None and orderbookId in self.currencies:
+            name, rate = self.currencies[orderbookId]
+            quote = {"name": name, "changePercent": 0.1, "lastPrice": rate, "flagCode": "SE", "currency": "SEK"}
+        elif quote is None:
+            currency, flagCode = [("SEK", "SE"), ("USD", "US"), ("EUR", "DE")][orderbookId % 3]
+            quote = {"name": "Stock {}".format(orderbookId), "flagCode": flagCode, "currency": currency, "lastPrice": 100.0 + orderbookId % 50,
+                     "keyRatios": {"priceEarningsRatio": 12.3, "volatility": 20.1, "directYield": 2.5}, "company": {"sector": "Technology"},
+                     "dividends": [{"exDate": "2026-04-01", "amountPerShare": 3.0}], "companyReports": [{"eventDate": "2026-11-01", "reportType": "QUARTERLY"}],
+                     "priceOneWeekAgo": 99.0, "priceOneMonthAgo": 95.0, "priceSixMonthsAgo": 90.0, "priceOneYearAgo": 80.0}
+
+        # Every version is a new price
+        random.seed(orderbookId * 7919 + version)
+        quote["changePercent"] = round(random.uniform(-3, 3), 2)
+        quote["lastPrice"] = round(quote["lastPrice"] * (1 + quote["changePercent"] / 100), 2)
+        quote["lastPriceUpdated"] = (datetime(2026, 1, 1) + timedelta(minutes=version)).strftime("%Y-%m-%dT%H:%M:%S.000+0100")
+        random.seed()
+
+        if self.payload > 0: quote["padding"] = "x" * max(0, self.payload - len(json.dumps(quote)))
+        return quote
+
+    def f_chart(self, orderbookId, timePeriod):
+        chart = self.f_file("chart", "{}.json".format(orderbookId))
+        if chart is not None: return chart
+
+        # Business days, midnight Stockholm time (ms)
+        end, points = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0), []
+        for days in range(self.periods.get(timePeriod, 1096), -1, -1):
+            day = end - timedelta(days=days)
+            if day.weekday() < 5: points.append([int((day - timedelta(hours=1)).timestamp() * 1000), round(100.0 + orderbookId % 50 + days * 0.01, 2)])
+        return {"dataPoints": points}
+
+    def f_search(self, query):
+        result = self.f_file("search", "{}.json".format(query.lower()))
+        if result is not None: return result
+
+        hits = [{"link": {"orderbookId": str(1000 + i), "linkDisplay": "{} {}".format(query, i)}, "name": "{} {}".format(query, i)} for i in range(5)]
+        return {"resultGroups": [{"instrumentType": "STOCK", "numberOfHits": len(hits), "hits": hits}]}
+
+''' One handler per request. Latency, errors and ETags are set on the server '''
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args): pass
+
+    def f_send(self, data):
+        server = self.server
+        time.sleep(max(0, random.gauss(server.latency, server.jitter)) / 1000)
+
+        with server.lock: server.requests += 1
+        if random.random() < server.errorRate:
+            self.send_response(503)
+            self.end_headers()
+            self.wfile.write(b"Service unavailable")
+            return
+
+        body = json.dumps(data).encode()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest()) if server.etag else None
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None: self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def f_stats(self):
+        ''' Number of served requests (this request is not counted and not delayed) '''
+        body = json.dumps({"requests": self.server.requests}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/_stats": self.f_stats()
+        elif url.path.startswith("/_mobile/market/stock/"): self.f_send(self.server.fixtures.f_quote(int(url.path.rsplit("/", 1)[1])))
+        elif url.path.startswith("/_cqbe/search/"): self.f_send(self.server.fixtures.f_search(urllib.parse.parse_qs(url.query).get("query", [""])[0]))
+        else: self.f_send({})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.startswith("/ab/component/highstockchart/getchart/orderbook"): self.f_send(self.server.fixtures.f_chart(int(body["orderbookId"]), body.get("timePeriod")))
+        else: self.f_send({})
+
+def f_start(port=0, latency=0, jitter=0, errorRate=0, payload=0, changeRate=1.0, etag=False, fixtures=None):
+    ''' Server in a daemon thread. Its address is "http://127.0.0.1:{server.server_port}", server.requests - number of served requests '''
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads, server.request_queue_size = True, 1024
+    server.latency, server.jitter, server.errorRate, server.etag = latency, jitter, errorRate, etag
+    server.fixtures, server.requests, server.lock = Fixtures(fixtures, payload, changeRate), 0, threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def f_record(directory, orderbookIds, queries=()):
+    ''' Save answers of avanza.se as fixtures '''
+
+    sys.path.insert(0, ROOT)
+    from Avanza_TT_core import FetchEngine, Ticker
+
+    engine = FetchEngine()
+    for folder in ["stock", "chart", "search"]: os.makedirs(os.path.join(directory, folder), exist_ok=True)
+    for orderbookId in orderbookIds:
+        with open(os.path.join(directory, "stock", "{}.json".format(orderbookId)), "w") as file: json.dump(engine.f_get('/_mobile/market/stock/{}'.format(orderbookId)).json(), file)
+        with open(os.path.join(directory, "chart", "{}.json".format(orderbookId)), "w") as file: json.dump({"dataPoints": Ticker.f_getChartPoints(engine, orderbookId)}, file)
+    for query in queries:
+        with open(os.path.join(directory, "search", "{}.json".format(query.lower())), "w") as file: json.dump(engine.f_get('/_cqbe/search/global-search/global-search-template', params={"query": query}).json(), file)
+    engine.f_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for avanza.se")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--latency", type=float, default=0, help="ms per response")
+    serve.add_argument("--jitter", type=float, default=0, help="ms, standard deviation of latency")
+    serve.add_argument("--error-rate", type=float, default=0, help="share of 503 responses")
+    serve.add_argument("--payload", type=int, default=0, help="bytes, quotes are padded up to this size")
+    serve.add_argument("--change-rate", type=float, default=1.0, help="probability that a quote changes between requests")
+    serve.add_argument("--etag", action="store_true", help="send ETag and answer If-None-Match with 304")
+    serve.add_argument("--fixtures", help="directory with recorded answers")
+
+    record = commands.add_parser("record")
+    record.add_argument("--fixtures", required=True)
+    record.add_argument("--query", action="append", default=[], help="search query to record")
+    record.add_argument("orderbookIds", type=int, nargs="+")
+
+    args = parser.parse_args()
+
+    if args.command == "record": return f_record(args.fixtures, args.orderbookIds, args.query)
+
+    server = f_start(args.port, args.latency, args.jitter, args.error_rate, args.payload, args.change_rate, args.etag, args.fixtures)
+    print("Serving on http://127.0.0.1:{} (Ctrl+C to stop)".format(server.server_port))
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt: server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+'''
+Refresh pipeline against the local stand-in for avanza.se (benchmarks/mock_avanza.py) with 10 ... 5000 holdings.
+Every size runs in a new process (peak memory of one size is not mixed with others), the mock server runs in this one.
+Steps (GUI - in the main window on the offscreen Qt platform, --no-gui - the same pipeline of Avanza_TT_core.Portfolios):
+* Ticker - quotes of all holdings (Ticker.f_fetch in the fetch engine)
+* f_updateTableContent - refresh until the table is filled and the file is written (cold - first one after start, warm - next one)
+* f_hdfFileUpdate - today's balance and snapshot written again
+* f_updateBalanceHistory - balances of the last days from the snapshots and price history (cold history cache) and the following refresh
+Reported: wall time, requests to the server and requests per second, peak RSS of the process after the step.
+
+python benchmarks/refresh.py [--sizes 10 100 1000 5000] [--latency 20] [--jitter 5] [--error-rate 0] [--payload 0] [--change-rate 1] [--etag] [--fixtures dir] [--no-gui]
+'''
+
+import os, sys, json, time, argparse, shutil, tempfile, subprocess, urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_avanza
+
+def f_requests(url):
+    with urllib.request.urlopen(url + "/_stats") as response: return json.load(response)["requests"]
+
+def f_peakRss():
+    ''' Peak resident memory of this process (MB) '''
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+
+def f_prepare(size, days=60):
+    ''' user_data.hdf5 with "size" holdings and their snapshots for the last business days (nothing is downloaded) '''
+    import numpy as np, h5py
+    from Avanza_TT_core import Portfolio, Schema, Snapshots
+
+    portfolio = Portfolio("user_data.hdf5")
+    portfolio.f_read()
+
+    ids = np.arange(100000, 100000 + size)
+    tickersInfo = np.zeros(size, dtype=Schema.tickersInfo)
+    tickersInfo["ID"], tickersInfo["Amount"], tickersInfo["Price last"] = ids, 10, 100.0
+    tickersInfo["Name"] = [Schema.f_bytes("Stock {}".format(i)) for i in ids]
+    tickersInfo["Currency"] = [[b"SEK", b"USD", b"EUR"][i % 3] for i in ids]
+    tickersInfo["Country"] = [[b"SE", b"US", b"DE"][i % 3] for i in ids]
+    currencyRates = np.array([(ticker, 10.0, Schema.f_bytes(name)) for ticker, name in Portfolio.defaultCurrencyTickers.items()], dtype=Schema.currencyRates)
+
+    with h5py.File("user_data.hdf5", "a") as file:
+        snapshots = Snapshots(file)
+        for day in np.busday_offset(np.datetime64(datetime.now().date()), np.arange(-days, 0), roll="backward"): snapshots.f_write(day, tickersInfo, currencyRates)
+
+def f_child(size, url, gui):
+    ''' Steps of one size (runs in a new process, the working directory is a new folder). Prints one JSON line per step '''
+    sys.path.insert(0, ROOT)
+    import Avanza_TT_core
+    Avanza_TT_core.FetchEngine.baseUrl = url
+
+    f_prepare(size)
+
+    def f_measure(step, function):
+        requests, started = f_requests(url), time.perf_counter()
+        function()
+        seconds = time.perf_counter() - started
+        print(json.dumps({"step": step, "seconds": seconds, "requests": f_requests(url) - requests, "rss": f_peakRss()}), flush=True)
+
+    # Quotes only (the session is opened before, holdings are the ones from the prepared file)
+    engine = Avanza_TT_core.FetchEngine()
+    engine.f_get("/")
+    f_measure("Ticker", lambda: engine.f_map(lambda ticker: Avanza_TT_core.Ticker.f_fetch(100000 + ticker, 10, engine), range(size)))
+    engine.f_close()
+
+    if not gui:
+        portfolios = Avanza_TT_core.Portfolios("user_data.hdf5")
+        portfolios.f_read()
+        portfolio = portfolios.items[None]
+        portfolio.f_convert(*portfolio.f_lastSnapshot(), stale=True)
+
+        def f_rewrite():
+            portfolio.unsaved = True
+            portfolio.saved.pop("balance", None)
+            portfolios.f_write()
+
+        f_measure("f_updateTableContent (cold)", portfolios.f_refresh)
+        f_measure("f_updateTableContent (warm)", portfolios.f_refresh)
+        f_measure("f_hdfFileUpdate", f_rewrite)
+        f_measure("f_updateBalanceHistory", lambda: (portfolio.f_backfill(), portfolios.f_refresh()))
+        portfolios.f_close()
+        return
+
+    import importlib.util
+    from PyQt5 import QtWidgets
+    spec = importlib.util.spec_from_file_location("Avanza_TT", os.path.join(ROOT, "Avanza_TT_V1.1.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    app = QtWidgets.QApplication(sys.argv)
+    prog = module.GUI()
+    prog.Interface_CheckBox_ShowWarnings.setChecked(False)
+
+    def f_wait():
+        ''' Events are processed until the running refresh is shown '''
+        while prog.refreshFuture is None or not prog.refreshFuture.done() or prog.statusbar.currentMessage() == "Updating...":
+            app.processEvents()
+            time.sleep(0.001)
+
+    def f_rewrite():
+        prog.portfolio.unsaved = True
+        prog.portfolio.saved.pop("balance", None)
+        prog.f_hdfFileUpdate()
+
+    # The first refresh is started by the window itself (with the first processed event)
+    f_measure("f_updateTableContent (cold)", f_wait)
+    f_measure("f_updateTableContent (warm)", lambda: (prog.f_updateTableContent(), f_wait()))
+    f_measure("f_hdfFileUpdate", f_rewrite)
+    def f_backfill():
+        ''' Balances are recomputed in the fetch engine, the refresh is started when they are shown '''
+        prog.f_updateBalanceHistory()
+        while not prog.Interface_Button_UpdateHistory.isEnabled():
+            app.processEvents()
+            time.sleep(0.001)
+        f_wait()
+
+    f_measure("f_updateBalanceHistory", f_backfill)
+    prog.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh pipeline with many holdings against a local stand-in for avanza.se")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="numbers of holdings")
+    parser.add_argument("--latency", type=float, default=20, help="ms per response")
+    parser.add_argument("--jitter", type=float, default=5, help="ms, standard deviation of latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of 503 responses")
+    parser.add_argument("--payload", type=int, default=0, help="bytes, quotes are padded up to this size")
+    parser.add_argument("--change-rate", type=float, default=1.0, help="probability that a quote changes between requests")
+    parser.add_argument("--etag", action="store_true", help="server sends ETag and answers If-None-Match with 304")
+    parser.add_argument("--fixtures", help="directory with recorded answers (see mock_avanza.py record)")
+    parser.add_argument("--no-gui", action="store_true", help="run the pipeline of Avanza_TT_core.Portfolios without the main window")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child: return f_child(int(args.child[0]), args.child[1], not args.no_gui)
+
+    server = mock_avanza.f_start(latency=args.latency, jitter=args.jitter, errorRate=args.error_rate, payload=args.payload, changeRate=args.change_rate, etag=args.etag, fixtures=args.fixtures)
+    url, env = "http://127.0.0.1:{}".format(server.server_port), dict(os.environ, QT_QPA_PLATFORM="offscreen")
+
+    print("{:>6}  {:<30}{:>10}{:>10}{:>10}{:>12}".format("size", "step", "seconds", "requests", "req/s", "peak RSS MB"))
+    for size in args.sizes:
+        workDir = tempfile.mkdtemp()
+        try:
+            command = [sys.executable, os.path.abspath(__file__), "--child", str(size), url] + (["--no-gui"] if args.no_gui else [])
+            output = subprocess.run(command, cwd=workDir, env=env, capture_output=True, text=True, timeout=3600)
+        finally: shutil.rmtree(workDir, ignore_errors=True)
+
+        lines = [json.loads(i) for i in output.stdout.splitlines() if i.startswith("{")]
+        if output.returncode != 0: print("{:>6}  failed:\n{}".format(size, output.stderr))
+        for i in lines:
+            print("{:>6}  {:<30}{:>10.3f}{:>10}{:>10.0f}{:>12.1f}".format(size, i["step"], i["seconds"], i["requests"], i["requests"] / i["seconds"] if i["seconds"] else 0, i["rss"]))
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+'''
+Startup time of Avanza_TT: from the start of the interpreter to the first paint of the main window.
+Every run is a new process, so module imports are measured as the user sees them.
+
+python benchmarks/startup.py [--runs 5] [--file user_data.hdf5] [--offscreen]
+'''
+
+import os, sys, time, json, argparse, shutil, tempfile, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process. Prints timestamps (time.time()) of the steps and exits without waiting for the first refresh
+CHILD = """
+import time; t_start = time.time()
+import os, sys, json, importlib.util
+sys.path.insert(0, {root!r})
+spec = importlib.util.spec_from_file_location("Avanza_TT", os.path.join({root!r}, "Avanza_TT_V1.1.py"))
+module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+t_import = time.time()
+
+from PyQt5 import QtCore, QtWidgets
+app = QtWidgets.QApplication(sys.argv)
+prog = module.GUI()
+t_init = time.time()
+
+class PaintFilter(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint:
+            print(json.dumps({{"start": t_start, "import": t_import, "init": t_init, "paint": time.time(), "modules": sorted(m for m in ("pandas", "h5py", "requests", "win10toast") if m in sys.modules)}}), flush=True)
+            os._exit(0)
+        return False
+
+paintFilter = PaintFilter()
+prog.installEventFilter(paintFilter)
+prog.show()
+app.exec_()
+"""
+
+def f_run(workDir, offscreen):
+    ''' One startup. Returns seconds from process start to: modules imported, window created, first paint '''
+
+    env = dict(os.environ, **({"QT_QPA_PLATFORM": "offscreen"} if offscreen else {}))
+    started = time.time()
+    output = subprocess.run([sys.executable, "-c", CHILD.format(root=ROOT)], cwd=workDir, env=env, capture_output=True, text=True, timeout=120)
+    line = [i for i in output.stdout.splitlines() if i.startswith("{")]
+    if not line: raise RuntimeError("Window was not painted:\n" + output.stderr)
+
+    times = json.loads(line[-1])
+    return {"interpreter": times["start"] - started, "import": times["import"] - started, "init": times["init"] - started, "paint": times["paint"] - started}, times["modules"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to the first paint of the main window")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--file", help="user_data.hdf5 to start with (a new file is created if not set)")
+    parser.add_argument("--offscreen", action="store_true", help="use the offscreen Qt platform (no display needed)")
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        workDir = tempfile.mkdtemp()
+        if args.file: shutil.copy(args.file, os.path.join(workDir, "user_data.hdf5"))
+        try:
+            times, modules = f_run(workDir, args.offscreen)
+            results.append(times)
+        finally: shutil.rmtree(workDir, ignore_errors=True)
+
+    print("{:<12}{:>10}{:>10}".format("seconds", "median", "min"))
+    for step in ["interpreter", "import", "init", "paint"]:
+        values = [i[step] for i in results]
+        print("{:<12}{:>10.3f}{:>10.3f}".format(step, statistics.median(values), min(values)))
+    print("Heavy modules loaded at the first paint (also by the background refresh): " + (", ".join(modules) or "none"))
+
+if __name__ == "__main__":
+    main()
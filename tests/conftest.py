@@ -0,0 +1,4 @@
+import os, sys
+
+# Avanza_TT_core.py is a module at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+'''
+Alert rules: thresholds, crossings, cooldown and the state kept in alerts.npz (Alerts.f_evaluate).
+'''
+
+import time
+
+import numpy as np, pytest
+
+from Avanza_TT_core import Alerts
+
+def f_values(changes, prices=None):
+    ''' Fields x Columns with changePercent (and price) set, the other fields are NaN '''
+    values = np.full((len(Alerts.fields), len(changes)), np.nan)
+    values[Alerts.fields.index("changePercent")] = changes
+    if prices is not None: values[Alerts.fields.index("price")] = prices
+    return values
+
+@pytest.fixture
+def alerts(tmp_path):
+    alerts = Alerts(str(tmp_path / "alerts.json"))
+    alerts.f_read()
+    return alerts
+
+def test_threshold_cooldown(alerts):
+    alerts.f_add("changePercent", "<", -3, cooldown=3600)
+    columns = ["5361", "293975"]
+
+    fired = alerts.f_evaluate(columns, f_values([-4, -1]), now=1000)
+    assert [(i["column"], i["value"]) for i in fired] == [("5361", -4)]
+
+    # Condition holds, but the cooldown is not over
+    assert alerts.f_evaluate(columns, f_values([-5, -1]), now=1000 + 3599) == []
+    assert [i["column"] for i in alerts.f_evaluate(columns, f_values([-5, -4]), now=1000 + 3599)] == ["293975"]
+    assert [i["column"] for i in alerts.f_evaluate(columns, f_values([-5, -4]), now=1000 + 3600)] == ["5361"]
+
+def test_crossing(alerts):
+    alerts.f_add("price", "crosses above", 100)
+    columns = ["5361"]
+
+    # Nothing crosses from an unknown value
+    assert alerts.f_evaluate(columns, f_values([0], [105]), now=0) == []
+    assert alerts.f_evaluate(columns, f_values([0], [95]), now=1) == []
+    assert [i["value"] for i in alerts.f_evaluate(columns, f_values([0], [101]), now=2)] == [101]
+
+    # Back below and above again, in cooldown
+    alerts.f_evaluate(columns, f_values([0], [99]), now=3)
+    assert alerts.f_evaluate(columns, f_values([0], [102]), now=4) == []
+    alerts.f_evaluate(columns, f_values([0], [99]), now=2 + Alerts.cooldown)
+    assert len(alerts.f_evaluate(columns, f_values([0], [102]), now=3 + Alerts.cooldown)) == 1
+
+def test_target(alerts):
+    alerts.f_add("changePercent", "<", -3, target=293975)
+    fired = alerts.f_evaluate(["5361", "293975"], f_values([-4, -4]), now=0)
+    assert [i["column"] for i in fired] == ["293975"]
+
+    # Another target of the same rule id is checked on its own pairs
+    alerts.f_add("changePercent", "<", -3, target=5361, id=fired[0]["rule"]["id"])
+    assert [i["column"] for i in alerts.f_evaluate(["5361", "293975"], f_values([-4, -4]), now=1)] == ["5361"]
+
+def test_columns_change(alerts):
+    ''' Times of the alerts follow their columns when columns are added, removed or reordered '''
+    alerts.f_add("changePercent", "<", -3)
+    assert len(alerts.f_evaluate(["1", "2", "3"], f_values([-4, -4, 0]), now=0)) == 2
+    assert [i["column"] for i in alerts.f_evaluate(["4", "3", "2"], f_values([-4, -4, -4]), now=1)] == ["4", "3"]
+
+def test_state(alerts):
+    alerts.f_add("changePercent", "<", -3)
+    alerts.f_add("price", "crosses below", 50)
+    now = time.time()
+    alerts.f_evaluate(["5361"], f_values([-4], [60]), now=now)
+    alerts.f_write()
+
+    # Alert in cooldown and the last values survive a restart
+    restarted = Alerts(alerts.path)
+    restarted.f_read()
+    assert [i["rule"]["field"] for i in restarted.f_evaluate(["5361"], f_values([-4], [40]), now=now + 1)] == ["price"]
+    assert not restarted.unsaved
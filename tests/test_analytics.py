@@ -0,0 +1,44 @@
+'''
+Analytics of the holdings against the same measures computed with pandas.
+'''
+
+import numpy as np, pandas as pd, pytest
+
+from Avanza_TT_core import Analytics
+
+@pytest.fixture
+def returns():
+    ''' Days x Tickers daily returns with gaps (holidays of one market, ticker listed later) '''
+    generator = np.random.default_rng(5)
+    data = generator.normal(0, 0.02, (300, 4))
+    data[generator.random(data.shape) < 0.1] = np.nan
+    data[:40, 3] = np.nan
+    return data
+
+def test_matrix():
+    points = []
+    for days, prices in [([1, 2, 3, 5], [10, 11, 12, 13]), ([2, 4, 5], [20, 21, 22])]:
+        chart = np.zeros(len(days), dtype=[("Date", "<i8"), ("Price", "<f8")])
+        chart["Date"], chart["Price"] = np.array(days) * 86400000 - 3600000, prices
+        points.append(chart)
+
+    days, prices = Analytics.f_matrix(points)
+    expected = pd.concat({i: pd.Series(chart["Price"], index=(chart["Date"] + 43200000) // 86400000) for i, chart in enumerate(points)}, axis=1).sort_index().ffill()
+    assert days.astype(np.int64).tolist() == expected.index.tolist()
+    np.testing.assert_array_equal(prices, expected.to_numpy())
+
+def test_rollingStd(returns):
+    window = Analytics.volatilityWindow
+    expected = pd.DataFrame(returns).rolling(window, min_periods=2).std().to_numpy()
+    result = Analytics.f_rollingStd(returns, window)
+
+    assert result.shape == returns.shape and np.isnan(result[:window - 1]).all()
+    np.testing.assert_allclose(result[window - 1:], expected[window - 1:], rtol=1e-9)
+
+def test_beta(returns):
+    market = np.nanmean(returns, axis=1)
+    expected = [pd.DataFrame({"x": returns[:, i], "y": market}).dropna().cov().loc["x", "y"] / pd.Series(market[~np.isnan(returns[:, i])]).var() for i in range(returns.shape[1])]
+    np.testing.assert_allclose(Analytics.f_beta(returns, market), expected, rtol=1e-9)
+
+def test_correlation(returns):
+    np.testing.assert_allclose(Analytics.f_correlation(returns), pd.DataFrame(returns).corr().to_numpy(), rtol=1e-9)
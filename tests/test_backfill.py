@@ -0,0 +1,85 @@
+'''
+Balance history from the stored snapshots and the local price history (Portfolio.f_backfill) against the day by day computation of the first version.
+'''
+
+import time
+
+import numpy as np, pandas as pd, h5py, pytest
+
+from Avanza_TT_core import Portfolio, FetchEngine, Snapshots, Balance, Schema, Ticker
+
+# Holdings (orderbookId: amount, currency) of the stored days; the days between them were not stored
+snapshots = {"2026-06-01": {1: (10, "SEK"), 2: (5, "USD")},
+             "2026-06-04": {1: (10, "SEK"), 2: (5, "USD"), 3: (7, "EUR")},
+             "2026-06-15": {1: (12, "SEK"), 3: (7, "EUR"), 4: (3, "GBP")},
+             "2026-06-24": {1: (12, "SEK"), 3: (2, "EUR"), 4: (3, "GBP")}}
+pairs = {19000: "USD/SEK", 18998: "EUR/SEK"}
+
+@pytest.fixture
+def charts():
+    ''' Daily prices of the instruments and pairs: one holiday of ticker 3, a day without the EUR rate '''
+    generator, days = np.random.default_rng(8), pd.bdate_range("2026-05-01", "2026-07-10")
+    charts = {number: pd.Series(np.round(generator.uniform(50, 150, len(days)), 2), index=days) for number in [1, 2, 3, 4, 19000, 18998]}
+    charts[3], charts[18998] = charts[3].drop(pd.Timestamp("2026-06-19")), charts[18998].drop(pd.Timestamp("2026-06-10"))
+    return charts
+
+@pytest.fixture
+def portfolio(tmp_path, charts):
+    path = str(tmp_path / "user_data.hdf5")
+    portfolio = Portfolio(path, FetchEngine())
+    portfolio.f_read()
+    portfolio.CURRENCY_RATES_TICKERS = dict(pairs)
+
+    with h5py.File(path, "a") as file:
+        for day, holdings in snapshots.items():
+            tickersInfo = np.zeros(len(holdings), dtype=Schema.tickersInfo)
+            tickersInfo["ID"], tickersInfo["Amount"], tickersInfo["Currency"] = list(holdings), [i[0] for i in holdings.values()], [i[1].encode() for i in holdings.values()]
+            Snapshots(file).f_write(day, tickersInfo, np.zeros(0, dtype=Schema.currencyRates))
+
+    # Fresh local history, nothing is downloaded
+    with h5py.File(str(tmp_path / "history.hdf5"), "w") as file:
+        for number, prices in charts.items():
+            points = np.zeros(len(prices), dtype=Ticker.chartDtype)
+            points["Date"], points["Price"] = prices.index.values.astype("datetime64[D]").astype(np.int64) * 86400000 - 7200000, prices.to_numpy()
+            file.create_dataset(str(number), data=points)
+            file[str(number)].attrs["Size"], file[str(number)].attrs["Checked"] = len(points), time.time()
+
+    yield portfolio
+    portfolio.engine.f_close()
+
+def f_reference(charts):
+    ''' Day by day, as the first version did: holdings of a missing day are the ones of the next stored day, a day with a missing price is skipped,
+    a holding without currency rate is not counted '''
+    stored = [pd.Timestamp(day) for day in snapshots]
+    totals = {}
+    for day in pd.bdate_range(stored[0], stored[-1]):
+        holdings = snapshots[str(next(i for i in stored if i >= day).date())]
+        if any(day not in charts[ticker].index for ticker in holdings): continue
+
+        total = 0.0
+        for ticker, (amount, currency) in holdings.items():
+            pair = next((number for number, name in pairs.items() if name == currency + "/SEK"), None)
+            rate = 1.0 if currency == "SEK" else charts[pair].get(day, np.nan) if pair is not None else np.nan
+            if not np.isnan(rate): total += amount * charts[ticker][day] * rate
+        totals[str(day.date())] = round(total)
+    return totals
+
+def f_balance(portfolio):
+    with h5py.File(portfolio.path, "r") as file: balance = Balance(file).f_read()
+    return dict(zip(balance["Date"].astype("datetime64[D]").astype(str).tolist(), balance["Total"].tolist()))
+
+def test_backfill(portfolio, charts):
+    expected = f_reference(charts)
+    assert "2026-06-19" not in expected and "2026-06-10" in expected
+
+    assert portfolio.f_backfill() == len(expected)
+    assert f_balance(portfolio) == pytest.approx(expected)
+
+def test_backfill_since(portfolio, charts):
+    ''' Only the days from the date on are computed again, the older ones are kept '''
+    portfolio.f_backfill()
+    with h5py.File(portfolio.path, "a") as file: Balance(file).f_replaceFrom("2026-06-12", np.zeros(0, dtype=Schema.balance))
+
+    expected = f_reference(charts)
+    assert portfolio.f_backfill("2026-06-12") == len([day for day in expected if day >= "2026-06-12"])
+    assert f_balance(portfolio) == pytest.approx(expected)
@@ -0,0 +1,39 @@
+'''
+Trading hours, holidays and daylight saving of the exchanges (MarketCalendar).
+'''
+
+from datetime import datetime, date
+
+import pytest
+
+from Avanza_TT_core import MarketCalendar
+
+@pytest.mark.parametrize("flagCode, day", [
+    ("SE", date(2026, 4, 3)), ("SE", date(2026, 4, 6)), ("SE", date(2026, 5, 14)), ("SE", date(2026, 6, 19)), ("SE", date(2025, 6, 20)), ("SE", date(2026, 12, 24)),
+    ("US", date(2026, 1, 19)), ("US", date(2026, 5, 25)), ("US", date(2026, 7, 3)), ("US", date(2026, 11, 26)), ("US", date(2027, 6, 18)),
+    ("GB", date(2021, 12, 27)), ("GB", date(2021, 12, 28)), ("GB", date(2026, 8, 31))])
+def test_holidays(flagCode, day):
+    assert day in MarketCalendar.f_holidays(flagCode, day.year)
+
+def test_easter():
+    assert [MarketCalendar.f_easter(year) for year in [2024, 2025, 2026, 2038]] == [date(2024, 3, 31), date(2025, 4, 20), date(2026, 4, 5), date(2038, 4, 25)]
+
+@pytest.mark.parametrize("flagCode, utc, offset", [
+    # EU: last Sunday of March and of October, 01:00 UTC
+    ("SE", datetime(2026, 3, 29, 0, 59), 1), ("SE", datetime(2026, 3, 29, 1, 0), 2), ("SE", datetime(2026, 10, 25, 0, 59), 2), ("SE", datetime(2026, 10, 25, 1, 0), 1),
+    ("GB", datetime(2026, 7, 1), 1), ("FI", datetime(2026, 1, 1), 2),
+    # US: second Sunday of March and first Sunday of November, 02:00 local time
+    ("US", datetime(2026, 3, 8, 6, 59), -5), ("US", datetime(2026, 3, 8, 7, 0), -4), ("US", datetime(2026, 11, 1, 5, 59), -4), ("US", datetime(2026, 11, 1, 6, 0), -5)])
+def test_utcOffset(flagCode, utc, offset):
+    assert MarketCalendar.f_utcOffset(flagCode, utc) == offset
+
+def test_session():
+    # Stockholm in summer time, New York between the European and the American switch (four hours to UTC instead of five)
+    assert MarketCalendar.f_session("SE", datetime(2026, 6, 1, 10)) == (datetime(2026, 6, 1, 7), datetime(2026, 6, 1, 15, 30))
+    assert MarketCalendar.f_session("US", datetime(2026, 3, 20, 12)) == (datetime(2026, 3, 20, 13, 30), datetime(2026, 3, 20, 20))
+
+    # Good Friday and Easter Monday are skipped
+    assert MarketCalendar.f_session("SE", datetime(2026, 4, 2, 16))[0] == datetime(2026, 4, 7, 7)
+    assert not MarketCalendar.f_isOpen("US", datetime(2026, 11, 26, 15))
+    assert MarketCalendar.f_isOpen("US", datetime(2026, 11, 26, 21, 2), grace=300) is False
+    assert MarketCalendar.f_isOpen("US", datetime(2026, 11, 27, 21, 2), grace=300)
@@ -0,0 +1,24 @@
+'''
+Conversion of every currency to SEK through the available pairs (FxEngine).
+'''
+
+import numpy as np
+
+from Avanza_TT_core import FxEngine
+
+def test_paths():
+    pairs = ["USD/SEK", "SEK/NOK", "EUR/USD", "GBP/EUR", "JPY/CHF", "broken"]
+    paths = FxEngine.f_paths(pairs, ["SEK", "USD", "NOK", "EUR", "GBP", "JPY", "DKK"])
+    assert paths == [[], [("USD/SEK", 1)], [("SEK/NOK", -1)], [("EUR/USD", 1), ("USD/SEK", 1)], [("GBP/EUR", 1), ("EUR/USD", 1), ("USD/SEK", 1)], None, None]
+
+def test_paths_shortest():
+    ''' Direct pair is used even if a chain is listed first '''
+    assert FxEngine.f_paths(["EUR/USD", "USD/SEK", "eur / sek"], ["EUR"]) == [[("eur / sek", 1)]]
+
+def test_toBase():
+    currencyRates = {"USD/SEK": [10.0, 19000], "SEK/NOK": [1.0 / 0.95, 53293], "EUR/USD": [1.1, 18998], "GBP/EUR": [1.2, 0], "CHF/SEK": [np.nan, 1], "JPY/CHF": [0.006, 2]}
+    rates = FxEngine.f_toBase(currencyRates, ["SEK", "USD", "NOK", "EUR", "GBP", "JPY"])
+
+    np.testing.assert_allclose(rates[:5], [1.0, 10.0, 0.95, 11.0, 13.2])
+    # CHF/SEK is not known, so JPY has no way to SEK
+    assert np.isnan(rates[5])
@@ -0,0 +1,105 @@
+'''
+Local price history (HistoryCache): download of the missing days only, appends in place and reads of a range of days.
+'''
+
+import json
+from datetime import datetime
+
+import numpy as np, h5py, pytest
+
+from Avanza_TT_core import HistoryCache, Ticker
+
+class Response:
+    def __init__(self, data): self.data = data
+    def json(self): return self.data
+
+class Engine:
+    ''' Chart of one price per day (the day number) up to the day before "today", as long as the requested period '''
+    days = {"one_week": 7, "one_month": 31, "three_months": 92, "one_year": 366, "three_years": 1096}
+
+    def __init__(self, today):
+        self.today, self.periods = np.datetime64(today, "D"), []
+
+    def f_post(self, path, data, headers):
+        period = json.loads(data)["timePeriod"]
+        self.periods.append(period)
+        days = np.arange(self.today - self.days[period], self.today).astype(np.int64)
+        # Stamped at midnight Stockholm time
+        return Response({"dataPoints": [[int(day) * 86400000 - 7200000, float(day)] for day in days]})
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "history.hdf5")
+
+def f_days(points):
+    return ((points["Date"] + 43200000) // 86400000).tolist()
+
+def test_topUp(path):
+    # Last stored day is ten days old, whatever the weekday is
+    today = np.datetime64(datetime.now().date())
+    engine = Engine(today - 10)
+    history = HistoryCache(engine, path)
+
+    points = history.f_points(5361)
+    assert engine.periods == ["three_years"] and len(points) == 1096
+    contiguous, size, capacity, _, latest = history.layout["5361"]
+    assert contiguous and size == 1096 and capacity == 1096 + HistoryCache.spare and latest == points["Date"][-1]
+
+    # After a restart only the missing days are downloaded and appended in place
+    engine.today = today
+    history = HistoryCache(engine, path)
+    history.maxAge = -1
+    points = history.f_points(5361)
+    assert engine.periods == ["three_years", "one_month"]
+    assert f_days(points) == np.arange(today - 1106, today).astype(np.int64).tolist()
+    assert history.layout["5361"][1:3] == (1106, capacity)
+
+    with h5py.File(path, "r") as file:
+        assert file["5361"].shape == (capacity,) and file["5361"].attrs["Size"] == 1106
+        np.testing.assert_array_equal(file["5361"][:1106], points)
+
+def test_move(path):
+    ''' Dataset is moved when its free rows are used up '''
+    today = np.datetime64(datetime.now().date())
+    engine = Engine(today - 10)
+    history = HistoryCache(engine, path)
+    history.spare = 4
+    history.f_points(5361)
+
+    engine.today, history.maxAge = today, -1
+    history.data.clear()
+    assert len(history.f_points(5361)) == 1106
+    assert history.layout["5361"][:3] == (True, 1106, 1110)
+    with h5py.File(path, "r") as file: assert list(file) == ["5361"]
+
+def test_range(path):
+    ''' Days of a ticker which is not in memory are read from the file, the whole series isn't '''
+    today = np.datetime64(datetime.now().date())
+    engine = Engine(today)
+    HistoryCache(engine, path).f_points(5361)
+
+    history = HistoryCache(engine, path)
+    points = history.f_points(5361, today - 30, today - 21)
+    assert f_days(points) == np.arange(today - 30, today - 20).astype(np.int64).tolist()
+    assert engine.periods == ["three_years"] and history.data == {}
+
+    # Whole series is kept in memory
+    assert len(history.f_points(5361)) == 1096 and list(history.data) == ["5361"]
+    np.testing.assert_array_equal(history.f_points(5361, today - 30, today - 21), points)
+
+def test_chunked(path):
+    ''' Compressed dataset of an older version is moved to the contiguous layout with the next download '''
+    today = np.datetime64(datetime.now().date())
+    old = Ticker.f_chartArray(Engine(today - 10).f_post("", json.dumps({"timePeriod": "one_year"}), {}).json()["dataPoints"])
+    with h5py.File(path, "w") as file:
+        file.create_dataset("5361", data=old, maxshape=(None,), chunks=True, compression="gzip")
+        file["5361"].attrs["Checked"] = 0.0
+
+    engine = Engine(today)
+    history = HistoryCache(engine, path)
+    assert history.f_layout()["5361"][:3] == (False, 366, 366)
+
+    points = history.f_points(5361)
+    assert engine.periods == ["one_month"] and len(points) == 376
+    assert history.layout["5361"][:3] == (True, 376, 376 + HistoryCache.spare)
+    with h5py.File(path, "r") as file: assert file["5361"].chunks is None
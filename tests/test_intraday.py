@@ -0,0 +1,59 @@
+'''
+Recording of the intraday quotes: ring buffer, times of the quotes and appends to intraday.hdf5 (IntradayRecorder).
+'''
+
+from datetime import datetime, timezone
+
+import pytest
+
+from Avanza_TT_core import RingBuffer, IntradayRecorder, Schema
+
+class Ticker:
+    def __init__(self, number, updated, price):
+        self.number, self.price_last, self.changePercent = number, price, 0.5
+        self.ticker = {"lastPriceUpdated": updated}
+
+@pytest.fixture
+def recorder(tmp_path):
+    # Writes only when f_flush is called
+    recorder = IntradayRecorder(str(tmp_path / "intraday.hdf5"), interval=3600)
+    yield recorder
+    recorder.f_close()
+
+def test_ringBuffer():
+    buffer = RingBuffer(4, Schema.intraday)
+    assert sum(buffer.f_push((i, i, 0)) for i in range(3)) == 0
+    assert buffer.f_drain()["Time"].tolist() == [0, 1, 2] and len(buffer.f_drain()) == 0
+
+    # Two rows more than fit: the oldest ones are overwritten and counted
+    assert sum(buffer.f_push((i, i, 0)) for i in range(3, 9)) == 2
+    assert buffer.f_drain()["Time"].tolist() == [5, 6, 7, 8]
+
+@pytest.mark.parametrize("text", ["2026-10-16T15:29:59.000+0200", "2026-10-16T15:29:59+0200", "2026-10-16T15:29:59+02:00", "2026-10-16T13:29:59Z"])
+def test_time(text):
+    assert IntradayRecorder.f_time(text) == datetime(2026, 10, 16, 13, 29, 59, tzinfo=timezone.utc).timestamp() * 1000
+
+def test_record(recorder):
+    recorder.f_record([Ticker(5361, "2026-10-16T09:00:00.000+0200", 100.0), Ticker(5361, "2026-10-16T09:00:00.000+0200", 100.0), Ticker(293975, "invalid", 50.0)])
+    recorder.f_record([Ticker(5361, "2026-10-16T09:01:00.000+0200", 101.0)])
+
+    # Same quote of the next refresh is not added again, the instrument without a time is not recorded
+    assert list(recorder.buffers) == [5361] and recorder.invalid == {293975}
+    assert recorder.f_flush() == 2
+    assert IntradayRecorder.f_read(recorder.path, 5361)["Price"].tolist() == [100.0, 101.0]
+
+def test_flush_restart(recorder):
+    ''' Quotes which are in the file already (recorded before a restart) are not appended again '''
+    recorder.f_record([Ticker(5361, "2026-10-16T09:00:00.000+0200", 100.0), Ticker(5361, "2026-10-16T09:01:00.000+0200", 101.0)])
+    recorder.f_flush()
+
+    restarted = IntradayRecorder(recorder.path, interval=3600)
+    restarted.f_record([Ticker(5361, "2026-10-16T09:01:00.000+0200", 101.0)])
+    restarted.f_record([Ticker(5361, "2026-10-16T09:02:00.000+0200", 102.0)])
+    assert restarted.f_flush() == 1
+    restarted.f_close()
+
+    stored = IntradayRecorder.f_read(recorder.path, 5361)
+    assert stored["Price"].tolist() == [100.0, 101.0, 102.0]
+    assert IntradayRecorder.f_read(recorder.path, 5361, start=int(stored["Time"][1]))["Price"].tolist() == [101.0, 102.0]
+    assert recorder.dropped == 0 and restarted.dropped == 0
@@ -0,0 +1,107 @@
+'''
+Storage of user_data.hdf5: migration of the older layouts, snapshot and balance tables.
+
+python -m pytest tests
+'''
+
+import os
+from datetime import date
+
+import numpy as np, h5py, pytest
+
+from Avanza_TT_core import Schema, Snapshots, Balance
+
+def f_writeV1(path):
+    ''' user_data.hdf5 as the first version wrote it: every value of the snapshots is a byte string, balance is text '''
+    with h5py.File(path, "w") as file:
+        group = file.create_group("tickers")
+        group.create_dataset("Tickers Indexes", data=[i.encode() for i in Schema.tickersInfo.names])
+        group.create_dataset("Balance", data=np.array([[b"2026-09-01", b"40000 SEK"], [b"2026-09-15", b"41000 SEK + 10 USD"], [b"2026-10-01", b"42000 SEK + 0 EUR"]]), maxshape=(None, 2), chunks=True)
+        file.create_dataset("proxy", (1, 1), dtype=h5py.special_dtype(vlen=str))[:, 0] = ["proxy:8080"]
+
+        holdings = {"2026-09-01": {5361: 10, 293975: 5}, "2026-09-15": {5361: 10, 293975: 5, 599956: 3}, "2026-10-01": {5361: 12, 599956: 3}}
+        for day, tickers in holdings.items():
+            rows = np.array([[number, amount, "Stock {}".format(number).encode(), 0.5, 100.0, 99.0, 95.0, 90.0, 80.0, b"10/01, 17:29", b"SE", b"USD" if number == 599956 else b"SEK", b"n/a", 20.1, 2.5, b"Tech"] for number, amount in tickers.items()])
+            group.create_group(day).create_dataset("Tickers Info", data=rows, maxshape=(None, 16), chunks=True)
+            group[day].create_dataset("Currency rates", data=np.array([[19000, 10.5, b"USD/SEK"], [18998, 11.4, b"EUR/SEK"]]), maxshape=(None, 3), chunks=True)
+
+def test_migrate_v1(tmp_path):
+    path = str(tmp_path / "user_data.hdf5")
+    f_writeV1(path)
+
+    assert Schema.f_migrate(path)
+    assert os.path.exists(path + ".v1.bak") and not os.path.exists(path + ".migrate")
+    assert not Schema.f_migrate(path)
+
+    with h5py.File(path, "r") as file:
+        assert file.attrs["Schema"] == Schema.version
+        assert "tickers" not in file
+        assert file["proxy"][0, 0].decode() == "proxy:8080"
+
+        # Balance: one row per date and currency, zero totals are dropped
+        balance = Balance(file).f_read()
+        assert balance.dtype == Schema.balance
+        assert [(np.datetime64(int(i["Date"]), "D"), i["Currency"], i["Total"]) for i in balance] == [
+            (np.datetime64("2026-09-01"), b"SEK", 40000.0), (np.datetime64("2026-09-15"), b"SEK", 41000.0), (np.datetime64("2026-09-15"), b"USD", 10.0), (np.datetime64("2026-10-01"), b"SEK", 42000.0)]
+
+        # Snapshots: typed rows of every day, text which is not a number is NaN
+        snapshots = Snapshots(file)
+        assert snapshots.index["Date"].astype("datetime64[D]").tolist() == [date(2026, 9, 1), date(2026, 9, 15), date(2026, 10, 1)]
+
+        tickersInfo, currencyRates = snapshots.f_latest()
+        assert tickersInfo["ID"].tolist() == [5361, 599956] and tickersInfo["Amount"].tolist() == [12, 3]
+        assert tickersInfo["Name"].tolist() == [b"Stock 5361", b"Stock 599956"] and tickersInfo["Currency"].tolist() == [b"SEK", b"USD"]
+        assert tickersInfo["Price one year"].tolist() == [80.0, 80.0] and np.isnan(tickersInfo["P/E ratio"]).all()
+        assert currencyRates[["ID", "Rate", "Name"]].tolist() == [(19000, 10.5, b"USD/SEK"), (18998, 11.4, b"EUR/SEK")]
+
+        assert len(snapshots.f_range(start="2026-09-15", stop="2026-09-15")) == 3
+
+def test_snapshot_earlier_date(tmp_path):
+    ''' A snapshot dated before the last stored one (the clock was turned back) is skipped, the stored days are kept '''
+    path = str(tmp_path / "user_data.hdf5")
+    f_writeV1(path)
+    Schema.f_migrate(path)
+
+    with h5py.File(path, "a") as file:
+        snapshots = Snapshots(file)
+        tickersInfo, currencyRates = snapshots.f_latest()
+
+        assert not snapshots.f_write(date(2026, 9, 30), tickersInfo, currencyRates)
+        assert snapshots.index["Date"].astype("datetime64[D]").tolist()[-1] == date(2026, 10, 1)
+        assert snapshots.f_write(date(2026, 10, 1), tickersInfo[:1], currencyRates)
+        assert Snapshots(file).f_latest()[0]["ID"].tolist() == [5361]
+
+def f_balance(days, total=100.0):
+    return np.array([(np.datetime64(day, "D").astype(np.int64), b"SEK", total) for day in days], dtype=Schema.balance)
+
+def f_dates(file):
+    return np.array(file["balance"]["Date"]).astype("datetime64[D]").astype(str).tolist()
+
+def test_balance_replace(tmp_path):
+    with h5py.File(str(tmp_path / "user_data.hdf5"), "w") as file:
+        Balance.f_create(file, f_balance(["2026-10-01", "2026-10-02", "2026-10-05"]))
+
+        Balance.f_replace(file, f_balance(["2026-09-30", "2026-10-01"], 200.0))
+        assert f_dates(file) == ["2026-09-30", "2026-10-01"] and set(file) == {"balance"}
+
+        # Rows before the date are copied a few at a time, the new ones follow
+        balance = Balance(file)
+        balance.f_write("2026-10-02", {"SEK": 1.0})
+        balance.f_replaceFrom("2026-10-01", f_balance(["2026-10-01", "2026-10-02", "2026-10-03"], 300.0), step=1)
+        assert f_dates(file) == ["2026-09-30", "2026-10-01", "2026-10-02", "2026-10-03"] and set(file) == {"balance"}
+        assert balance.f_read()["Total"].tolist() == [200.0, 300.0, 300.0, 300.0]
+
+@pytest.mark.parametrize("tables, expected", [
+    # Crash while "balance.new" was written: the old rows are kept
+    ({"balance": "2026-10-01", "balance.new": "2026-10-02"}, "2026-10-01"),
+    # Crash after "balance" was moved aside: "balance.new" is complete
+    ({"balance.old": "2026-10-01", "balance.new": "2026-10-02"}, "2026-10-02"),
+    # Crash before "balance.old" was deleted
+    ({"balance": "2026-10-02", "balance.old": "2026-10-01"}, "2026-10-02"),
+    ({"balance.old": "2026-10-01"}, "2026-10-01")])
+def test_balance_recover(tmp_path, tables, expected):
+    with h5py.File(str(tmp_path / "user_data.hdf5"), "w") as file:
+        for name, day in tables.items(): Schema.f_createTable(file, name, f_balance([day]))
+
+        Balance.f_recover(file)
+        assert set(file) == {"balance"} and f_dates(file) == [expected]
@@ -0,0 +1,67 @@
+'''
+Instrument search cache: exact hits, narrowing of a complete prefix result and expiry (InstrumentSearch).
+'''
+
+import time
+
+import pytest
+
+from Avanza_TT_core import InstrumentSearch
+
+class Response:
+    def __init__(self, data): self.data = data
+    def json(self): return self.data
+
+class Engine:
+    ''' Answers global-search with the stocks whose name contains the query, at most "limit" hits per group '''
+    stocks = [(5361, "Volvo B"), (5362, "Volvo A"), (5247, "Investor B"), (5246, "Investor A"), (26268, "Volati")]
+
+    def __init__(self, limit=10):
+        self.limit, self.queries = limit, []
+
+    def f_get(self, path, params):
+        self.queries.append(params["query"])
+        hits = [{"name": name, "link": {"orderbookId": number}} for number, name in self.stocks if params["query"].lower() in name.lower()]
+        return Response({"resultGroups": [{"instrumentType": "STOCK", "numberOfHits": len(hits), "hits": hits[:self.limit]}, {"instrumentType": "FUND", "numberOfHits": 0, "hits": []}]})
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+def test_prefix(clock):
+    engine = Engine()
+    search = InstrumentSearch(engine)
+
+    assert search.f_search("vol") == [("5361", "Volvo B"), ("5362", "Volvo A"), ("26268", "Volati")]
+    assert search.f_cached("vol") == search.f_search("vol ")
+
+    # Complete result of the prefix is filtered, nothing is requested
+    assert search.f_cached("volv") == [("5361", "Volvo B"), ("5362", "Volvo A")]
+    assert search.f_search("volvo a") == [("5362", "Volvo A")]
+    assert search.f_cached("inv") is None
+    assert engine.queries == ["vol"]
+
+def test_prefix_incomplete(clock):
+    ''' A result which is cut (more hits than returned) can't answer a longer query '''
+    engine = Engine(limit=2)
+    search = InstrumentSearch(engine)
+
+    search.f_search("vol")
+    assert search.f_cached("vola") is None
+    assert search.f_search("vola") == [("26268", "Volati")]
+    assert engine.queries == ["vol", "vola"]
+
+def test_ttl(clock):
+    engine = Engine()
+    search = InstrumentSearch(engine)
+
+    search.f_search("investor")
+    clock[0] += InstrumentSearch.ttl - 1
+    assert search.f_cached("investor b") == [("5247", "Investor B")]
+
+    clock[0] += 2
+    assert search.f_cached("investor b") is None and "investor" not in search.cache
+    search.f_search("investor")
+    assert engine.queries == ["investor", "investor"]
@@ -0,0 +1,62 @@
+'''
+Table model of the holdings: a refresh signals only the removed, added and changed rows (PortfolioTableModel.f_setRows).
+'''
+
+import os, importlib.util
+
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("pyqtgraph")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# Avanza_TT_V1.1.py can't be imported by its name
+spec = importlib.util.spec_from_file_location("Avanza_TT_GUI", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Avanza_TT_V1.1.py"))
+gui = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(gui)
+
+class Ticker:
+    def __init__(self, number, change=0.5):
+        self.number, self.count, self.name, self.country, self.price_updateTime = number, 10, "Stock {}".format(number), "SE", "10/16, 17:29"
+        self.peRatio, self.changePercent = 15.0, change
+
+def f_rows(numbers, changes={}):
+    return [(Ticker(number, changes.get(number, 0.5)), 100.0, 1000.0, "SEK") for number in numbers]
+
+@pytest.fixture
+def model():
+    model, signals = gui.PortfolioTableModel(), []
+    model.modelReset.connect(lambda: signals.append(("reset",)))
+    model.rowsRemoved.connect(lambda parent, first, last: signals.append(("removed", first, last)))
+    model.rowsInserted.connect(lambda parent, first, last: signals.append(("inserted", first, last)))
+    model.dataChanged.connect(lambda topLeft, bottomRight, roles: signals.append(("changed", topLeft.column(), topLeft.row(), bottomRight.row())))
+    model.f_setRows(f_rows([1, 2, 3, 4, 5]))
+    signals.clear()
+    return model, signals
+
+def test_unchanged(model):
+    model, signals = model
+    model.f_setRows(f_rows([1, 2, 3, 4, 5]))
+    assert signals == []
+
+def test_changed(model):
+    model, signals = model
+    model.f_setRows(f_rows([1, 2, 3, 4, 5], {2: -1.0, 3: -2.0, 5: 1.0}))
+
+    column = [name for name, _ in gui.PortfolioTableModel.columns].index("Change today")
+    assert signals == [("changed", column, 1, 2), ("changed", column, 4, 4)]
+    assert model.data(model.index(2, column)) == "-2.0"
+
+def test_removed_added(model):
+    model, signals = model
+    model.f_setRows(f_rows([1, 4, 5, 6, 7], {5: 2.0}))
+
+    column = [name for name, _ in gui.PortfolioTableModel.columns].index("Change today")
+    assert signals == [("removed", 1, 2), ("inserted", 3, 4), ("changed", column, 2, 2)]
+    assert [model.data(model.index(row, 0)) for row in range(model.rowCount())] == ["1", "4", "5", "6", "7"]
+
+def test_reordered(model):
+    ''' Rows in another order are not moved one by one, the table is rebuilt '''
+    model, signals = model
+    model.f_setRows(f_rows([2, 1, 3, 4, 5]))
+    assert signals == [("reset",)]